@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+二维码解码基准测试
+对截图目录中的每张图片，分别使用各个解码后端、预处理模式和解码策略运行 decoder.decode_frame，
+统计每帧耗时、识别成功率和内存峰值，可用于在非Windows环境下发现解码环节的性能或正确性回退
+
+用法:
+    python bench/decode_bench.py                      # 使用仓库自带的截图
+    python bench/decode_bench.py --frames D:/captures --json report.json
+    python bench/decode_bench.py --check               # 测试所有解码策略，有识别错误时以非0状态码退出
+    python bench/decode_bench.py --strategies single tiles+pyramid --workers 4
+"""
+
+import argparse
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from PIL import Image
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import decoder  # noqa: E402
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+def load_frames(frames_dir):
+    """读取截图及其期望结果，没有记录在 expected.json 中的截图只统计耗时"""
+    expected = {}
+    expected_path = os.path.join(frames_dir, "expected.json")
+    if os.path.exists(expected_path):
+        with open(expected_path, "r", encoding="utf-8") as f:
+            expected = json.load(f)
+
+    frames = []
+    for filename in sorted(os.listdir(frames_dir)):
+        if not filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        with Image.open(os.path.join(frames_dir, filename)) as im:
+            # 与 mss 截图转换后的格式保持一致
+            image = im.convert("RGB")
+        frames.append((filename, image, expected.get(filename)))
+    return frames
+
+
+def available_backends(candidates=None):
+    """检测当前环境可用的解码后端，candidates 为要检测的后端（默认为全部）"""
+    backends = []
+    blank = Image.new("RGB", (8, 8), "#FFFFFF")
+    for backend in candidates or decoder.BACKENDS:
+        try:
+            decoder.decode_image(blank, backend=backend)
+            backends.append(backend)
+        except Exception as e:
+            print(f"跳过解码后端 {backend}: {e}")
+    return backends
+
+
+def bench_frame(image, options, repeat):
+    """对单帧重复解码，返回 (解码结果, 耗时列表(毫秒), 内存峰值(KB))"""
+    timings = []
+    results = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = decoder.decode_frame(image, options)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    # 单独跑一次统计Python层的内存峰值，避免tracemalloc影响耗时
+    tracemalloc.start()
+    decoder.decode_frame(image, options)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return results, timings, peak / 1024
+
+
+def check_result(results, expected):
+    """判断获取流程会选中的二维码（最新的一个）是否正确，没有期望值时返回None"""
+    if expected is None:
+        return None
+    newest, _ = decoder.select_newest(results)
+    if expected["payload"] is None:
+        return newest is None
+    return (
+        newest is not None
+        and newest.data.decode("utf-8", errors="replace") == expected["payload"]
+    )
+
+
+def run(frames, backends, modes, strategies, tiling, repeat):
+    """
+    :param tiling: 切块解码参数 {workers, tiles, tile_overlap, scales}，与配置中的 decode 项相同
+    """
+    report = {"frames": len(frames), "repeat": repeat, "tiling": tiling, "results": []}
+    for backend, mode, strategy in itertools.product(backends, modes, strategies):
+        options = dict(tiling, backend=backend, preprocess=mode, strategy=strategy)
+        per_frame = []
+        for filename, image, expected in frames:
+            results, timings, peak_kb = bench_frame(image, options, repeat)
+            per_frame.append(
+                {
+                    "frame": filename,
+                    "size": list(image.size),
+                    "median_ms": round(statistics.median(timings), 3),
+                    "max_ms": round(max(timings), 3),
+                    "peak_kb": round(peak_kb, 1),
+                    "decoded": len(results),
+                    "success": check_result(results, expected),
+                }
+            )
+        checked = [f for f in per_frame if f["success"] is not None]
+        summary = {
+            "backend": backend,
+            "preprocess": mode,
+            "strategy": strategy,
+            "median_ms": round(statistics.median(f["median_ms"] for f in per_frame), 3),
+            "max_ms": round(max(f["max_ms"] for f in per_frame), 3),
+            "peak_kb": round(max(f["peak_kb"] for f in per_frame), 1),
+            "success_rate": (
+                round(sum(f["success"] for f in checked) / len(checked), 3)
+                if checked
+                else None
+            ),
+            "failures": [f["frame"] for f in checked if not f["success"]],
+            "per_frame": per_frame,
+        }
+        report["results"].append(summary)
+    return report
+
+
+def print_report(report):
+    print(
+        f"\n{'后端':<8} {'预处理':<8} {'解码策略':<12} {'中位耗时ms':>10} "
+        f"{'最大耗时ms':>10} {'内存峰值KB':>10} {'成功率':>8}"
+    )
+    for item in report["results"]:
+        rate = item["success_rate"]
+        rate = "-" if rate is None else f"{rate:.0%}"
+        print(
+            f"{item['backend']:<10} {item['preprocess']:<10} {item['strategy']:<16} "
+            f"{item['median_ms']:>12.2f} "
+            f"{item['max_ms']:>12.2f} {item['peak_kb']:>12.1f} {rate:>10}"
+        )
+        for failure in item["failures"]:
+            print(f"    识别失败: {failure}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QRmai 二维码解码基准测试")
+    parser.add_argument(
+        "--frames",
+        default=os.path.join(BENCH_DIR, "frames"),
+        help="截图目录（默认使用 bench/frames）",
+    )
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=decoder.BACKENDS,
+        help="要测试的解码后端（默认测试所有可用后端）",
+    )
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=decoder.PREPROCESS_MODES,
+        default=list(decoder.PREPROCESS_MODES),
+        help="要测试的预处理模式",
+    )
+    parser.add_argument(
+        "--strategies",
+        nargs="+",
+        choices=decoder.STRATEGIES,
+        help="要测试的解码策略，与 single 对比可评估切块并行解码的收益"
+        "（默认只测 single，--check 时默认测试所有策略）",
+    )
+    parser.add_argument("--workers", type=int, default=4, help="切块解码的线程数")
+    parser.add_argument("--tiles", type=int, default=2, help="切块时每行/列的块数")
+    parser.add_argument(
+        "--tile-overlap", type=float, default=0.25, help="相邻两块重叠部分的比例"
+    )
+    parser.add_argument(
+        "--scales",
+        nargs="+",
+        type=float,
+        default=[0.5],
+        help="pyramid 策略中整张截图的缩放比例",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="每帧重复解码次数")
+    parser.add_argument("--json", help="将完整结果以JSON格式写入该文件")
+    parser.add_argument(
+        "--check", action="store_true", help="存在识别失败的截图时以状态码1退出"
+    )
+    args = parser.parse_args()
+
+    frames = load_frames(args.frames)
+    if not frames:
+        print(f"目录中没有截图: {args.frames}")
+        return 1
+
+    backends = available_backends(args.backends)
+    if args.backends and len(backends) < len(args.backends):
+        # 明确指定的后端不可用时不测试其他后端，以免误以为测试了全部指定的后端
+        return 1
+    if not backends:
+        print("没有可用的解码后端")
+        return 1
+
+    tiling = {
+        "workers": args.workers,
+        "tiles": args.tiles,
+        "tile_overlap": args.tile_overlap,
+        "scales": args.scales,
+    }
+    # 切块解码需要合并各块的结果才能选出最新的二维码（如 *_two_codes.png），检查时一并覆盖
+    strategies = args.strategies or (
+        list(decoder.STRATEGIES) if args.check else ["single"]
+    )
+    report = run(frames, backends, args.modes, strategies, tiling, args.repeat)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        print(f"\n结果已写入 {args.json}")
+
+    if args.check and any(item["failures"] for item in report["results"]):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
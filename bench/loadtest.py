@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QRmai 压力测试
+在本进程内以模拟桌面后端（desktop_sim.py）启动Flask应用，模拟多个客户端同时访问
+二维码路由、/login 和 /settings，统计吞吐量、各路由延迟分位数，以及实际执行获取流程、
+复用进行中结果和命中缓存的次数。结果以JSON输出，便于对比不同版本
+
+用法:
+    python bench/loadtest.py                               # 20个客户端，每个5次请求
+    python bench/loadtest.py --clients 50 --requests 10 --cache-duration 60
+    python bench/loadtest.py --mix qr=1 --json report.json
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+
+def percentile(values, q):
+    """最近秩法计算分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def start_app(args):
+    """以模拟桌面后端启动应用，返回 (main模块, server, 基础URL)"""
+    # main.py 以当前目录为根目录读取配置和模板
+    os.chdir(ROOT_DIR)
+    sys.path.insert(0, ROOT_DIR)
+
+    import logging
+
+    import main
+    import decode_scheduler
+    import config_store
+    import desktop_sim
+    from werkzeug.serving import make_server
+
+    # 控制台只输出警告，详细日志仍写入logs目录
+    main.log_setup.set_console_level(logging.WARNING)
+
+    # 压测不应影响真实的解码耗时记录
+    decode_scheduler.STATS_FILE = os.path.join(
+        tempfile.gettempdir(), "qrmai_loadtest_decode_stats.json"
+    )
+    config = config_store.thaw(config_store.get())
+    decode_scheduler.reset(config["p1"], config["p2"])
+
+    # 只替换内存中的配置快照，不写入config.json
+    config["desktop_backend"] = "simulated"
+    config["cache_duration"] = args.cache_duration
+    if args.decoder:
+        config["decode"]["backend"] = args.decoder
+    if args.input_mode:
+        config["input_mode"] = args.input_mode
+    config_store.replace(config, save=False)
+    desktop_sim.configure(
+        qr_delay=(args.qr_delay_min, args.qr_delay_max),
+        window_missing_rate=args.window_missing_rate,
+    )
+
+    # 与正常启动一样先完成预热，避免首个请求的初始化耗时混入统计
+    main.warm_up()
+
+    server = make_server("127.0.0.1", 0, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return main, server, f"http://127.0.0.1:{server.server_port}"
+
+
+# 与二维码路径共用缓存、只返回内容或SVG的接口
+TOKEN_ROUTES = {"payload": "/payload", "svg": "/qr.svg"}
+
+
+def make_opener():
+    """每个客户端使用独立的cookie，模拟不同的浏览器会话"""
+    return urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+    )
+
+
+def send(opener, url, data=None, timeout=120):
+    """发送请求，返回 (状态码, 耗时毫秒)"""
+    body = urllib.parse.urlencode(data).encode() if data is not None else None
+    start = time.perf_counter()
+    try:
+        with opener.open(url, data=body, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = None
+    return status, (time.perf_counter() - start) * 1000
+
+
+def run_client(client_id, base_url, main, args, routes, weights):
+    """单个客户端：先登录，再按比例随机访问各路由"""
+    rng = random.Random(args.seed + client_id)
+    opener = make_opener()
+    config = main.config_store.get()
+    token = config["token"]
+    qr_route = config["qr_route"]
+    send(opener, f"{base_url}/login", data={"token": token})
+
+    records = []
+    for _ in range(args.requests):
+        route = rng.choices(routes, weights)[0]
+        if route == "qr":
+            url = f"{base_url}{qr_route}?token={urllib.parse.quote(token)}"
+        elif route in TOKEN_ROUTES:
+            url = f"{base_url}{TOKEN_ROUTES[route]}?token={urllib.parse.quote(token)}"
+        else:
+            url = f"{base_url}/{route}"
+        status, elapsed = send(opener, url)
+        records.append((route, status, elapsed))
+    return records
+
+
+def summarize(records, elapsed, main, args):
+    report = {
+        "params": {
+            "clients": args.clients,
+            "requests_per_client": args.requests,
+            "mix": args.mix,
+            "cache_duration": args.cache_duration,
+            "qr_delay": [args.qr_delay_min, args.qr_delay_max],
+            "window_missing_rate": args.window_missing_rate,
+            "decoder": main.config_store.get()["decode"]["backend"],
+            "input_mode": main.config_store.get()["input_mode"],
+        },
+        # 最近一次获取流程各阶段的耗时，用于对比前台/后台点击方式
+        "last_stage_ms": main.last_stage_timings,
+        "warmup_ms": main.warmup_state["ms"],
+        "duration_s": round(elapsed, 3),
+        "total_requests": len(records),
+        "throughput_rps": round(len(records) / elapsed, 3) if elapsed else None,
+        "routes": {},
+    }
+    for route in sorted({r[0] for r in records}):
+        latencies = [r[2] for r in records if r[0] == route]
+        statuses = {}
+        for r in records:
+            if r[0] == route:
+                statuses[str(r[1])] = statuses.get(str(r[1]), 0) + 1
+        report["routes"][route] = {
+            "count": len(latencies),
+            "errors": sum(1 for r in records if r[0] == route and r[1] != 200),
+            "status": statuses,
+            "p50_ms": round(percentile(latencies, 0.5), 3),
+            "p99_ms": round(percentile(latencies, 0.99), 3),
+            "max_ms": round(max(latencies), 3),
+            "mean_ms": round(statistics.mean(latencies), 3),
+        }
+    with main.metrics_lock:
+        report["pipeline"] = dict(main.metrics)
+    return report
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="QRmai 压力测试（模拟桌面后端）")
+    parser.add_argument("--clients", type=int, default=20, help="并发客户端数量")
+    parser.add_argument("--requests", type=int, default=5, help="每个客户端的请求次数")
+    parser.add_argument(
+        "--mix",
+        default="qr=8,login=1,settings=1",
+        help="各路由的请求比例，可选 qr/payload/svg/login/settings",
+    )
+    parser.add_argument(
+        "--cache-duration", type=float, default=0, help="二维码缓存时间（秒）"
+    )
+    parser.add_argument(
+        "--qr-delay-min", type=float, default=0.8, help="点击后二维码出现的最短延迟"
+    )
+    parser.add_argument(
+        "--qr-delay-max", type=float, default=1.6, help="点击后二维码出现的最长延迟"
+    )
+    parser.add_argument(
+        "--window-missing-rate",
+        type=float,
+        default=0.0,
+        help="模拟找不到微信窗口的概率",
+    )
+    parser.add_argument("--decoder", help="覆盖配置中的解码后端（pyzbar/opencv）")
+    parser.add_argument(
+        "--input-mode",
+        choices=("foreground", "background"),
+        help="覆盖配置中的点击方式（foreground/background）",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--json", help="将结果写入该文件（默认输出到标准输出）")
+    args = parser.parse_args()
+
+    mix = {}
+    for item in args.mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ("qr", "login", "settings", *TOKEN_ROUTES):
+            parser.error(f"未知的路由: {name}")
+        mix[name] = float(weight or 1)
+    routes, weights = list(mix), list(mix.values())
+
+    main, server, base_url = start_app(args)
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as executor:
+            futures = [
+                executor.submit(run_client, i, base_url, main, args, routes, weights)
+                for i in range(args.clients)
+            ]
+            records = [record for f in futures for record in f.result()]
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+
+    report = summarize(records, elapsed, main, args)
+    output = json.dumps(report, ensure_ascii=False, indent=4)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"结果已写入 {args.json}")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生成解码基准测试用的合成截图
+模拟不同显示器尺寸、系统缩放、深浅色主题下的微信聊天窗口，二维码消息位于聊天区域中
+生成结果写入 bench/frames/，并在 expected.json 中记录每张截图应识别出的二维码内容
+"""
+
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import qrcode
+from PIL import Image, ImageDraw, ImageFilter
+
+FRAMES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frames")
+
+THEMES = {
+    "light": {
+        "desktop": "#2B5797",
+        "sidebar": "#2E2E2E",
+        "list": "#E6E6E6",
+        "chat": "#F5F5F5",
+        "bubble": "#FFFFFF",
+        "text": "#C8C8C8",
+    },
+    "dark": {
+        "desktop": "#1B1B1B",
+        "sidebar": "#1F1F1F",
+        "list": "#262626",
+        "chat": "#111111",
+        "bubble": "#2C2C2C",
+        "text": "#4A4A4A",
+    },
+}
+
+# 文件名, 屏幕尺寸, 缩放比例, 主题, 二维码消息数量, 额外处理
+FRAME_SPECS = [
+    ("1920x1080_100_light", (1920, 1080), 1.0, "light", 1, None),
+    ("1920x1080_100_dark", (1920, 1080), 1.0, "dark", 1, None),
+    ("1920x1080_125_light", (1920, 1080), 1.25, "light", 1, None),
+    ("2560x1440_150_light", (2560, 1440), 1.5, "light", 1, None),
+    ("2560x1440_175_dark", (2560, 1440), 1.75, "dark", 1, None),
+    ("1366x768_100_light", (1366, 768), 1.0, "light", 1, None),
+    ("1920x1080_100_light_two_codes", (1920, 1080), 1.0, "light", 2, None),
+    ("1920x1080_100_light_blur", (1920, 1080), 1.0, "light", 1, "blur"),
+    ("1920x1080_100_dark_no_code", (1920, 1080), 1.0, "dark", 0, None),
+]
+
+
+def make_payload(rng, issued_at):
+    """生成与舞萌DX登录二维码格式一致的内容：SGWCMAID + 时间戳 + 64位十六进制"""
+    digest = "".join(rng.choice("0123456789ABCDEF") for _ in range(64))
+    return "SGWCMAID" + issued_at.strftime("%y%m%d%H%M%S") + digest
+
+
+def render_qr(payload, size):
+    """按整数模块尺寸绘制二维码，再平滑缩放到目标尺寸，接近微信中图片消息的显示效果"""
+    qr = qrcode.QRCode(border=2)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    qr_img = qr.make_image().convert("RGB")
+    return qr_img.resize((size, size), Image.BILINEAR)
+
+
+def render_frame(screen_size, scale, theme_name, payloads, effect=None):
+    """绘制一张包含微信窗口的整屏截图，payloads 中越靠后的二维码消息越靠下（越新）"""
+    theme = THEMES[theme_name]
+    frame = Image.new("RGB", screen_size, theme["desktop"])
+    draw = ImageDraw.Draw(frame)
+
+    def px(value):
+        return int(value * scale)
+
+    # 微信窗口，逻辑尺寸 960x720，居中偏左
+    win_w = min(px(960), screen_size[0] - 40)
+    win_h = min(px(720), screen_size[1] - 60)
+    left = (screen_size[0] - win_w) // 3
+    top = (screen_size[1] - win_h) // 2
+    sidebar_w = px(56)
+    list_w = px(250)
+    draw.rectangle([left, top, left + win_w, top + win_h], fill=theme["chat"])
+    draw.rectangle([left, top, left + sidebar_w, top + win_h], fill=theme["sidebar"])
+    draw.rectangle(
+        [left + sidebar_w, top, left + sidebar_w + list_w, top + win_h],
+        fill=theme["list"],
+    )
+
+    chat_left = left + sidebar_w + list_w + px(20)
+    # 聊天区域里的普通文字消息
+    y = top + px(60)
+    for i in range(3):
+        width = px(120 + 60 * i)
+        draw.rounded_rectangle(
+            [chat_left + px(44), y, chat_left + px(44) + width, y + px(36)],
+            radius=px(4),
+            fill=theme["bubble"],
+        )
+        draw.rectangle(
+            [chat_left + px(54), y + px(14), chat_left + px(34) + width, y + px(22)],
+            fill=theme["text"],
+        )
+        y += px(52)
+
+    # 二维码消息，从上到下依次变新
+    qr_size = px(180)
+    for payload in payloads:
+        bubble = [
+            chat_left + px(44),
+            y,
+            chat_left + px(44) + qr_size + px(24),
+            y + qr_size + px(24),
+        ]
+        draw.rounded_rectangle(bubble, radius=px(4), fill=theme["bubble"])
+        frame.paste(render_qr(payload, qr_size), (bubble[0] + px(12), y + px(12)))
+        y += qr_size + px(40)
+
+    if effect == "blur":
+        frame = frame.filter(ImageFilter.GaussianBlur(1))
+    return frame
+
+
+def main():
+    rng = random.Random(20241019)
+    issued_at = datetime(2024, 10, 19, 10, 0, 0)
+    os.makedirs(FRAMES_DIR, exist_ok=True)
+
+    expected = {}
+    for name, screen_size, scale, theme, code_count, effect in FRAME_SPECS:
+        payloads = []
+        for _ in range(code_count):
+            issued_at += timedelta(minutes=3)
+            payloads.append(make_payload(rng, issued_at))
+        frame = render_frame(screen_size, scale, theme, payloads, effect)
+        filename = f"synthetic_{name}.png"
+        frame.save(os.path.join(FRAMES_DIR, filename), format="PNG", optimize=True)
+        expected[filename] = {
+            # 截图中最新（最靠下）的二维码，没有二维码时为null
+            "payload": payloads[-1] if payloads else None,
+            "all_payloads": payloads,
+            "source": "synthetic",
+        }
+        print(f"已生成 {filename}")
+
+    # 保留已有的真实截图记录，只覆盖合成截图的条目
+    expected_path = os.path.join(FRAMES_DIR, "expected.json")
+    if os.path.exists(expected_path):
+        with open(expected_path, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        for filename, entry in previous.items():
+            if entry.get("source") != "synthetic":
+                expected[filename] = entry
+
+    with open(expected_path, "w", encoding="utf-8") as f:
+        json.dump(dict(sorted(expected.items())), f, ensure_ascii=False, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+二维码生成基准测试
+对比原来的生成方式（qrcode.make + 逐像素处理透明 + 缩放合成）与 encoder 模块在各生成库下的耗时、
+二维码版本和输出大小，并检查生成的图片能否被正确识别
+
+用法:
+    python bench/qr_bench.py
+    python bench/qr_bench.py --repeat 50 --error-correction L M --json report.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+
+from PIL import Image
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import decoder  # noqa: E402
+import encoder  # noqa: E402
+
+# 与舞萌DX登录二维码格式一致的内容
+PAYLOAD = "SGWCMAID241019100000" + "0123456789ABCDEF" * 4
+SKIN_QR_POINT = (106, 638)
+SKIN_QR_SIZE = 576
+
+
+def load_skin():
+    """使用仓库中的 skin.png，没有时生成一张同样布局的纯色皮肤"""
+    path = os.path.join(ROOT_DIR, "skin.png")
+    if os.path.exists(path):
+        with Image.open(path) as im:
+            return im.copy()
+    return Image.new("RGBA", (788, 1400), "#FCE4EC")
+
+
+def legacy_png(data, skin):
+    """原来的生成方式（与皮肤合成的新版格式）"""
+    import qrcode
+
+    img_io = BytesIO()
+    qr_img = qrcode.make(data)
+    if skin is None:
+        qr_img.save(img_io, format="PNG")
+        return img_io.getvalue()
+
+    skin = skin.copy()
+    qr_img = qr_img.convert("RGBA")
+    width, height = qr_img.size
+    for x in range(width):
+        for y in range(height):
+            r, g, b, a = qr_img.getpixel((x, y))
+            if r > 200 and g > 200 and b > 200:
+                qr_img.putpixel((x, y), (255, 255, 255, 0))
+    resized_qr = qr_img.resize((SKIN_QR_SIZE, SKIN_QR_SIZE))
+    skin.paste(resized_qr, SKIN_QR_POINT, mask=resized_qr)
+    skin.save(img_io, format="PNG")
+    return img_io.getvalue()
+
+
+def encoder_png(data, skin, engine, error_correction, border):
+    """encoder 模块的生成方式，与 main.render_qr_image 相同"""
+    img_io = BytesIO()
+    matrix = encoder.make_matrix(data, error_correction, engine)
+    if skin is None:
+        encoder.make_image(matrix).save(img_io, format="PNG")
+        return img_io.getvalue()
+
+    skin = skin.copy()
+    mask = encoder.make_mask(matrix, border, SKIN_QR_SIZE)
+    left, top = SKIN_QR_POINT
+    skin.paste((0, 0, 0), (left, top, left + SKIN_QR_SIZE, top + SKIN_QR_SIZE), mask)
+    skin.save(img_io, format="PNG")
+    return img_io.getvalue()
+
+
+def encoder_svg(data, engine, error_correction):
+    return encoder.make_svg(encoder.make_matrix(data, error_correction, engine))
+
+
+def timeit(func, repeat):
+    """重复执行，每次执行前清空矩阵缓存，返回 (最后一次的结果, 中位耗时ms)"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        encoder.make_matrix.cache_clear()
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(timings)
+
+
+def pick_backend():
+    blank = Image.new("RGB", (8, 8), "#FFFFFF")
+    for backend in ("pyzbar", "opencv"):
+        try:
+            decoder.decode_image(blank, backend=backend)
+            return backend
+        except Exception:
+            continue
+    return None
+
+
+def readable(png, backend):
+    """生成的图片能否被识别为 PAYLOAD，没有可用的解码后端时返回None"""
+    if backend is None:
+        return None
+    with Image.open(BytesIO(png)) as im:
+        image = im.convert("RGB")
+    return any(
+        obj.data.decode() == PAYLOAD for obj in decoder.decode_image(image, backend)
+    )
+
+
+def run(engines, levels, border, repeat):
+    skin = load_skin()
+    backend = pick_backend()
+    results = []
+
+    def add(name, output, median_ms, **extra):
+        item = {"case": name, "median_ms": round(median_ms, 3), "bytes": len(output)}
+        item.update(extra)
+        results.append(item)
+
+    png, ms = timeit(lambda: legacy_png(PAYLOAD, None), repeat)
+    add("legacy png", png, ms, readable=readable(png, backend))
+    png, ms = timeit(lambda: legacy_png(PAYLOAD, skin), max(1, repeat // 10))
+    add("legacy skin", png, ms, readable=readable(png, backend))
+
+    for engine in engines:
+        for level in levels:
+            tag = f"{engine}/{level}"
+            matrix, ms = timeit(
+                lambda: encoder.make_matrix(PAYLOAD, level, engine), repeat
+            )
+            version = (len(matrix) - 17) // 4
+            add(f"{tag} matrix", b"", ms, version=version, modules=len(matrix))
+            png, ms = timeit(
+                lambda: encoder_png(PAYLOAD, None, engine, level, border), repeat
+            )
+            add(f"{tag} png", png, ms, readable=readable(png, backend))
+            png, ms = timeit(
+                lambda: encoder_png(PAYLOAD, skin, engine, level, border), repeat
+            )
+            add(f"{tag} skin", png, ms, readable=readable(png, backend))
+            svg, ms = timeit(lambda: encoder_svg(PAYLOAD, engine, level), repeat)
+            add(f"{tag} svg", svg, ms)
+    return {"repeat": repeat, "border": border, "backend": backend, "results": results}
+
+
+def print_report(report):
+    print(
+        f"\n{'用例':<18} {'中位耗时ms':>10} {'输出字节':>10} {'版本':>6} {'可识别':>6}"
+    )
+    for item in report["results"]:
+        version = item.get("version", "")
+        readable_text = {True: "是", False: "否", None: "-"}[item.get("readable")]
+        print(
+            f"{item['case']:<20} {item['median_ms']:>12.3f} {item['bytes']:>12} "
+            f"{version:>8} {readable_text:>6}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QRmai 二维码生成基准测试")
+    parser.add_argument(
+        "--engines",
+        nargs="+",
+        choices=encoder.ENGINES[1:],
+        help="要测试的生成库（默认测试所有已安装的）",
+    )
+    parser.add_argument(
+        "--error-correction",
+        nargs="+",
+        choices=encoder.ERROR_CORRECTION_LEVELS,
+        default=["L", "M"],
+        help="要测试的纠错级别",
+    )
+    parser.add_argument(
+        "--border", type=int, default=2, help="与皮肤合成时四周空白的宽度"
+    )
+    parser.add_argument("--repeat", type=int, default=20, help="每个用例的重复次数")
+    parser.add_argument("--json", help="将完整结果以JSON格式写入该文件")
+    args = parser.parse_args()
+
+    engines = args.engines or [
+        engine
+        for engine in encoder.ENGINES[1:]
+        if engine == "qrcode" or encoder.resolve_engine() == engine
+    ]
+    report = run(engines, args.error_correction, args.border, args.repeat)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        print(f"\n结果已写入 {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
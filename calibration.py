@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QRmai 点击位置校准模块
+p1/p2 是屏幕上的绝对坐标，微信窗口移动、分辨率或缩放比例变化后就会点错位置，每次请求都要等到解码超时。
+开启校准后，点击位置按相对于微信窗口左上角的偏移保存，窗口移动后自动跟随；
+点击生效时截取点击位置周围的图像作为模板，点击后画面没有变化（p1）或没有出现二维码（p2）时，
+在窗口截图中匹配模板重新定位（需要安装opencv-python）。
+每个档案（见配置中的 profiles）的偏移和模板单独保存，全局配置的模板在 calibration/ 下，
+档案的模板在 calibration/<档案名称>/ 下
+"""
+
+import json
+import logging
+import os
+import threading
+
+from PIL import Image, ImageChops, ImageStat
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "calibration.json"  # 窗口内偏移的记录文件
+TEMPLATE_DIR = "calibration"  # 模板图片目录，可手动替换其中的 p1.png / p2.png
+TEMPLATE_RADIUS = 32  # 模板为点击位置周围 64x64 的区域
+COMPARE_SIZE = (160, 120)  # 比较画面变化前缩小到的尺寸
+CHANGE_RATIO = 0.002  # 点击前后窗口截图中有变化的像素比例小于该值时认为点击没有生效
+MATCH_MARGIN = 0.03  # p2 取与最高相似度相差不超过该值的位置中最下方的一个
+
+_lock = threading.Lock()
+_state = None
+_templates = {}  # {(档案名称, 名称): 灰度模板图像}
+_opencv_missing_logged = False
+
+
+def _empty_state(p1=None, p2=None):
+    return {
+        "p1": list(p1) if p1 else None,  # 记录偏移时配置中的坐标
+        "p2": list(p2) if p2 else None,
+        "offsets": {},  # {名称: [相对窗口左上角的x, y]}
+        "stale": [],  # 上一次点击没有生效、下次需要重新定位的位置
+    }
+
+
+def _load_state():
+    """读取保存的偏移（只在第一次调用时读取文件），档案的记录在 profiles 中"""
+    global _state
+    if _state is None:
+        _state = _empty_state()
+        if os.path.exists(STATE_FILE):
+            try:
+                with open(STATE_FILE, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data.get("offsets"), dict):
+                    _state = data
+            except Exception:
+                pass
+        _state.setdefault("profiles", {})
+    return _state
+
+
+def _profile_state(profile):
+    """档案的校准记录，profile 为None时为全局配置的记录"""
+    state = _load_state()
+    if profile is None:
+        return state
+    return state["profiles"].setdefault(profile, _empty_state())
+
+
+def _save_state():
+    try:
+        with open(STATE_FILE, "w", encoding="utf-8") as f:
+            json.dump(_state, f, ensure_ascii=False, indent=4)
+    except Exception:
+        pass
+
+
+def _template_path(name, profile=None):
+    if profile is None:
+        return os.path.join(TEMPLATE_DIR, name + ".png")
+    return os.path.join(TEMPLATE_DIR, profile, name + ".png")
+
+
+def _state_for(p1, p2, profile):
+    """获取与配置中p1/p2对应的校准记录，手动修改坐标后丢弃旧的偏移和模板"""
+    global _state
+    state = _profile_state(profile)
+    if state.get("p1") != list(p1) or state.get("p2") != list(p2):
+        if profile is None:
+            profiles = state["profiles"]
+            _state = state = _empty_state(p1, p2)
+            state["profiles"] = profiles
+        else:
+            state = _state["profiles"][profile] = _empty_state(p1, p2)
+        for name in ("p1", "p2"):
+            _templates.pop((profile, name), None)
+            try:
+                os.remove(_template_path(name, profile))
+            except OSError:
+                pass
+        _save_state()
+    return state
+
+
+def resolve(p1, p2, window_rect, profile=None):
+    """
+    根据微信窗口当前的位置计算本次的点击坐标
+    第一次调用时以配置中的坐标和当前窗口位置计算偏移，之后窗口移动时点击位置随之移动
+    :param window_rect: 微信窗口区域 (left, top, right, bottom)，为None时直接使用配置中的坐标
+    :param profile: 档案名称，为None时为全局配置
+    :return: (p1, p2)
+    """
+    if window_rect is None:
+        return tuple(p1), tuple(p2)
+    left, top = window_rect[0], window_rect[1]
+    points = []
+    with _lock:
+        state = _state_for(p1, p2, profile)
+        for name, configured in (("p1", p1), ("p2", p2)):
+            offset = state["offsets"].get(name)
+            if offset is None:
+                offset = state["offsets"][name] = [
+                    configured[0] - left,
+                    configured[1] - top,
+                ]
+                _save_state()
+            points.append((left + offset[0], top + offset[1]))
+    return tuple(points)
+
+
+def frame_changed(before, after):
+    """比较点击前后的窗口截图，判断点击是否生效"""
+    if before.size != after.size:
+        return True
+    small_before = before.convert("L").resize(COMPARE_SIZE, Image.BILINEAR)
+    small_after = after.convert("L").resize(COMPARE_SIZE, Image.BILINEAR)
+    # 灰度差超过16的像素视为有变化，忽略缩放和抗锯齿带来的细微差别
+    changed = ImageChops.difference(small_before, small_after).point(
+        lambda v: 255 if v > 16 else 0
+    )
+    ratio = ImageStat.Stat(changed).mean[0] / 255
+    return ratio >= CHANGE_RATIO
+
+
+def _get_template(name, profile):
+    template = _templates.get((profile, name))
+    path = _template_path(name, profile)
+    if template is None and os.path.exists(path):
+        with Image.open(path) as im:
+            template = _templates[(profile, name)] = im.convert("L")
+    return template
+
+
+def record(name, image, point, window_rect, profile=None):
+    """
+    点击生效后截取点击位置周围的图像作为模板（已有模板时不覆盖）
+    :param image: 点击前的窗口截图，与 window_rect 对应
+    """
+    with _lock:
+        if _get_template(name, profile) is not None:
+            return
+        x, y = point[0] - window_rect[0], point[1] - window_rect[1]
+        box = (
+            x - TEMPLATE_RADIUS,
+            y - TEMPLATE_RADIUS,
+            x + TEMPLATE_RADIUS,
+            y + TEMPLATE_RADIUS,
+        )
+        if box[0] < 0 or box[1] < 0 or box[2] > image.width or box[3] > image.height:
+            return
+        template = image.crop(box).convert("L")
+        path = _template_path(name, profile)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            template.save(path)
+        except OSError as e:
+            logger.warning(f"保存校准模板 {name} 失败: {e}")
+        _templates[(profile, name)] = template
+    logger.info(f"已记录 {name} 的校准模板")
+
+
+def _match(image, template, threshold, lowest):
+    """
+    在截图中匹配模板，返回 (模板中心在截图中的坐标, 相似度)，没有达到阈值的位置时返回None
+    :param lowest: 有多个相似的位置时取最下方的一个（聊天中最新的消息在最下方）
+    """
+    import cv2
+    import numpy
+
+    haystack = numpy.asarray(image.convert("L"))
+    needle = numpy.asarray(template)
+    if needle.shape[0] > haystack.shape[0] or needle.shape[1] > haystack.shape[1]:
+        return None
+    scores = cv2.matchTemplate(haystack, needle, cv2.TM_CCOEFF_NORMED)
+    _, score, _, (x, y) = cv2.minMaxLoc(scores)
+    if score < threshold:
+        return None
+    if lowest:
+        # 同样的消息卡片相似度几乎相同，只在与最高相似度接近的位置中挑选
+        ys, xs = numpy.nonzero(scores >= score - MATCH_MARGIN)
+        index = ys.argmax()
+        x, y = int(xs[index]), int(ys[index])
+        score = float(scores[y, x])
+    return (x + template.width // 2, y + template.height // 2), score
+
+
+def relocate(name, image, window_rect, threshold=0.8, profile=None):
+    """
+    在窗口截图中匹配模板，重新定位点击位置并更新偏移
+    :return: 新的点击坐标，没有模板、未安装opencv或匹配失败时返回None
+    """
+    global _opencv_missing_logged
+    with _lock:
+        template = _get_template(name, profile)
+    if template is None:
+        logger.warning(f"{name} 没有校准模板，无法重新定位")
+        return None
+    try:
+        found = _match(image, template, threshold, lowest=(name == "p2"))
+    except ImportError:
+        if not _opencv_missing_logged:
+            logger.warning("未安装opencv-python，无法按模板重新定位点击位置")
+            _opencv_missing_logged = True
+        return None
+    if found is None:
+        logger.warning(f"在微信窗口中没有找到与 {name} 模板相似的位置")
+        return None
+
+    (x, y), score = found
+    with _lock:
+        state = _profile_state(profile)
+        state["offsets"][name] = [x, y]
+        if name in state["stale"]:
+            state["stale"].remove(name)
+        _save_state()
+    point = (window_rect[0] + x, window_rect[1] + y)
+    logger.info(f"已重新定位 {name}: {point}（相似度 {score:.2f}）")
+    return point
+
+
+def mark_stale(name, profile=None):
+    """点击后没有得到预期的结果，下次获取时重新定位该位置"""
+    with _lock:
+        state = _profile_state(profile)
+        if name not in state["stale"]:
+            state["stale"].append(name)
+            _save_state()
+
+
+def is_stale(name, profile=None):
+    with _lock:
+        return name in _profile_state(profile)["stale"]
+
+
+def get_status(profile=None):
+    """校准状态，用于 /metrics"""
+    with _lock:
+        state = _profile_state(profile)
+        return {
+            "offsets": dict(state["offsets"]),
+            "stale": list(state["stale"]),
+            "templates": [
+                name
+                for name in ("p1", "p2")
+                if os.path.exists(_template_path(name, profile))
+            ],
+        }
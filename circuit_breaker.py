@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QRmai 熔断器
+微信退出登录、界面布局变化等情况下，获取流程会连续失败，每次都要完整地点击、等待解码超时并结束小程序进程。
+连续失败达到阈值后熔断器打开，请求直接返回错误图片和 Retry-After；
+打开期间由后台线程按退避时间（逐次翻倍）执行一次试探（半开），试探成功后自动关闭。
+每个档案有各自的熔断器，某个档案连续失败不影响其他档案
+"""
+
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"  # 正常执行获取流程
+OPEN = "open"  # 直接返回错误，等待后台试探
+HALF_OPEN = "half_open"  # 后台试探进行中
+
+FAILURE_THRESHOLD = 3  # 连续失败多少次后打开，0为不启用熔断
+BASE_DELAY = 30  # 第一次试探前等待的时间（秒）
+MAX_DELAY = 600  # 试探等待时间的上限（秒）
+
+_breakers_lock = threading.Lock()
+_breakers = []  # 已创建的熔断器，关闭熔断功能时全部关闭
+
+
+def configure(failure_threshold=None, base_delay=None, max_delay=None):
+    """调整所有熔断器共用的熔断参数"""
+    global FAILURE_THRESHOLD, BASE_DELAY, MAX_DELAY
+    if failure_threshold is not None:
+        FAILURE_THRESHOLD = int(failure_threshold)
+    if base_delay is not None:
+        BASE_DELAY = base_delay
+    if max_delay is not None:
+        MAX_DELAY = max_delay
+    if not FAILURE_THRESHOLD:
+        with _breakers_lock:
+            breakers = list(_breakers)
+        for breaker in breakers:
+            breaker.record_success()
+
+
+class CircuitBreaker:
+    """一个档案的熔断器，probe 为半开时在后台执行的试探函数"""
+
+    def __init__(self, probe=None, name=None):
+        self.name = name  # 档案名称，用于日志
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._open_count = 0  # 本次打开后试探失败的次数，用于计算退避时间
+        self._retry_at = 0  # 下一次试探的时间
+        self._probe = probe
+        self._probe_thread = None
+        with _breakers_lock:
+            _breakers.append(self)
+
+    def _label(self):
+        return f"（档案 {self.name}）" if self.name else ""
+
+    def check(self):
+        """
+        判断是否允许执行获取流程
+        :return: (是否允许, 距离下一次试探的秒数)
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True, 0
+            return False, max(1, math.ceil(self._retry_at - time.time()))
+
+    def record_success(self):
+        """获取流程成功，关闭熔断器"""
+        with self._lock:
+            self._consecutive_failures = 0
+            if self._state != CLOSED:
+                logger.info(f"获取二维码成功，熔断器已关闭{self._label()}")
+            self._state = CLOSED
+            self._open_count = 0
+
+    def record_failure(self):
+        """获取流程失败，连续失败达到阈值或试探失败时打开熔断器"""
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._state == HALF_OPEN:
+                self._open_count += 1
+            elif self._state == OPEN or not FAILURE_THRESHOLD:
+                return
+            elif self._consecutive_failures < FAILURE_THRESHOLD:
+                return
+
+            delay = min(MAX_DELAY, BASE_DELAY * 2**self._open_count)
+            self._state = OPEN
+            self._retry_at = time.time() + delay
+            logger.warning(
+                f"获取二维码已连续失败{self._consecutive_failures}次，"
+                f"熔断器打开{self._label()}，{delay}秒后在后台重试"
+            )
+            self._start_probe_thread()
+
+    def _start_probe_thread(self):
+        """启动后台试探线程（调用时需持有 self._lock）"""
+        if self._probe is None or (
+            self._probe_thread is not None and self._probe_thread.is_alive()
+        ):
+            return
+        self._probe_thread = threading.Thread(
+            target=self._probe_loop, name="circuit-probe", daemon=True
+        )
+        self._probe_thread.start()
+
+    def _probe_loop(self):
+        """等待到试探时间后执行一次试探，直到熔断器关闭"""
+        while True:
+            with self._lock:
+                if self._state == CLOSED:
+                    return
+                delay = self._retry_at - time.time()
+                if delay <= 0:
+                    self._state = HALF_OPEN
+            if delay > 0:
+                time.sleep(delay)
+                continue
+
+            logger.info(f"熔断器半开，在后台尝试获取二维码{self._label()}")
+            try:
+                # 试探函数执行获取流程，并通过 record_success/record_failure 报告结果
+                self._probe()
+            except Exception as e:
+                logger.error(f"熔断器试探出错: {e}")
+            with self._lock:
+                reported = self._state != HALF_OPEN
+            if not reported:
+                # 试探出错或没有报告结果，按失败处理
+                self.record_failure()
+
+    def get_status(self):
+        """熔断器状态，用于 /metrics"""
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._consecutive_failures,
+                "retry_in": (
+                    round(max(0, self._retry_at - time.time()), 1)
+                    if self._state != CLOSED
+                    else None
+                ),
+            }
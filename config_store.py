@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QRmai 配置管理模块
+配置以只读快照的形式保存：修改配置时生成新的快照并整体替换，正在执行的流程仍使用开始时取得的快照；
+写入配置文件时先写临时文件再重命名，后台线程监视 config.json 的修改时间，手动修改后自动重新加载
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+import log_setup
+
+logger = logging.getLogger(__name__)
+
+WATCH_INTERVAL = 1.0  # 检查配置文件是否被修改的间隔（秒）
+
+CONFIG_PATH = "config.json"
+
+# 与 decoder.STRATEGIES 一致，这里不导入 decoder/encoder，以免启动时就加载PIL
+DECODE_STRATEGIES = ("single", "tiles", "pyramid", "tiles+pyramid")
+# 与 encoder.ENGINES / encoder.ERROR_CORRECTION_LEVELS 一致
+QR_ENGINES = ("auto", "qrcode", "segno")
+QR_ERROR_CORRECTION_LEVELS = ("L", "M", "Q", "H")
+# foreground 激活窗口并移动鼠标点击，background 向窗口发送点击消息并截取窗口自身的内容
+INPUT_MODES = ("foreground", "background")
+
+# 档案（profiles）中可以单独设置的配置项，对象类型的项只需写出与全局配置不同的子项
+PROFILE_KEYS = (
+    "p1",
+    "p2",
+    "cache_duration",
+    "decode",
+    "qr",
+    "skin_format",
+    "custom_skin_path",
+    "custom_skin_qrcode_size",
+    "custom_skin_qrcode_point",
+    "calibration",
+)
+PIPELINE_MARGIN = (
+    20  # 流程总时限至少比 decode.time 多出的秒数（查找窗口、点击、结束进程等）
+)
+PROFILE_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")  # 档案名称会出现在路径中
+
+_lock = threading.Lock()
+_snapshot = None
+_file_state = None  # 最近一次读取/写入时配置文件的 (修改时间, 大小)
+_listeners = []
+_watcher_thread = None
+_profile_views = (None, {})  # (生成时使用的快照, {档案名称: 合并后的快照})
+
+
+class FrozenDict(dict):
+    """只读字典，任何修改操作都会抛出TypeError"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("配置快照是只读的，请通过 config_store.replace 修改配置")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+
+def freeze(value):
+    """将配置转换为只读快照：dict 转为 FrozenDict，list 转为 tuple"""
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """将只读快照转换回可修改的普通 dict/list，用于生成新的配置"""
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(v) for v in value]
+    return value
+
+
+def get_default_config():
+    """获取默认配置项"""
+    return {
+        "p1": [1087, 799],
+        "p2": [945, 682],
+        "token": "qrmai",
+        "host": "0.0.0.0",
+        "port": 5000,
+        "qr_route": "/qrmai",  # 二维码访问路径
+        "qr_route_grace_period": 300,  # 修改二维码访问路径后，旧路径继续可用的时间（秒）
+        "cache_duration": 60,
+        "standalone_mode": False,
+        "decode": {
+            "time": 10,
+            "retry_count": 10,
+            "adaptive": True,
+            "backend": "pyzbar",
+            "preprocess": "none",
+            "strategy": "single",  # single 整张截图解码一次，其他为切块/缩放后在线程池中同时解码
+            "workers": 4,  # 切块解码的线程数
+            "tiles": 2,  # 切块时每行/列的块数
+            "tile_overlap": 0.25,  # 相邻两块重叠部分占块边长的比例
+            "scales": [0.5],  # pyramid 策略中整张截图的缩放比例
+            "stale_tolerance": 5,  # 二维码生成时间早于点击时间超过该秒数时视为旧二维码（时间精确到秒，另留出时钟误差）
+        },
+        "qr": {  # 二维码生成
+            "engine": "auto",  # auto / qrcode / segno，auto 时安装了 segno 就使用 segno
+            "error_correction": "L",  # 纠错级别 L / M / Q / H
+            "border": 2,  # 与皮肤合成时四周空白的宽度（模块数），不使用皮肤时固定为4
+        },
+        "skin_format": "new",
+        "custom_skin_path": "./skin.png",
+        "custom_skin_qrcode_size": 576,
+        "custom_skin_qrcode_point": [106, 638],
+        "dev_mode": False,
+        "desktop_backend": "windows",
+        "input_mode": "foreground",  # foreground / background，background 时不激活窗口、不移动鼠标
+        "update_check_interval": 3600,  # 后台检查更新的间隔（秒），0为只在启动时检查
+        "stage_timeouts": {  # 获取流程各阶段的时限（秒），超时后中止本次流程
+            "pipeline": 30,  # 整个流程的总时限，需要大于 decode.time
+            "find_window": 5,
+            "activate": 5,
+            "click": 2,
+            "minimize": 2,
+            "capture": 3,
+            "kill": 5,
+        },
+        "circuit_breaker": {
+            "failure_threshold": 3,  # 连续失败多少次后暂停获取，0为不启用
+            "base_delay": 30,  # 暂停后第一次后台重试的等待时间（秒），之后逐次翻倍
+            "max_delay": 600,  # 后台重试等待时间的上限（秒）
+        },
+        "calibration": {
+            "enabled": False,  # 点击位置跟随微信窗口移动，点击没有生效时按模板重新定位
+            "match_threshold": 0.8,  # 模板匹配的相似度阈值（0~1）
+        },
+        # 多个游戏的档案 {名称: 与全局配置不同的项}，通过 <qr_route>/<名称> 获取
+        "profiles": {},
+        "log": {
+            "format": "text",  # text 或 json（每行一条JSON）
+            "retention_days": 14,  # 日志保留天数，0为永久保留
+            "rate_limit": 10,  # 相同INFO日志的最短记录间隔（秒），0为不限制
+        },
+    }
+
+
+def _max_decode_time(config):
+    """全局配置和各档案中最长的 decode.time，取值不合法时忽略（由 validate 报错）"""
+    times = []
+    for source in (config, *_profiles_of(config)):
+        decode = source.get("decode")
+        value = decode.get("time") if isinstance(decode, dict) else None
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            times.append(value)
+    return max(times, default=0)
+
+
+def _profiles_of(config):
+    profiles = config.get("profiles")
+    if not isinstance(profiles, dict):
+        return []
+    return [profile for profile in profiles.values() if isinstance(profile, dict)]
+
+
+def default_pipeline_timeout(config):
+    """没有设置流程总时限时的默认值：默认的30秒，decode.time 较长时为 decode.time + PIPELINE_MARGIN"""
+    default = get_default_config()["stage_timeouts"]["pipeline"]
+    return max(default, _max_decode_time(config) + PIPELINE_MARGIN)
+
+
+def ensure_config_completeness(config):
+    """确保配置项完整，缺失的项用默认值补全"""
+    default_config = get_default_config()
+    timeouts = config.get("stage_timeouts")
+    pipeline_missing = not isinstance(timeouts, dict) or "pipeline" not in timeouts
+
+    # 检查并补全顶层配置项
+    for key, default_value in default_config.items():
+        if key not in config:
+            config[key] = default_value
+        # 对于嵌套字典，也需要检查完整性
+        elif isinstance(default_value, dict) and isinstance(config[key], dict):
+            for sub_key, sub_default_value in default_value.items():
+                if sub_key not in config[key]:
+                    config[key][sub_key] = sub_default_value
+
+    # 流程总时限需要大于 decode.time，没有设置时按 decode.time 推算
+    if pipeline_missing and isinstance(config["stage_timeouts"], dict):
+        config["stage_timeouts"]["pipeline"] = default_pipeline_timeout(config)
+    return config
+
+
+def _fix_pipeline_timeout(config):
+    """
+    配置文件中的流程总时限不大于 decode.time 时改为推算的默认值并给出警告，
+    以免旧的配置文件在启动或重新加载时因为这条规则无法读取（通过设置页面提交时仍然会被拒绝）
+    """
+    timeouts = config.get("stage_timeouts")
+    if not isinstance(timeouts, dict):
+        return config
+    pipeline = timeouts.get("pipeline")
+    if isinstance(pipeline, (int, float)) and pipeline <= _max_decode_time(config):
+        timeouts["pipeline"] = default_pipeline_timeout(config)
+        logger.warning(
+            f"stage_timeouts.pipeline（{pipeline}）不大于 decode.time，"
+            f"已改为 {timeouts['pipeline']}"
+        )
+    return config
+
+
+def merge_profile(config, profile):
+    """
+    在全局配置的副本上覆盖档案中设置的项，对象类型的项按子项覆盖
+    :return: 合并后的配置dict（不含 profiles）
+    """
+    merged = thaw(config)
+    merged["profiles"] = {}
+    for key, value in thaw(profile).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key].update(value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def get_profile(config, name):
+    """
+    获取档案的配置快照，同一个快照中的档案只合并一次
+    :param name: 档案名称，为None时返回 config 本身
+    :raise KeyError: 档案不存在
+    """
+    global _profile_views
+    if name is None:
+        return config
+    source, views = _profile_views
+    if source is not config:
+        source, views = config, {}
+        _profile_views = (source, views)
+    view = views.get(name)
+    if view is None:
+        view = views[name] = freeze(merge_profile(config, config["profiles"][name]))
+    return view
+
+
+def validate_profiles(config):
+    """检查档案的名称和可单独设置的项，并按合并后的配置逐个校验"""
+    profiles = config["profiles"]
+    if not isinstance(profiles, dict):
+        raise ValueError("profiles 必须是对象")
+    for name, profile in profiles.items():
+        if not PROFILE_NAME_PATTERN.match(name):
+            raise ValueError(f"档案名称只能包含字母、数字、- 和 _，当前为 {name}")
+        if not isinstance(profile, dict):
+            raise ValueError(f"profiles.{name} 必须是对象")
+        for key in profile:
+            if key not in PROFILE_KEYS:
+                raise ValueError(f"profiles.{name} 中不能设置 {key}")
+        try:
+            validate(merge_profile(config, profile))
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"profiles.{name} 不合法: {e}") from None
+        except ValueError as e:
+            raise ValueError(f"profiles.{name} 中的 {e}") from None
+
+
+def validate(config):
+    """检查配置项的类型和取值，不合法时抛出ValueError"""
+    for key in ("p1", "p2", "custom_skin_qrcode_point"):
+        point = config[key]
+        if not (
+            isinstance(point, (list, tuple))
+            and len(point) == 2
+            and all(isinstance(v, int) for v in point)
+        ):
+            raise ValueError(f"{key} 必须是两个整数坐标，当前为 {point}")
+    if config["input_mode"] not in INPUT_MODES:
+        raise ValueError(
+            f"input_mode 只能是 {' / '.join(INPUT_MODES)}，当前为 {config['input_mode']}"
+        )
+    if not isinstance(config["token"], str) or not config["token"]:
+        raise ValueError("token 不能为空")
+    if not isinstance(config["qr_route"], str) or not config["qr_route"].startswith(
+        "/"
+    ):
+        raise ValueError(f"qr_route 必须以 / 开头，当前为 {config['qr_route']}")
+    if not isinstance(config["port"], int) or not 0 < config["port"] < 65536:
+        raise ValueError(f"port 必须是1~65535之间的整数，当前为 {config['port']}")
+    for key in (
+        "cache_duration",
+        "update_check_interval",
+        "custom_skin_qrcode_size",
+        "qr_route_grace_period",
+    ):
+        if not isinstance(config[key], (int, float)) or config[key] < 0:
+            raise ValueError(f"{key} 不能小于0，当前为 {config[key]}")
+    decode = config["decode"]
+    if not isinstance(decode, dict):
+        raise ValueError("decode 必须是对象")
+    if not isinstance(decode["time"], (int, float)) or decode["time"] <= 0:
+        raise ValueError(f"decode.time 必须大于0，当前为 {decode['time']}")
+    if not isinstance(decode["retry_count"], int) or decode["retry_count"] < 1:
+        raise ValueError(
+            f"decode.retry_count 必须是正整数，当前为 {decode['retry_count']}"
+        )
+    if decode["strategy"] not in DECODE_STRATEGIES:
+        raise ValueError(
+            f"decode.strategy 只能是 {' / '.join(DECODE_STRATEGIES)}，当前为 {decode['strategy']}"
+        )
+    for key in ("workers", "tiles"):
+        if not isinstance(decode[key], int) or decode[key] < 1:
+            raise ValueError(f"decode.{key} 必须是正整数，当前为 {decode[key]}")
+    if (
+        not isinstance(decode["tile_overlap"], (int, float))
+        or not 0 <= decode["tile_overlap"] < 1
+    ):
+        raise ValueError(
+            f"decode.tile_overlap 必须在0~1之间，当前为 {decode['tile_overlap']}"
+        )
+    if (
+        not isinstance(decode["stale_tolerance"], (int, float))
+        or decode["stale_tolerance"] < 0
+    ):
+        raise ValueError(
+            f"decode.stale_tolerance 不能小于0，当前为 {decode['stale_tolerance']}"
+        )
+    scales = decode["scales"]
+    if (
+        not isinstance(scales, (list, tuple))
+        or not scales
+        or not all(isinstance(v, (int, float)) and 0 < v <= 1 for v in scales)
+    ):
+        raise ValueError(f"decode.scales 必须是0~1之间的缩放比例列表，当前为 {scales}")
+    qr = config["qr"]
+    if not isinstance(qr, dict) or qr["engine"] not in QR_ENGINES:
+        raise ValueError(f"qr.engine 只能是 {' / '.join(QR_ENGINES)}")
+    if qr["error_correction"] not in QR_ERROR_CORRECTION_LEVELS:
+        raise ValueError(
+            f"qr.error_correction 只能是 {' / '.join(QR_ERROR_CORRECTION_LEVELS)}"
+        )
+    if not isinstance(qr["border"], int) or qr["border"] < 0:
+        raise ValueError(f"qr.border 不能小于0，当前为 {qr['border']}")
+    timeouts = config["stage_timeouts"]
+    if not isinstance(timeouts, dict):
+        raise ValueError("stage_timeouts 必须是对象")
+    for key, value in timeouts.items():
+        if not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError(f"stage_timeouts.{key} 必须大于0，当前为 {value}")
+    if timeouts["pipeline"] <= decode["time"]:
+        raise ValueError("stage_timeouts.pipeline 必须大于 decode.time")
+    breaker = config["circuit_breaker"]
+    if not isinstance(breaker, dict):
+        raise ValueError("circuit_breaker 必须是对象")
+    for key in ("failure_threshold", "base_delay", "max_delay"):
+        if not isinstance(breaker[key], (int, float)) or breaker[key] < 0:
+            raise ValueError(f"circuit_breaker.{key} 不能小于0，当前为 {breaker[key]}")
+    calibration = config["calibration"]
+    if not isinstance(calibration, dict) or not isinstance(
+        calibration["enabled"], bool
+    ):
+        raise ValueError("calibration.enabled 必须是 true 或 false")
+    threshold = calibration["match_threshold"]
+    if not isinstance(threshold, (int, float)) or not 0 < threshold <= 1:
+        raise ValueError(
+            f"calibration.match_threshold 必须在0~1之间，当前为 {threshold}"
+        )
+    log = config["log"]
+    if not isinstance(log, dict) or log["format"] not in log_setup.LOG_FORMATS:
+        raise ValueError("log.format 只能是 text 或 json")
+    for key in ("retention_days", "rate_limit"):
+        if not isinstance(log[key], (int, float)) or log[key] < 0:
+            raise ValueError(f"log.{key} 不能小于0，当前为 {log[key]}")
+    validate_profiles(config)
+    return config
+
+
+def make_version(token):
+    """根据token和配置文件修改时间生成配置版本标识，用于增强认证安全性"""
+    try:
+        return hashlib.md5(
+            (token + str(os.path.getmtime(CONFIG_PATH))).encode()
+        ).hexdigest()
+    except FileNotFoundError:
+        return hashlib.md5((token + str(time.time())).encode()).hexdigest()
+
+
+def _stat_file():
+    try:
+        stat = os.stat(CONFIG_PATH)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _read_file():
+    """
+    读取配置文件并补全、校验
+    :return: (配置dict, 是否缺少配置项需要写回文件)
+    """
+    file_config = {}
+    if os.path.exists(CONFIG_PATH):
+        with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+            file_config = json.load(f)
+
+    loaded = validate(
+        _fix_pipeline_timeout(
+            ensure_config_completeness(json.loads(json.dumps(file_config)))
+        )
+    )
+    return loaded, loaded != file_config
+
+
+def _write_file(config):
+    """先写入同目录下的临时文件，再重命名替换配置文件，避免写到一半时被读取"""
+    directory = os.path.dirname(os.path.abspath(CONFIG_PATH))
+    fd, temp_path = tempfile.mkstemp(
+        prefix=".config-", suffix=".json.tmp", dir=directory
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, CONFIG_PATH)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _swap(new_config):
+    """替换当前快照并通知监听者，调用时需持有 _lock"""
+    global _snapshot
+    old = _snapshot
+    _snapshot = freeze(new_config)
+    for listener in list(_listeners):
+        try:
+            listener(old, _snapshot)
+        except Exception as e:
+            logger.error(f"配置变更回调出错: {e}")
+    return _snapshot
+
+
+def init(path):
+    """
+    读取配置文件并生成初始快照（整个进程只需调用一次）
+    :return: 配置文件是否不存在或缺少配置项，需要调用 save_current 写回
+    """
+    global CONFIG_PATH, _file_state
+    CONFIG_PATH = path
+    with _lock:
+        loaded, needs_save = _read_file()
+        loaded["version"] = make_version(loaded["token"])
+        _file_state = _stat_file()
+        _swap(loaded)
+    return needs_save
+
+
+def get():
+    """获取当前配置快照（只读），同一次操作中应只获取一次并一直使用它"""
+    return _snapshot
+
+
+def add_listener(listener):
+    """注册配置变更回调 listener(旧快照, 新快照)，旧快照在初始化时为None"""
+    _listeners.append(listener)
+
+
+def replace(new_config, save=True):
+    """
+    校验新的配置并整体替换当前快照
+    :param new_config: 完整的配置dict（可由 thaw(get()) 修改得到）
+    :param save: 是否写入配置文件
+    :return: 新的快照
+    """
+    global _file_state
+    new_config = validate(ensure_config_completeness(thaw(new_config)))
+    with _lock:
+        if save:
+            _write_file(new_config)
+            _file_state = _stat_file()
+        # token变更后更新版本标识，使已登录的会话失效
+        if "version" not in new_config or (
+            _snapshot is not None and new_config["token"] != _snapshot["token"]
+        ):
+            new_config["version"] = make_version(new_config["token"])
+        return _swap(new_config)
+
+
+def save_current():
+    """将当前快照写入配置文件"""
+    global _file_state
+    with _lock:
+        _write_file(_snapshot)
+        _file_state = _stat_file()
+
+
+def reload_if_changed():
+    """配置文件的修改时间或大小变化时重新加载，返回是否已重新加载"""
+    global _file_state
+    with _lock:
+        state = _stat_file()
+        if state is None or state == _file_state:
+            return False
+        try:
+            loaded, _ = _read_file()
+        except OSError as e:
+            # 文件可能正在被写入而暂时无法读取，不记录本次的修改时间，下次检查时重试
+            logger.warning(f"读取配置文件失败，稍后重试: {e}")
+            return False
+        except (ValueError, KeyError, TypeError) as e:
+            # 内容不合法（可能正在编辑中），保留当前配置，下次修改后再尝试
+            _file_state = state
+            logger.warning(f"重新加载配置文件失败，继续使用当前配置: {e}")
+            return False
+        _file_state = state
+        if _snapshot is not None and loaded["token"] == _snapshot["token"]:
+            loaded["version"] = _snapshot["version"]
+        else:
+            loaded["version"] = make_version(loaded["token"])
+        _swap(loaded)
+    logger.info("检测到配置文件被修改，已重新加载")
+    return True
+
+
+def start_watcher(interval=WATCH_INTERVAL):
+    """启动后台线程，定期检查配置文件是否被修改"""
+    global _watcher_thread
+    if _watcher_thread is not None:
+        return _watcher_thread
+
+    def watch():
+        while True:
+            time.sleep(interval)
+            try:
+                reload_if_changed()
+            except Exception as e:
+                logger.error(f"检查配置文件时出错: {e}")
+
+    _watcher_thread = threading.Thread(target=watch, name="config-watcher", daemon=True)
+    _watcher_thread.start()
+    return _watcher_thread
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QRmai 自适应解码调度模块
+根据最近几次"点击p2 → 首次解码成功"的耗时分布，安排截图解码的时间点：
+在二维码最可能出现的时间段内密集尝试，其余时间稀疏尝试，总次数和总时长不超过配置上限
+"""
+
+import json
+import os
+import threading
+
+STATS_FILE = "decode_stats.json"  # 历史耗时记录文件
+MAX_SAMPLES = 50  # 最多保留的历史样本数
+MIN_SAMPLES = 5  # 样本数达到该值后才启用自适应调度
+DENSE_RATIO = 0.6  # 分配给密集区间的尝试次数比例
+MIN_INTERVAL = 0.1  # 两次尝试之间的最小间隔（秒），截图+解码本身也需要时间
+
+DEFAULT_KEY = ""  # 全局配置（不属于任何档案）的记录在文件中的键
+
+_lock = threading.Lock()
+_stats = None  # {档案名称: {"p1": ..., "p2": ..., "samples": [...]}}
+
+
+def _empty_stats(p1=None, p2=None):
+    return {
+        "p1": list(p1) if p1 else None,
+        "p2": list(p2) if p2 else None,
+        "samples": [],
+    }
+
+
+def _key(profile):
+    return DEFAULT_KEY if profile is None else profile
+
+
+def _load_stats():
+    """读取历史耗时记录（只在第一次调用时读取文件）"""
+    global _stats
+    if _stats is None:
+        _stats = {}
+        if os.path.exists(STATS_FILE):
+            try:
+                with open(STATS_FILE, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data.get("samples"), list):
+                    # 旧版本的文件只有一条全局配置的记录
+                    data = {DEFAULT_KEY: data}
+                _stats = {
+                    key: value
+                    for key, value in data.items()
+                    if isinstance(value, dict)
+                    and isinstance(value.get("samples"), list)
+                }
+            except Exception:
+                pass
+    return _stats
+
+
+def _save_stats():
+    try:
+        with open(STATS_FILE, "w", encoding="utf-8") as f:
+            json.dump(_stats, f, ensure_ascii=False, indent=4)
+    except Exception:
+        pass
+
+
+def _samples_for(p1, p2, profile):
+    """与当前p1/p2对应的历史耗时（只读），坐标不一致或没有记录时返回空列表"""
+    stats = _load_stats().get(_key(profile))
+    if stats is None or stats.get("p1") != list(p1) or stats.get("p2") != list(p2):
+        return []
+    return stats["samples"]
+
+
+def reset(p1=None, p2=None, profile=None):
+    """清空该档案学习到的耗时分布（p1/p2变更后调用）"""
+    with _lock:
+        _load_stats()[_key(profile)] = _empty_stats(p1, p2)
+        _save_stats()
+
+
+def record_latency(p1, p2, latency, profile=None):
+    """
+    记录一次"点击p2 → 首次解码成功"的耗时，坐标与已有记录不一致时丢弃旧记录
+    :param latency: 耗时（秒）。由于只能在截图时刻观察到二维码，调用方应传入
+                    上一次失败尝试与本次成功尝试之间的中点作为估计值
+    :param profile: 档案名称，全局配置为None
+    """
+    with _lock:
+        stats = _load_stats()
+        key = _key(profile)
+        record = stats.get(key)
+        if record is None or record["p1"] != list(p1) or record["p2"] != list(p2):
+            record = stats[key] = _empty_stats(p1, p2)
+        record["samples"].append(round(float(latency), 3))
+        del record["samples"][:-MAX_SAMPLES]
+        _save_stats()
+
+
+def _quantile(sorted_values, q):
+    """线性插值计算分位数"""
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    pos = (len(sorted_values) - 1) * q
+    lower = int(pos)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (
+        pos - lower
+    )
+
+
+def get_distribution(p1, p2, profile=None):
+    """获取学习到的耗时分布，样本不足时返回None"""
+    with _lock:
+        samples = sorted(_samples_for(p1, p2, profile))
+    if len(samples) < MIN_SAMPLES:
+        return None
+    return {
+        "count": len(samples),
+        "p10": _quantile(samples, 0.1),
+        "p50": _quantile(samples, 0.5),
+        "p90": _quantile(samples, 0.9),
+    }
+
+
+def static_schedule(total_time, retry_count):
+    """原有的等间隔调度：每隔 time / retry_count 秒尝试一次"""
+    interval = total_time / retry_count
+    return [round(interval * (i + 1), 3) for i in range(retry_count)]
+
+
+def build_schedule(decode_config, p1, p2, profile=None):
+    """
+    生成本次解码的尝试时间点列表（相对于点击p2的秒数，升序）
+    列表长度不超过 retry_count，最后一个时间点不超过 time
+    """
+    total_time = float(decode_config["time"])
+    retry_count = max(1, int(decode_config["retry_count"]))
+
+    if not decode_config.get("adaptive", True):
+        return static_schedule(total_time, retry_count)
+
+    distribution = get_distribution(p1, p2, profile)
+    if distribution is None or retry_count < 3:
+        return static_schedule(total_time, retry_count)
+
+    # 密集区间：10%~90%分位数，两侧各留出一定余量
+    margin = max(MIN_INTERVAL, 0.25 * (distribution["p90"] - distribution["p10"]))
+    dense_start = max(MIN_INTERVAL, distribution["p10"] - margin)
+    dense_end = min(total_time, distribution["p90"] + margin)
+    if dense_start >= dense_end:
+        return static_schedule(total_time, retry_count)
+
+    dense_count = max(2, int(round(retry_count * DENSE_RATIO)))
+    head_count = 1 if dense_start > 2 * MIN_INTERVAL else 0
+    tail_count = retry_count - dense_count - head_count
+    if tail_count < 1:
+        # 至少保留一次在超时时间点的尝试，以兼顾偶尔出现的慢响应
+        dense_count -= 1 - tail_count
+        tail_count = 1
+
+    # 分布过窄时向两侧扩展密集区间，保证相邻尝试之间至少间隔 MIN_INTERVAL
+    min_width = MIN_INTERVAL * (dense_count - 1)
+    if dense_end - dense_start < min_width:
+        center = (dense_start + dense_end) / 2
+        dense_start = max(MIN_INTERVAL, center - min_width / 2)
+        dense_end = min(total_time, dense_start + min_width)
+
+    schedule = []
+    if head_count:
+        schedule.append(dense_start / 2)
+    if dense_count == 1:
+        schedule.append(distribution["p50"])
+    else:
+        step = (dense_end - dense_start) / (dense_count - 1)
+        schedule.extend(dense_start + step * i for i in range(dense_count))
+    tail_step = (total_time - dense_end) / tail_count
+    schedule.extend(dense_end + tail_step * (i + 1) for i in range(tail_count))
+
+    # 去掉过于接近的时间点
+    result = []
+    for offset in sorted(schedule):
+        offset = round(min(offset, total_time), 3)
+        if not result or offset - result[-1] >= MIN_INTERVAL - 1e-6:
+            result.append(offset)
+    return result
+
+
+def get_status(config, profile=None):
+    """设置页面展示用的调度状态"""
+    distribution = get_distribution(config["p1"], config["p2"], profile)
+    with _lock:
+        sample_count = len(_samples_for(config["p1"], config["p2"], profile))
+    return {
+        "adaptive": config["decode"].get("adaptive", True),
+        "sample_count": sample_count,
+        "min_samples": MIN_SAMPLES,
+        "distribution": distribution,
+        "schedule": build_schedule(
+            config["decode"], config["p1"], config["p2"], profile
+        ),
+    }
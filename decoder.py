@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QRmai 二维码解码模块
+对截图进行预处理并识别其中的二维码，不依赖Windows相关库，便于在任意平台上测试和跑基准
+除了对整张截图解码一次（single）外，还可以把截图切成互相重叠的小块、缩小成几种尺寸，
+在线程池中同时解码（zbar和opencv在解码时都会释放GIL），任意一块识别到二维码后立即返回
+"""
+
+import re
+import threading
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+
+from PIL import Image
+
+# 解码结果：data为二维码内容(bytes)，rect为二维码在原始截图中的位置 (left, top, width, height)
+Decoded = namedtuple("Decoded", ["data", "rect"])
+
+BACKENDS = ("pyzbar", "opencv")
+PREPROCESS_MODES = ("none", "gray", "half", "binary")
+# single 整张截图解码一次 / tiles 切块 / pyramid 整张截图按 scales 缩放 / tiles+pyramid 两者同时
+STRATEGIES = ("single", "tiles", "pyramid", "tiles+pyramid")
+
+# 舞萌DX登录二维码内容：SGWCMAID + 生成时间(yymmddHHMMSS，北京时间) + 64位十六进制
+PAYLOAD_TIME_PATTERN = re.compile(rb"^SGWCMAID(\d{12})")
+PAYLOAD_TIMEZONE = timezone(timedelta(hours=8))
+
+_opencv_local = threading.local()  # cv2.QRCodeDetector 不能在多个线程中同时使用
+_pool_lock = threading.Lock()
+_pool = None
+_pool_workers = 0
+
+
+def preprocess_image(image, mode="none"):
+    """
+    截图预处理
+    :param mode: none 原图 / gray 灰度 / half 灰度并缩小一半 / binary 灰度二值化
+    :return: (处理后的图像, 缩放比例)
+    """
+    if mode == "none":
+        return image, 1
+    gray = image.convert("L")
+    if mode == "gray":
+        return gray, 1
+    if mode == "half":
+        return gray.resize((gray.width // 2, gray.height // 2), Image.BILINEAR), 0.5
+    if mode == "binary":
+        return gray.point(lambda v: 255 if v > 128 else 0), 1
+    raise ValueError(f"未知的预处理模式: {mode}")
+
+
+def _decode_pyzbar(image):
+    from pyzbar.pyzbar import decode, ZBarSymbol
+
+    return [
+        Decoded(obj.data, tuple(obj.rect))
+        for obj in decode(image, symbols=[ZBarSymbol.QRCODE])
+    ]
+
+
+def _decode_opencv(image):
+    import cv2
+    import numpy
+
+    detector = getattr(_opencv_local, "detector", None)
+    if detector is None:
+        detector = _opencv_local.detector = cv2.QRCodeDetector()
+    array = numpy.asarray(image.convert("L"))
+    ok, payloads, points, _ = detector.detectAndDecodeMulti(array)
+    if not ok:
+        return []
+    results = []
+    for payload, corners in zip(payloads, points):
+        if not payload:
+            continue
+        xs = [int(p[0]) for p in corners]
+        ys = [int(p[1]) for p in corners]
+        rect = (min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys))
+        results.append(Decoded(payload.encode("utf-8"), rect))
+    return results
+
+
+def _decode_backend(image, backend):
+    if backend == "pyzbar":
+        return _decode_pyzbar(image)
+    if backend == "opencv":
+        return _decode_opencv(image)
+    raise ValueError(f"未知的解码后端: {backend}")
+
+
+def decode_image(image, backend="pyzbar", preprocess="none"):
+    """
+    识别图像中的所有二维码
+    :param image: PIL图像
+    :param backend: 解码后端，pyzbar 或 opencv（需要安装opencv-python）
+    :param preprocess: 预处理模式，见 preprocess_image
+    :return: Decoded 列表，rect 已换算回原始图像坐标
+    """
+    processed, scale = preprocess_image(image, preprocess)
+    results = _decode_backend(processed, backend)
+
+    if scale != 1:
+        results = [
+            Decoded(obj.data, tuple(int(v / scale) for v in obj.rect))
+            for obj in results
+        ]
+    return results
+
+
+def payload_time(data):
+    """
+    解析二维码内容中的生成时间
+    :param data: 二维码内容(bytes)
+    :return: 时间戳（秒），不是舞萌DX格式或时间不合法时返回None
+    """
+    match = PAYLOAD_TIME_PATTERN.match(data)
+    if not match:
+        return None
+    try:
+        issued_at = datetime.strptime(match.group(1).decode(), "%y%m%d%H%M%S")
+    except ValueError:
+        return None
+    return issued_at.replace(tzinfo=PAYLOAD_TIMEZONE).timestamp()
+
+
+def is_stale(obj, not_before, previous=None):
+    """
+    二维码的生成时间早于 not_before 时为旧二维码，无法解析时间的二维码不视为旧二维码；
+    与上一次返回的二维码 previous 相同或生成时间不晚于它的也是旧二维码
+    """
+    if previous is not None and obj.data == previous:
+        return True
+    issued_at = payload_time(obj.data)
+    if issued_at is None:
+        return False
+    if previous is not None:
+        previous_at = payload_time(previous)
+        if previous_at is not None and issued_at <= previous_at:
+            return True
+    return not_before is not None and issued_at < not_before
+
+
+def select_newest(results, not_before=None, previous=None):
+    """
+    从识别到的二维码中挑选最新的一个：先比较内容中的生成时间，相同或无法解析时取屏幕上最靠下的
+    （聊天中最新的消息在最下方）
+    :param not_before: 生成时间早于该时间戳的二维码视为旧二维码（已过期或即将过期）被丢弃
+    :param previous: 上一次返回的二维码内容(bytes)，与它相同或更早的二维码同样被丢弃
+    :return: (最新的二维码或None, 被丢弃的旧二维码列表)
+    """
+    stale = [obj for obj in results if is_stale(obj, not_before, previous)]
+    fresh = [obj for obj in results if not is_stale(obj, not_before, previous)]
+    if not fresh:
+        return None, stale
+    newest = max(
+        fresh,
+        key=lambda obj: (payload_time(obj.data) or 0, obj.rect[1] + obj.rect[3]),
+    )
+    return newest, stale
+
+
+def _get_pool(workers):
+    """获取解码线程池，线程数变化时换用新的线程池"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode")
+            _pool_workers = workers
+        return _pool
+
+
+def make_jobs(width, height, strategy, tiles=2, tile_overlap=0.25, scales=(0.5,)):
+    """
+    生成解码任务 (left, top, right, bottom, 缩放比例)，缩小的图像排在前面（解码最快），整张原图排在最后
+    切块时每块的边长为 截图边长/tiles*(1+tile_overlap)，比重叠部分小的二维码一定完整地落在某一块中
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"未知的解码策略: {strategy}")
+    jobs = []
+    if strategy in ("pyramid", "tiles+pyramid"):
+        for scale in sorted(scales):
+            jobs.append((0, 0, width, height, scale))
+    if strategy in ("tiles", "tiles+pyramid"):
+        step_x, step_y = width / tiles, height / tiles
+        size_x, size_y = step_x * (1 + tile_overlap), step_y * (1 + tile_overlap)
+        for row in range(tiles):
+            for col in range(tiles):
+                # 最后一行/列向内对齐，不超出截图
+                left = int(min(col * step_x, width - size_x))
+                top = int(min(row * step_y, height - size_y))
+                jobs.append(
+                    (
+                        max(0, left),
+                        max(0, top),
+                        min(width, int(left + size_x)),
+                        min(height, int(top + size_y)),
+                        1,
+                    )
+                )
+    # 最后加上整张原图，比重叠部分大、被切开的二维码仍能识别，结果不会比 single 差
+    jobs.append((0, 0, width, height, 1))
+    return jobs
+
+
+def _run_job(image, job, backend):
+    """解码截图的一块，rect 换算回 image 中的坐标"""
+    left, top, right, bottom, scale = job
+    part = image
+    if (left, top, right, bottom) != (0, 0, image.width, image.height):
+        part = part.crop((left, top, right, bottom))
+    if scale != 1:
+        part = part.resize(
+            (max(1, int(part.width * scale)), max(1, int(part.height * scale))),
+            Image.BILINEAR,
+        )
+    return [
+        Decoded(
+            obj.data,
+            (
+                int(obj.rect[0] / scale) + left,
+                int(obj.rect[1] / scale) + top,
+                int(obj.rect[2] / scale),
+                int(obj.rect[3] / scale),
+            ),
+        )
+        for obj in _decode_backend(part, backend)
+        if obj.data
+    ]
+
+
+def _merge_results(results):
+    """合并各块的结果，相邻块重叠部分或不同缩放比例中识别到的同一个二维码只保留一个"""
+    merged = []
+    for obj in results:
+        left, top, width, height = obj.rect
+        if not any(
+            kept.data == obj.data
+            and left < kept.rect[0] + kept.rect[2]
+            and kept.rect[0] < left + width
+            and top < kept.rect[1] + kept.rect[3]
+            and kept.rect[1] < top + height
+            for kept in merged
+        ):
+            merged.append(obj)
+    return merged
+
+
+def decode_frame(image, options, not_before=None, first_only=False):
+    """
+    按解码配置识别截图中的二维码
+    :param image: PIL图像
+    :param options: 配置中的 decode 项（backend、preprocess、strategy、workers、tiles、tile_overlap、scales）
+    :param not_before: 早于该时间生成的二维码视为旧二维码，只在 first_only 时影响何时结束
+    :param first_only: 切块解码时，任意一块识别到新二维码即结束并只返回该块的结果，
+        只需要判断能否识别时使用；默认等所有块解码完成，以便从全部二维码中挑选最新的一个
+    :return: Decoded 列表，切块解码时已合并各块中重复识别的同一个二维码
+    """
+    strategy = options.get("strategy", "single")
+    if strategy == "single":
+        return decode_image(image, options["backend"], options["preprocess"])
+
+    processed, preprocess_scale = preprocess_image(image, options["preprocess"])
+    jobs = make_jobs(
+        processed.width,
+        processed.height,
+        strategy,
+        options.get("tiles", 2),
+        options.get("tile_overlap", 0.25),
+        options.get("scales", (0.5,)),
+    )
+    pool = _get_pool(options.get("workers", 4))
+    pending = {
+        pool.submit(_run_job, processed, job, options["backend"]) for job in jobs
+    }
+    results = []
+    found = False
+    error = None
+    try:
+        while pending and not found:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    job_results = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if found or not job_results:
+                    continue
+                results.extend(job_results)
+                if first_only and any(
+                    not is_stale(obj, not_before) for obj in job_results
+                ):
+                    # 只有旧二维码的块不会让解码提前结束
+                    results, found = job_results, True
+    finally:
+        # 已经在解码的块无法中断，等它们自行结束；还没开始的直接取消
+        for future in pending:
+            future.cancel()
+
+    if not results and error is not None:
+        raise error
+    results = _merge_results(results)
+    if preprocess_scale != 1:
+        results = [
+            Decoded(obj.data, tuple(int(v / preprocess_scale) for v in obj.rect))
+            for obj in results
+        ]
+    return results
@@ -0,0 +1,569 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QRmai Windows桌面后端
+负责查找/激活微信窗口、模拟鼠标点击、截屏以及结束微信小程序进程
+main.py 通过 config["desktop_backend"] 选择后端，模拟后端见 desktop_sim.py
+
+后台模式（config["input_mode"] 为 background）下不激活窗口、不移动鼠标：
+点击通过向微信窗口发送鼠标消息完成，截屏通过 PrintWindow 截取窗口自身的内容，
+微信窗口被其他窗口遮挡时也能正常获取，但不能最小化
+"""
+
+import logging
+import subprocess  # 用于运行系统命令
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil  # 进程管理库
+from PIL import Image  # 图像处理库
+from mss import mss  # 屏幕截图库
+from pynput.mouse import Controller as MouseController, Button  # 鼠标控制库
+
+# Windows API 相关库用于操作进程窗口
+import ctypes
+import ctypes.wintypes
+from win32 import win32gui, win32process
+import win32con
+
+logger = logging.getLogger(__name__)
+
+# 初始化鼠标控制器
+mouse = MouseController()
+
+# 以下两行代码修复了Win10在系统缩放下第一次请求时鼠标移动位置偏移的bug
+# 导入 Shcore.dll
+shcore = ctypes.windll.shcore
+# 设置 DPI 感知模式：0 = 无感知，1 = 系统级感知，2 = 每显示器感知
+shcore.SetProcessDpiAwareness(2)  # 每显示器高 DPI 感知
+
+user32 = ctypes.windll.user32
+gdi32 = ctypes.windll.gdi32
+dwmapi = ctypes.windll.dwmapi
+DWMWA_EXTENDED_FRAME_BOUNDS = 9
+DPI_AWARENESS_PER_MONITOR_AWARE = 2
+PW_RENDERFULLCONTENT = 2  # 让 PrintWindow 也能截取硬件加速绘制的窗口（Win8.1及以上）
+# ChildWindowFromPointEx 跳过不可见、禁用和透明的子窗口
+CWP_SKIP = 0x0001 | 0x0002 | 0x0004
+_per_monitor_dpi_aware = None
+
+# 句柄类型在64位系统上超过int范围，需要声明参数和返回值类型
+_wt = ctypes.wintypes
+user32.GetWindowDC.argtypes = [_wt.HWND]
+user32.GetWindowDC.restype = _wt.HDC
+user32.ReleaseDC.argtypes = [_wt.HWND, _wt.HDC]
+user32.PrintWindow.argtypes = [_wt.HWND, _wt.HDC, _wt.UINT]
+user32.ChildWindowFromPointEx.argtypes = [_wt.HWND, _wt.POINT, _wt.UINT]
+user32.ChildWindowFromPointEx.restype = _wt.HWND
+gdi32.CreateCompatibleDC.argtypes = [_wt.HDC]
+gdi32.CreateCompatibleDC.restype = _wt.HDC
+gdi32.CreateCompatibleBitmap.argtypes = [_wt.HDC, ctypes.c_int, ctypes.c_int]
+gdi32.CreateCompatibleBitmap.restype = _wt.HBITMAP
+gdi32.SelectObject.argtypes = [_wt.HDC, _wt.HGDIOBJ]
+gdi32.SelectObject.restype = _wt.HGDIOBJ
+gdi32.GetDIBits.argtypes = [
+    _wt.HDC,
+    _wt.HBITMAP,
+    _wt.UINT,
+    _wt.UINT,
+    ctypes.c_void_p,
+    ctypes.c_void_p,
+    _wt.UINT,
+]
+gdi32.DeleteObject.argtypes = [_wt.HGDIOBJ]
+gdi32.DeleteDC.argtypes = [_wt.HDC]
+
+
+class BITMAPINFOHEADER(ctypes.Structure):
+    _fields_ = [
+        ("biSize", _wt.DWORD),
+        ("biWidth", _wt.LONG),
+        ("biHeight", _wt.LONG),
+        ("biPlanes", _wt.WORD),
+        ("biBitCount", _wt.WORD),
+        ("biCompression", _wt.DWORD),
+        ("biSizeImage", _wt.DWORD),
+        ("biXPelsPerMeter", _wt.LONG),
+        ("biYPelsPerMeter", _wt.LONG),
+        ("biClrUsed", _wt.DWORD),
+        ("biClrImportant", _wt.DWORD),
+    ]
+
+
+def _is_per_monitor_dpi_aware():
+    """
+    检查当前线程是否为每显示器DPI感知
+    打包后的exe可能已经在清单中设置了DPI感知，此时 SetProcessDpiAwareness 会失败，需要以实际状态为准
+    """
+    global _per_monitor_dpi_aware
+    if _per_monitor_dpi_aware is None:
+        try:
+            user32.GetThreadDpiAwarenessContext.restype = ctypes.c_void_p
+            user32.GetAwarenessFromDpiAwarenessContext.argtypes = [ctypes.c_void_p]
+            context = user32.GetThreadDpiAwarenessContext()
+            awareness = user32.GetAwarenessFromDpiAwarenessContext(context)
+            _per_monitor_dpi_aware = awareness == DPI_AWARENESS_PER_MONITOR_AWARE
+        except AttributeError:
+            # Win10 1607 之前的系统没有这两个API
+            _per_monitor_dpi_aware = False
+    return _per_monitor_dpi_aware
+
+
+# 微信窗口查找缓存：Weixin.exe 的PID集合和上一次找到的窗口句柄
+_window_lock = threading.Lock()
+_wechat_pids = set()
+_last_hwnd = None
+last_window_lookup = {"ms": 0.0, "source": None}  # 最近一次查找的耗时和方式
+
+
+def _refresh_wechat_pids(appex=None):
+    """
+    扫描进程表，更新 Weixin.exe 的PID集合
+    :param appex: 传入列表时同时将扫描到的 WeChatAppEx.exe 进程加入其中，避免再扫描一次
+    """
+    global _wechat_pids
+    pids = set()
+    for proc in psutil.process_iter(["pid", "name"]):
+        name = proc.info["name"]
+        if not name:
+            continue
+        if "Weixin.exe" in name:
+            pids.add(proc.info["pid"])
+        elif appex is not None and "WeChatAppEx.exe" in name:
+            appex.append(proc)
+    _wechat_pids = pids
+    return _wechat_pids
+
+
+def _is_wechat_window(hwnd):
+    """检查窗口句柄是否仍然有效且属于 Weixin.exe"""
+    try:
+        if not win32gui.IsWindow(hwnd) or not win32gui.IsWindowVisible(hwnd):
+            return False
+        _, pid = win32process.GetWindowThreadProcessId(hwnd)
+        return pid in _wechat_pids
+    except Exception:
+        return False
+
+
+def _enum_wechat_windows(pids):
+    """枚举顶层窗口，只按PID筛选，不为每个窗口创建 psutil.Process"""
+
+    def enum_windows_callback(hwnd, windows):
+        if not win32gui.IsWindowVisible(hwnd):
+            return True
+
+        # 获取窗口关联的进程ID
+        _, pid = win32process.GetWindowThreadProcessId(hwnd)
+        if pid in pids:
+            windows.append(hwnd)
+        return True
+
+    windows = []
+    win32gui.EnumWindows(enum_windows_callback, windows)
+    return windows
+
+
+def find_wechat_window_by_process():
+    """
+    通过查找Weixin.exe进程来获取微信窗口句柄
+    优先验证上一次找到的句柄，失效时再用缓存的PID枚举窗口，仍找不到才重新扫描进程表
+    """
+    global _last_hwnd
+    start = time.perf_counter()
+    with _window_lock:
+        source = "cache"
+        hwnd = _last_hwnd if _last_hwnd and _is_wechat_window(_last_hwnd) else None
+
+        if hwnd is None:
+            source = "enum"
+            pids = {pid for pid in _wechat_pids if psutil.pid_exists(pid)}
+            windows = _enum_wechat_windows(pids) if pids else []
+            if not windows:
+                source = "scan"
+                windows = _enum_wechat_windows(_refresh_wechat_pids())
+            hwnd = windows[0] if windows else None
+            _last_hwnd = hwnd
+
+    elapsed = (time.perf_counter() - start) * 1000
+    last_window_lookup.update(ms=round(elapsed, 3), source=source)
+    logger.info(f"查找微信窗口耗时 {elapsed:.1f}ms（{source}）")
+    return hwnd
+
+
+KILL_WAIT_TIMEOUT = 2  # 等待被结束的进程退出的最长时间（秒）
+
+
+def _find_wechat_appex(scan_fallback=True):
+    """
+    查找 WeChatAppEx.exe 进程：优先从 Weixin.exe 的进程树中查找
+    缓存的PID失效时重新扫描进程表，同一次扫描的结果直接作为备用结果，不再扫描第二次
+    :param scan_fallback: 进程树中找不到时是否使用扫描整个进程表的结果
+    """
+    scanned = None
+    pids = {pid for pid in _wechat_pids if psutil.pid_exists(pid)}
+    if not pids:
+        scanned = []
+        pids = _refresh_wechat_pids(scanned)
+
+    procs = []
+    for pid in pids:
+        try:
+            for child in psutil.Process(pid).children(recursive=True):
+                try:
+                    if "WeChatAppEx.exe" in child.name():
+                        procs.append(child)
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    pass
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    if procs or not scan_fallback:
+        return procs
+    return scanned if scanned is not None else _find_wechat_appex_by_scan()
+
+
+def _find_wechat_appex_by_scan():
+    """扫描整个进程表查找 WeChatAppEx.exe（进程树中找不到时的备用方法）"""
+    return [
+        proc
+        for proc in psutil.process_iter(["pid", "name"])
+        if proc.info["name"] and "WeChatAppEx.exe" in proc.info["name"]
+    ]
+
+
+def kill_wechat_process():
+    """
+    杀死WeChatAppEx.exe进程
+    优先从 Weixin.exe 的进程树中查找，同时结束所有目标进程并限时等待其退出
+    """
+    try:
+        # 方法1: 使用psutil查找并终止进程
+        with _window_lock:
+            procs = _find_wechat_appex()
+
+        if not procs:
+            logger.info("未找到可杀死的WeChatAppEx.exe进程")
+            return
+
+        # 逐个结束，某个进程无权限或已退出时不影响其他进程
+        killed = []
+        for proc in procs:
+            try:
+                proc.kill()  # 终止进程
+                killed.append(proc)
+            except psutil.NoSuchProcess:
+                pass
+            except psutil.AccessDenied:
+                logger.warning(
+                    f"尝试杀死微信进程 {proc.pid} 时访问被拒绝 - 可能需要提升权限"
+                )
+        if not killed:
+            return
+
+        # 只等待成功发出结束信号的进程
+        _, alive = psutil.wait_procs(killed, timeout=KILL_WAIT_TIMEOUT)
+        logger.info(f"已杀死微信进程，PID: {[proc.pid for proc in killed]}")
+        if alive:
+            logger.warning(
+                f"以下微信进程在{KILL_WAIT_TIMEOUT}s内未退出: {[p.pid for p in alive]}"
+            )
+    except psutil.AccessDenied:
+        logger.warning("尝试杀死微信进程时访问被拒绝 - 可能需要提升权限")
+    except Exception as e:
+        logger.error(f"杀死微信进程时出错: {e}")
+        # 备用方法: 尝试使用taskkill命令
+        try:
+            subprocess.run(
+                ["taskkill", "/f", "/im", "WeChatAppEx.exe"],
+                creationflags=subprocess.CREATE_NO_WINDOW,
+                check=True,
+            )
+            logger.info("使用taskkill命令杀死微信进程")
+        except subprocess.CalledProcessError:
+            logger.warning("使用taskkill命令杀死微信进程失败")
+
+
+def activate_window(hwnd, background=False):
+    """
+    恢复并激活窗口，置于最顶层
+    :param background: 后台模式，只在窗口最小化时恢复窗口，不激活、不置顶
+    :return: 是否激活成功
+    """
+    if background:
+        # 最小化的窗口不处理点击消息，也无法截取内容
+        try:
+            if win32gui.IsIconic(hwnd):
+                win32gui.ShowWindow(hwnd, win32con.SW_SHOWNOACTIVATE)
+            return True
+        except Exception as e:
+            logger.warning(f"恢复窗口失败: {e}")
+            return False
+
+    # 尝试激活窗口，添加重试机制和错误处理
+    for attempt in range(3):  # 最多尝试3次
+        try:
+            # 恢复窗口（如果被最小化）
+            win32gui.ShowWindow(hwnd, win32con.SW_RESTORE)
+            # 将窗口置于前台并激活
+            win32gui.SetForegroundWindow(hwnd)
+            # 设置窗口为最顶层
+            win32gui.SetWindowPos(
+                hwnd,
+                win32con.HWND_TOPMOST,
+                0,
+                0,
+                0,
+                0,
+                win32con.SWP_NOMOVE | win32con.SWP_NOSIZE,
+            )
+            return True
+        except Exception as e:
+            logger.warning(f"第 {attempt + 1} 次尝试激活窗口失败: {e}")
+            time.sleep(1)  # 等待1秒后重试
+    return False
+
+
+def click(x, y, hwnd=None):
+    """
+    移动鼠标并点击
+    :param x: x坐标
+    :param y: y坐标
+    :param hwnd: 指定时向该窗口发送点击消息（后台模式），不移动鼠标
+    """
+    if hwnd:
+        _post_click(hwnd, x, y)
+        return
+    mouse.position = (x, y)
+    mouse.click(Button.left, 1)
+
+
+def _post_click(hwnd, x, y):
+    """将屏幕坐标换算为窗口客户区坐标，向该位置所在的（子）窗口发送按下和抬起消息"""
+    client = _wt.POINT(*win32gui.ScreenToClient(hwnd, (x, y)))
+    child = user32.ChildWindowFromPointEx(hwnd, client, CWP_SKIP)
+    if child and child != hwnd:
+        hwnd = child
+        client = _wt.POINT(*win32gui.ScreenToClient(hwnd, (x, y)))
+    lparam = ((client.y & 0xFFFF) << 16) | (client.x & 0xFFFF)
+    win32gui.PostMessage(hwnd, win32con.WM_MOUSEMOVE, 0, lparam)
+    win32gui.PostMessage(hwnd, win32con.WM_LBUTTONDOWN, win32con.MK_LBUTTON, lparam)
+    win32gui.PostMessage(hwnd, win32con.WM_LBUTTONUP, 0, lparam)
+
+
+def minimize_window(hwnd):
+    """最小化窗口"""
+    win32gui.ShowWindow(hwnd, win32con.SW_MINIMIZE)
+
+
+# 最近一次截屏的方式和区域，可通过 /metrics 查看
+last_capture = {"source": None, "rect": None, "ms": 0.0}
+MIN_CAPTURE_SIZE = 100  # 可用于截屏的窗口的最小宽高（像素）
+_capture_hwnd = None  # 上一次截取的 WeChatAppEx.exe 窗口
+
+
+def _get_window_rect(hwnd):
+    """
+    获取窗口在屏幕上的实际区域（物理像素），窗口无效或已最小化时返回None
+    使用 DWM 的扩展边框区域，不包含 GetWindowRect 中不可见的缩放边框
+    """
+    try:
+        if not win32gui.IsWindow(hwnd) or not win32gui.IsWindowVisible(hwnd):
+            return None
+        if win32gui.IsIconic(hwnd):
+            return None
+        rect = ctypes.wintypes.RECT()
+        result = dwmapi.DwmGetWindowAttribute(
+            hwnd,
+            DWMWA_EXTENDED_FRAME_BOUNDS,
+            ctypes.byref(rect),
+            ctypes.sizeof(rect),
+        )
+        if result == 0:
+            # DWM返回的区域始终是物理像素，不受DPI感知模式影响
+            left, top, right, bottom = rect.left, rect.top, rect.right, rect.bottom
+        else:
+            left, top, right, bottom = win32gui.GetWindowRect(hwnd)
+        if result != 0 and not _is_per_monitor_dpi_aware():
+            # 非每显示器感知时 GetWindowRect 得到的是逻辑坐标，按窗口所在显示器的缩放比例换算为物理像素
+            scale = user32.GetDpiForWindow(hwnd) / 96
+            left, top, right, bottom = (
+                int(left * scale),
+                int(top * scale),
+                int(right * scale),
+                int(bottom * scale),
+            )
+    except Exception as e:
+        logger.debug(f"获取窗口区域失败: {e}")
+        return None
+    if right - left < MIN_CAPTURE_SIZE or bottom - top < MIN_CAPTURE_SIZE:
+        # 太小的窗口（如辅助窗口）不可能完整显示二维码
+        return None
+    return left, top, right, bottom
+
+
+def _find_capture_window(hwnd):
+    """
+    查找显示二维码的窗口：优先使用最上层的 WeChatAppEx.exe 窗口（点击二维码消息后打开的页面），
+    其次是未最小化的微信主窗口
+    :return: (窗口句柄, 窗口区域)，都找不到时为 (None, None)
+    """
+    global _capture_hwnd
+    # 上一次使用的窗口仍然有效时直接使用，避免每次截屏都扫描进程树
+    if _capture_hwnd is not None:
+        rect = _get_window_rect(_capture_hwnd)
+        if rect:
+            return _capture_hwnd, rect
+        _capture_hwnd = None
+
+    with _window_lock:
+        appex_pids = {proc.pid for proc in _find_wechat_appex(scan_fallback=False)}
+    for candidate in _enum_wechat_windows(appex_pids) if appex_pids else []:
+        rect = _get_window_rect(candidate)
+        if rect:
+            _capture_hwnd = candidate
+            return candidate, rect
+    rect = _get_window_rect(hwnd) if hwnd else None
+    return (hwnd, rect) if rect else (None, None)
+
+
+def _print_window(hwnd):
+    """
+    通过 PrintWindow 截取窗口自身的内容，窗口被其他窗口遮挡时也能截取
+    :return: (PIL图像, 窗口区域)，窗口已最小化或截取失败时为 (None, None)
+    """
+    rect = _get_window_rect(hwnd)
+    if not rect:
+        return None, None
+    # PrintWindow 绘制的是包含不可见缩放边框的整个窗口，截取后裁剪到可见区域
+    outer = win32gui.GetWindowRect(hwnd) if _is_per_monitor_dpi_aware() else rect
+    width, height = outer[2] - outer[0], outer[3] - outer[1]
+    window_dc = user32.GetWindowDC(hwnd)
+    memory_dc = gdi32.CreateCompatibleDC(window_dc)
+    bitmap = gdi32.CreateCompatibleBitmap(window_dc, width, height)
+    try:
+        previous = gdi32.SelectObject(memory_dc, bitmap)
+        printed = user32.PrintWindow(hwnd, memory_dc, PW_RENDERFULLCONTENT)
+        gdi32.SelectObject(memory_dc, previous)
+        if not printed:
+            return None, None
+        # 高度为负数时按从上到下的顺序输出每行像素
+        header = BITMAPINFOHEADER(
+            biSize=ctypes.sizeof(BITMAPINFOHEADER),
+            biWidth=width,
+            biHeight=-height,
+            biPlanes=1,
+            biBitCount=32,
+        )
+        buffer = ctypes.create_string_buffer(width * height * 4)
+        if not gdi32.GetDIBits(
+            memory_dc, bitmap, 0, height, buffer, ctypes.byref(header), 0
+        ):
+            return None, None
+    finally:
+        gdi32.DeleteObject(bitmap)
+        gdi32.DeleteDC(memory_dc)
+        user32.ReleaseDC(hwnd, window_dc)
+    image = Image.frombuffer("RGB", (width, height), buffer, "raw", "BGRX", 0, 1)
+    box = (
+        rect[0] - outer[0],
+        rect[1] - outer[1],
+        rect[2] - outer[0],
+        rect[3] - outer[1],
+    )
+    return image.crop(box), rect
+
+
+def _clip_to_screen(rect, sct):
+    """将区域限制在所有显示器组成的虚拟屏幕内"""
+    screen = sct.monitors[0]
+    left = max(rect[0], screen["left"])
+    top = max(rect[1], screen["top"])
+    right = min(rect[2], screen["left"] + screen["width"])
+    bottom = min(rect[3], screen["top"] + screen["height"])
+    if right <= left or bottom <= top:
+        return None
+    return {"left": left, "top": top, "width": right - left, "height": bottom - top}
+
+
+def _grab_monitor(monitor):
+    # mss对象不能跨线程使用，每个线程单独创建
+    with mss() as sct:
+        screenshot = sct.grab(monitor)
+        return monitor, Image.frombytes("RGB", screenshot.size, screenshot.rgb)
+
+
+def _capture_all_monitors(sct):
+    """同时截取所有显示器，按各自的位置拼接成一张虚拟屏幕图像"""
+    screen = sct.monitors[0]
+    monitors = sct.monitors[1:]
+    if len(monitors) == 1:
+        return _grab_monitor(monitors[0])[1]
+
+    canvas = Image.new("RGB", (screen["width"], screen["height"]), "#000000")
+    with ThreadPoolExecutor(max_workers=len(monitors)) as executor:
+        for monitor, image in executor.map(_grab_monitor, monitors):
+            canvas.paste(
+                image,
+                (monitor["left"] - screen["left"], monitor["top"] - screen["top"]),
+            )
+    return canvas
+
+
+def capture_screen(hwnd=None, background=False):
+    """
+    截取显示二维码的窗口所在区域，返回PIL图像
+    找不到可用的窗口区域时，同时截取所有显示器
+    :param hwnd: 微信窗口句柄（find_wechat_window_by_process 的返回值）
+    :param background: 后台模式，通过 PrintWindow 截取窗口自身的内容，失败时再截取屏幕
+    """
+    start = time.perf_counter()
+    capture_hwnd, rect = _find_capture_window(hwnd)
+    image = None
+    if background and capture_hwnd:
+        # 窗口可能被其他窗口遮挡，屏幕上看不到二维码
+        source = "print_window"
+        image = _print_window(capture_hwnd)[0]
+    if image is None:
+        with mss() as sct:
+            region = _clip_to_screen(rect, sct) if rect else None
+            if region:
+                source = "window"
+                screenshot = sct.grab(region)
+                # 将截图转换为PIL图像对象
+                image = Image.frombytes("RGB", screenshot.size, screenshot.rgb)
+            else:
+                source = "monitors"
+                image = _capture_all_monitors(sct)
+
+    last_capture.update(
+        source=source,
+        rect=rect,
+        ms=round((time.perf_counter() - start) * 1000, 3),
+    )
+    return image
+
+
+def capture_window(hwnd, background=False):
+    """
+    截取微信主窗口所在的区域，用于校准点击位置
+    :param background: 后台模式，通过 PrintWindow 截取窗口自身的内容
+    :return: (PIL图像, 截取的区域 (left, top, right, bottom))，窗口已最小化或不在屏幕内时为 (None, None)
+    """
+    if background and hwnd:
+        return _print_window(hwnd)
+    rect = _get_window_rect(hwnd) if hwnd else None
+    if not rect:
+        return None, None
+    with mss() as sct:
+        region = _clip_to_screen(rect, sct)
+        if not region:
+            return None, None
+        screenshot = sct.grab(region)
+    image = Image.frombytes("RGB", screenshot.size, screenshot.rgb)
+    return image, (
+        region["left"],
+        region["top"],
+        region["left"] + region["width"],
+        region["top"] + region["height"],
+    )
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QRmai 桌面操作线程
+所有鼠标、窗口和截屏操作都交给同一个后台线程按顺序执行，每个阶段有单独的时限：
+超时后请求线程立即返回并中止本次流程，卡住的线程被丢弃，之后的操作由新的线程执行，
+不会因为一次卡死的 SetForegroundWindow 或截屏让所有请求一直等待。
+多个档案共用同一个桌面，获取流程通过 DesktopQueue 按请求的先后顺序依次执行
+"""
+
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STAGE_TIMEOUT = 5  # 没有单独配置时限的阶段（秒）
+
+_executor_lock = threading.Lock()
+_executor = None
+restart_count = 0  # 因操作超时而替换线程的次数
+
+
+class StageTimeout(Exception):
+    """某个阶段超过了时限"""
+
+    def __init__(self, stage, timeout):
+        super().__init__(f"{stage} 阶段超过 {timeout:.1f}s 未完成")
+        self.stage = stage
+
+
+class PipelineCancelled(Exception):
+    """流程被取消或超过了总时限"""
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="desktop-actor"
+            )
+        return _executor
+
+
+def _replace_executor(stuck):
+    """丢弃卡住的线程（无法强制结束，等它自行返回后退出），之后的操作由新线程执行"""
+    global _executor, restart_count
+    with _executor_lock:
+        if _executor is stuck:
+            _executor = None
+            restart_count += 1
+    stuck.shutdown(wait=False, cancel_futures=True)
+
+
+def run_stage(stage, func, *args, timeout=DEFAULT_STAGE_TIMEOUT):
+    """
+    在桌面操作线程中执行 func(*args)，超过 timeout 秒时抛出 StageTimeout
+    """
+    executor = _get_executor()
+    future = executor.submit(func, *args)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        if not future.cancel():
+            # 操作已经开始执行且没有返回，线程可能卡住了
+            logger.error(f"桌面操作 {stage} 超时，已丢弃该线程")
+            _replace_executor(executor)
+        raise StageTimeout(stage, timeout) from None
+
+
+class DesktopQueue:
+    """
+    按先后顺序排队的锁：每个档案同时只有一个请求在排队（同一档案的请求由档案自己的锁串行），
+    因此各档案轮流执行获取流程，不会因为某个档案的请求多而让其他档案一直等待
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._waiters = collections.deque()
+        self._held = False
+
+    def acquire(self, name=None):
+        """排队直到轮到本次请求，等待期间每0.5秒记录一次日志"""
+        ticket = object()
+        with self._cond:
+            self._waiters.append(ticket)
+            while self._held or self._waiters[0] is not ticket:
+                if not self._cond.wait(0.5):
+                    logger.info(f"等待桌面空闲... ({name or '默认'})")
+            self._waiters.popleft()
+            self._held = True
+
+    def release(self):
+        with self._cond:
+            self._held = False
+            self._cond.notify_all()
+
+    def waiting(self):
+        """正在排队的请求数"""
+        return len(self._waiters)
+
+
+class PipelineRun:
+    """
+    一次获取流程的取消标记、总时限和各阶段耗时
+    流程中的等待都通过 sleep 进行，取消或超过总时限时抛出 PipelineCancelled
+    """
+
+    def __init__(self, stage_timeouts):
+        self.stage_timeouts = stage_timeouts
+        self.deadline = time.monotonic() + stage_timeouts["pipeline"]
+        self.stages = {}  # {阶段: 累计耗时ms}
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """请求取消本次流程，会在下一次等待或执行阶段前生效"""
+        self._cancelled.set()
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+    def check(self):
+        if self._cancelled.is_set():
+            raise PipelineCancelled("流程已被取消")
+        if self.remaining() <= 0:
+            raise PipelineCancelled(
+                f"流程超过总时限 {self.stage_timeouts['pipeline']}s"
+            )
+
+    def sleep(self, seconds):
+        """可被取消的等待"""
+        self.check()
+        if seconds <= 0:
+            return
+        wait = min(seconds, max(0, self.remaining()))
+        if self._cancelled.wait(wait):
+            raise PipelineCancelled("流程已被取消")
+        if wait < seconds:
+            # 剩余的总时限不够等待
+            self.check()
+
+    def _record(self, stage, start):
+        elapsed = (time.perf_counter() - start) * 1000
+        self.stages[stage] = round(self.stages.get(stage, 0) + elapsed, 1)
+
+    def call(self, stage, func, *args):
+        """在桌面操作线程中执行一个阶段，时限取该阶段时限和剩余总时限中较小的一个"""
+        self.check()
+        timeout = min(
+            self.stage_timeouts.get(stage, DEFAULT_STAGE_TIMEOUT),
+            max(0.001, self.remaining()),
+        )
+        start = time.perf_counter()
+        try:
+            return run_stage(stage, func, *args, timeout=timeout)
+        finally:
+            self._record(stage, start)
+
+    def timed(self, stage, func, *args, **kwargs):
+        """在当前线程中执行并记录耗时（用于解码等不涉及桌面的阶段）"""
+        self.check()
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._record(stage, start)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QRmai 模拟桌面后端
+与 desktop.py 提供相同的函数，但不操作真实的窗口和鼠标：
+每次点击后经过一段随机延迟，"屏幕"上会出现一个新的二维码，用于压力测试和在非Windows环境下调试
+"""
+
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import qrcode
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+SCREEN_SIZE = (1920, 1080)
+QR_POSITION = (700, 420)  # 二维码在模拟屏幕上的位置
+QR_SIZE = 180
+QR_DELAY = (0.8, 1.6)  # 点击后二维码出现的延迟范围（秒）
+WINDOW_MISSING_RATE = 0.0  # 模拟找不到微信窗口的概率
+
+_lock = threading.Lock()
+_blank_frame = None
+_pending_frame = None  # 点击后即将出现的截图
+_appear_at = None  # 二维码出现的时间
+
+
+def configure(qr_delay=None, window_missing_rate=None):
+    """调整模拟参数"""
+    global QR_DELAY, WINDOW_MISSING_RATE
+    if qr_delay is not None:
+        QR_DELAY = tuple(qr_delay)
+    if window_missing_rate is not None:
+        WINDOW_MISSING_RATE = float(window_missing_rate)
+
+
+def _get_blank_frame():
+    global _blank_frame
+    if _blank_frame is None:
+        _blank_frame = Image.new("RGB", SCREEN_SIZE, "#F5F5F5")
+    return _blank_frame
+
+
+def make_payload():
+    """生成与舞萌DX登录二维码格式一致的内容：SGWCMAID + 时间戳(北京时间) + 64位十六进制"""
+    digest = (uuid4().hex + uuid4().hex).upper()
+    issued_at = datetime.now(timezone(timedelta(hours=8)))
+    return "SGWCMAID" + issued_at.strftime("%y%m%d%H%M%S") + digest
+
+
+def kill_wechat_process():
+    """模拟结束微信进程：清空屏幕上的二维码"""
+    global _pending_frame, _appear_at
+    with _lock:
+        _pending_frame = None
+        _appear_at = None
+
+
+def find_wechat_window_by_process():
+    """模拟查找微信窗口，按 WINDOW_MISSING_RATE 概率找不到"""
+    if random.random() < WINDOW_MISSING_RATE:
+        return None
+    return 1
+
+
+def activate_window(hwnd, background=False):
+    return True
+
+
+def click(x, y, hwnd=None):
+    """模拟点击：生成一个新的二维码，在随机延迟后出现在屏幕上（后台模式同样处理）"""
+    global _pending_frame, _appear_at
+    frame = _get_blank_frame().copy()
+    qr = qrcode.QRCode(border=4)
+    qr.add_data(make_payload())
+    qr.make(fit=True)
+    # 使用整数倍的模块尺寸，避免缩放产生的锯齿影响识别
+    qr.box_size = max(1, QR_SIZE // (qr.modules_count + 8))
+    frame.paste(qr.make_image().convert("RGB"), QR_POSITION)
+    with _lock:
+        _pending_frame = frame
+        _appear_at = time.time() + random.uniform(*QR_DELAY)
+
+
+def minimize_window(hwnd):
+    pass
+
+
+def capture_screen(hwnd=None, background=False):
+    """模拟截屏：二维码出现之前返回空白画面"""
+    with _lock:
+        if _pending_frame is not None and time.time() >= _appear_at:
+            return _pending_frame
+    return _get_blank_frame()
+
+
+def capture_window(hwnd, background=False):
+    """模拟截取微信主窗口：窗口占满整个模拟屏幕"""
+    return capture_screen(hwnd), (0, 0) + SCREEN_SIZE
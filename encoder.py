@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QRmai 二维码生成模块
+先根据二维码内容生成模块矩阵，再输出为图片、皮肤合成用的蒙版或SVG：
+- 安装了 segno 时优先使用（比纯Python实现的 qrcode 快得多），没有安装时使用 qrcode
+- 按内容自动选择最小的版本；纠错级别默认为L：二维码显示在手机屏幕上几乎没有污损，
+  纠错级别越低版本越小、每个模块越大，扫码器越容易识别
+- 单独输出的图片和SVG使用标准规定的4个模块宽的空白（quiet zone）；与皮肤合成时皮肤本身的背景
+  就是空白，四周的空白宽度可调
+"""
+
+import functools
+import importlib.util
+
+from PIL import Image
+
+ENGINES = ("auto", "qrcode", "segno")
+ERROR_CORRECTION_LEVELS = ("L", "M", "Q", "H")
+QUIET_ZONE = 4  # 标准规定的四周空白宽度（模块数）
+
+
+def resolve_engine(engine="auto"):
+    """auto 时安装了 segno 就使用 segno，否则使用 qrcode"""
+    if engine == "auto":
+        return "segno" if importlib.util.find_spec("segno") else "qrcode"
+    if engine not in ENGINES:
+        raise ValueError(f"未知的二维码生成库: {engine}")
+    return engine
+
+
+def _matrix_qrcode(data, error_correction):
+    import qrcode
+    from qrcode import constants
+
+    qr = qrcode.QRCode(
+        error_correction=getattr(constants, f"ERROR_CORRECT_{error_correction}"),
+        border=0,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return tuple(tuple(row) for row in qr.get_matrix())
+
+
+def _matrix_segno(data, error_correction):
+    import segno
+
+    qr = segno.make_qr(data, error=error_correction.lower(), boost_error=False)
+    return tuple(tuple(bool(v) for v in row) for row in qr.matrix)
+
+
+@functools.lru_cache(maxsize=8)
+def make_matrix(data, error_correction="L", engine="auto"):
+    """
+    生成二维码的模块矩阵（最小版本，不含四周空白），同一内容的PNG和SVG共用
+    :return: 每行为一个bool元组，True为深色模块
+    """
+    if error_correction not in ERROR_CORRECTION_LEVELS:
+        raise ValueError(f"未知的纠错级别: {error_correction}")
+    if resolve_engine(engine) == "segno":
+        return _matrix_segno(data, error_correction)
+    return _matrix_qrcode(data, error_correction)
+
+
+def _module_image(matrix, border, dark, light):
+    """每个模块1像素的灰度图像"""
+    count = len(matrix)
+    image = Image.frombytes(
+        "L",
+        (count, count),
+        bytes(dark if v else light for row in matrix for v in row),
+    )
+    if border:
+        canvas = Image.new("L", (count + border * 2, count + border * 2), light)
+        canvas.paste(image, (border, border))
+        image = canvas
+    return image
+
+
+def make_image(matrix, border=QUIET_ZONE, box_size=10):
+    """生成白底黑色二维码的灰度图像，每个模块 box_size 像素"""
+    image = _module_image(matrix, border, 0, 255)
+    return image.resize(
+        (image.width * box_size, image.height * box_size), Image.NEAREST
+    )
+
+
+def make_mask(matrix, border, size):
+    """
+    生成 size x size 的蒙版（深色模块为255，其余为0），用于在皮肤上直接绘制二维码
+    """
+    return _module_image(matrix, border, 255, 0).resize((size, size), Image.NEAREST)
+
+
+def make_svg(matrix, border=QUIET_ZONE):
+    """
+    生成SVG：每行连续的深色模块合并为一段路径，不进行任何栅格化
+    :return: SVG字节数据
+    """
+    runs = []
+    for y, row in enumerate(matrix, border):
+        x = 0
+        while x < len(row):
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < len(row) and row[x]:
+                x += 1
+            runs.append(f"M{start + border} {y}h{x - start}v1H{start + border}z")
+    size = len(matrix) + border * 2
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" '
+        f'shape-rendering="crispEdges"><rect width="{size}" height="{size}" '
+        f'fill="#fff"/><path d="{"".join(runs)}"/></svg>'
+    ).encode("ascii")
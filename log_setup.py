@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QRmai 日志模块
+请求线程只把日志记录放入队列，由后台线程（QueueListener）写入文件和控制台：
+- 日志文件按日期命名（logs/YYYY-MM-DD.log），跨天时自动切换到新文件，并删除超过保留天数的旧文件
+- 短时间内重复出现的相同INFO及以下级别日志（如等待请求完成的循环）只记录一次，间隔结束或停止时
+  汇总省略的次数，警告和错误不受限制
+- 可选紧凑的JSON行格式，便于其他工具解析
+"""
+
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+LOG_FORMATS = ("text", "json")
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_listener = None
+_queue_handler = None
+_file_handler = None
+_console_handler = None
+_rate_limit_filter = None
+_flush_thread = None
+_flush_stop = threading.Event()
+FLUSH_INTERVAL = 1  # 检查重复日志的间隔是否结束的频率（秒）
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+
+
+def make_formatter(log_format):
+    if log_format == "json":
+        return JsonFormatter()
+    return logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+
+
+class DailyFileHandler(logging.FileHandler):
+    """
+    按日期写入 logs/YYYY-MM-DD.log，跨天时切换到新文件
+    切换时删除超过 retention_days 天的旧日志，retention_days 为0时不删除
+    """
+
+    def __init__(self, logs_dir, retention_days=14, encoding="utf-8"):
+        self.logs_dir = logs_dir
+        self.retention_days = retention_days
+        self.current_date = time.strftime("%Y-%m-%d")
+        super().__init__(self._path_for(self.current_date), encoding=encoding)
+        self.remove_expired()
+
+    def _path_for(self, date):
+        return os.path.join(self.logs_dir, date + ".log")
+
+    def emit(self, record):
+        date = time.strftime("%Y-%m-%d", time.localtime(record.created))
+        if date != self.current_date:
+            self.acquire()
+            try:
+                self.close()
+                self.current_date = date
+                self.baseFilename = os.path.abspath(self._path_for(date))
+            finally:
+                self.release()
+            self.remove_expired()
+        super().emit(record)
+
+    def remove_expired(self):
+        """删除超过保留天数的日志文件"""
+        if not self.retention_days:
+            return
+        cutoff = datetime.date.today() - datetime.timedelta(days=self.retention_days)
+        for name in os.listdir(self.logs_dir):
+            stem, ext = os.path.splitext(name)
+            if ext != ".log":
+                continue
+            try:
+                file_date = datetime.datetime.strptime(stem, "%Y-%m-%d").date()
+            except ValueError:
+                continue
+            if file_date < cutoff:
+                try:
+                    os.remove(os.path.join(self.logs_dir, name))
+                except OSError:
+                    pass
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    相同的INFO及以下级别日志（同一logger、级别和内容）在 interval 秒内只放行一次，
+    间隔结束时（或下一次放行时）记录期间省略的次数；interval 为0时不限制。
+    警告和错误每条都放行，以免漏掉不同请求各自的失败
+    """
+
+    MAX_KEYS = 1000
+
+    def __init__(self, interval=10):
+        super().__init__()
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._seen = {}  # {(logger, 级别, 内容): [上次放行时间, 省略次数]}
+
+    def filter(self, record):
+        if not self.interval or record.levelno > logging.INFO:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        now = record.created
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is not None and now - entry[0] < self.interval:
+                entry[1] += 1
+                return False
+
+            suppressed = entry[1] if entry is not None else 0
+            if len(self._seen) >= self.MAX_KEYS:
+                # 清理已过期且没有待汇总次数的记录，避免内容各不相同的日志撑大字典
+                self._seen = {
+                    k: v
+                    for k, v in self._seen.items()
+                    if now - v[0] < self.interval or v[1]
+                }
+            self._seen[key] = [now, 0]
+
+        if suppressed:
+            record.msg = self._summary(record.getMessage(), suppressed)
+            record.args = None
+        return True
+
+    def _summary(self, message, suppressed):
+        return f"{message}（{self.interval}秒内重复{suppressed}次已省略）"
+
+    def flush(self, handler, force=False):
+        """
+        将间隔已结束（force 时为全部）的省略次数作为单独的日志交给 handler，不再经过本过滤器
+        """
+        now = time.time()
+        pending = []
+        with self._lock:
+            for key, entry in list(self._seen.items()):
+                if not force and now - entry[0] < self.interval:
+                    continue
+                del self._seen[key]
+                if entry[1]:
+                    pending.append((key, entry[1]))
+
+        for (name, level, message), suppressed in pending:
+            record = logging.makeLogRecord(
+                {
+                    "name": name,
+                    "levelno": level,
+                    "levelname": logging.getLevelName(level),
+                    "msg": self._summary(message, suppressed),
+                }
+            )
+            handler.emit(record)
+
+
+def setup_logging(logs_dir, retention_days=14, log_format="text", rate_limit=10):
+    """
+    配置根logger：请求线程只将日志放入队列，由后台线程写入文件和控制台
+    :param logs_dir: 日志文件夹
+    :param retention_days: 日志保留天数，0为永久保留
+    :param log_format: text 或 json（每行一条JSON）
+    :param rate_limit: 相同日志的最短记录间隔（秒），0为不限制
+    """
+    global _listener, _queue_handler, _file_handler, _console_handler
+    global _rate_limit_filter, _flush_thread
+
+    if not os.path.exists(logs_dir):
+        os.makedirs(logs_dir)
+
+    stop()
+
+    _file_handler = DailyFileHandler(logs_dir, retention_days)
+    _console_handler = logging.StreamHandler()
+    for handler in (_file_handler, _console_handler):
+        handler.setLevel(logging.INFO)
+        handler.setFormatter(make_formatter(log_format))
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    _rate_limit_filter = RateLimitFilter(rate_limit)
+    _queue_handler.addFilter(_rate_limit_filter)
+
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    # 避免重复添加handler
+    if root.handlers:
+        root.handlers.clear()
+    root.addHandler(_queue_handler)
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, _file_handler, _console_handler, respect_handler_level=True
+    )
+    _listener.start()
+
+    # 相同日志的间隔结束后，即使没有再次出现也记录期间省略的次数
+    _flush_stop.clear()
+    _flush_thread = threading.Thread(
+        target=_flush_loop,
+        args=(_rate_limit_filter, _queue_handler),
+        name="log-flush",
+        daemon=True,
+    )
+    _flush_thread.start()
+    return root
+
+
+def _flush_loop(rate_limit_filter, handler):
+    while not _flush_stop.wait(FLUSH_INTERVAL):
+        rate_limit_filter.flush(handler)
+
+
+def apply_config(log_config):
+    """按配置调整日志格式、保留天数和重复日志的记录间隔，修改配置后无需重启"""
+    if _file_handler is None:
+        return
+    _file_handler.retention_days = log_config["retention_days"]
+    _rate_limit_filter.interval = log_config["rate_limit"]
+    for handler in (_file_handler, _console_handler):
+        handler.setFormatter(make_formatter(log_config["format"]))
+
+
+def set_console_level(level):
+    """调整控制台输出的日志级别，文件中仍记录完整日志"""
+    if _console_handler is not None:
+        _console_handler.setLevel(level)
+
+
+def stop():
+    """停止后台写日志线程，记录尚未汇总的省略次数并写完队列中剩余的日志"""
+    global _listener, _flush_thread
+    if _flush_thread is not None:
+        _flush_stop.set()
+        _flush_thread.join()
+        _flush_thread = None
+    if _listener is not None:
+        _rate_limit_filter.flush(_queue_handler, force=True)
+        _listener.stop()
+        _listener = None
+        _file_handler.close()
+
+
+atexit.register(stop)
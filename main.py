@@ -1,11 +1,40 @@
 # 标准库导入
-import json  # JSON操作库
 import os
 import sys
+import math
 import time  # 时间相关操作
 import logging
+import threading
+import importlib
+import importlib.util
 from io import BytesIO  # 用于处理字节流
 
+import log_setup  # 异步、按日期切换的日志
+
+# 启动耗时统计，使用 --profile-startup 参数启动时打印
+_startup_begin = time.perf_counter()
+PROFILE_STARTUP = "--profile-startup" in sys.argv
+startup_timings = []  # [(阶段名称, 耗时ms)]
+
+
+def record_startup_phase(name, start):
+    """记录一个启动阶段的耗时，返回当前时间便于连续计时"""
+    now = time.perf_counter()
+    startup_timings.append((name, (now - start) * 1000))
+    return now
+
+
+def print_startup_profile():
+    """打印各启动阶段的耗时"""
+    total = (time.perf_counter() - _startup_begin) * 1000
+    print("启动耗时分析:")
+    for name, elapsed in startup_timings:
+        print(f"  {elapsed:8.1f} ms  {name}")
+    print(f"  {total:8.1f} ms  总计（进程启动到开始监听）")
+
+
+_phase_start = time.perf_counter()
+
 # Flask框架相关模块
 from flask import (
     Flask,
@@ -18,9 +47,7 @@ from flask import (
     jsonify,
 )
 
-# 外部库导入
-import psutil  # 进程管理库
-import subprocess  # 用于运行系统命令
+_phase_start = record_startup_phase("导入 flask", _phase_start)
 
 
 def resource_path(relative_path):
@@ -45,190 +72,232 @@ def setup_logging():
     # 创建logs文件夹路径
     logs_dir = os.path.join(base_path, "logs")
 
-    # 如果logs文件夹不存在，则创建
-    if not os.path.exists(logs_dir):
-        os.makedirs(logs_dir)
+    # 日志通过队列由后台线程写入 logs/YYYY-MM-DD.log，跨天自动切换文件
+    logger = log_setup.setup_logging(logs_dir)
 
-    # 日志文件名（按日期）
-    log_file = os.path.join(logs_dir, time.strftime("%Y-%m-%d") + ".log")
+    return logger, logs_dir
 
-    # 配置logging
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
 
-    # 避免重复添加handler
-    if logger.handlers:
-        logger.handlers.clear()
+# 初始化日志
+logger, logs_dir = setup_logging()
+logger.info("日志系统初始化")
 
-    # 创建文件handler，写入日志文件
-    file_handler = logging.FileHandler(log_file, encoding="utf-8")
-    file_handler.setLevel(logging.INFO)
+# Flask/werkzeug日志传递给根logger，使用相同的日志文件和格式
+logging.getLogger("werkzeug").setLevel(logging.INFO)
+_phase_start = record_startup_phase("初始化日志", _phase_start)
 
-    # 创建控制台handler
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
+# 图像处理（PIL、qrcode）和解码库较重，在 qrmai_action 中首次使用时导入，
+# 或者启动后由 preload_modules 在后台线程中提前导入
+from uuid import uuid4
 
-    # 设置日志格式
-    formatter = logging.Formatter(
-        "%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
-    )
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
+import decode_scheduler  # 自适应解码调度
+import config_store  # 配置快照和热加载
+import circuit_breaker  # 连续失败时熔断获取流程
+import desktop_actor  # 桌面操作线程和各阶段时限
 
-    # 添加handler
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+# 桌面后端（窗口操作、鼠标点击、截屏），首次使用时按配置加载
+_desktop_backend = None
 
-    return logger, logs_dir
 
+def get_desktop_backend():
+    """
+    获取桌面后端模块
+    windows: desktop.py，操作真实的微信窗口
+    simulated: desktop_sim.py，模拟桌面，用于压力测试和非Windows环境调试
+    """
+    global _desktop_backend
+    if _desktop_backend is None:
+        if config_store.get().get("desktop_backend") == "simulated":
+            import desktop_sim as backend
+        else:
+            import desktop as backend
+        _desktop_backend = backend
+        logger.info(f"已加载桌面后端: {backend.__name__}")
+    return _desktop_backend
 
-# 初始化日志
-logger, logs_dir = setup_logging()
-logger.info("日志系统初始化")
 
-# 配置Flask/werkzeug日志，使用相同的日志文件和格式
-werkzeug_logger = logging.getLogger("werkzeug")
-werkzeug_logger.setLevel(logging.INFO)
-werkzeug_handler = logging.FileHandler(
-    os.path.join(logs_dir, time.strftime("%Y-%m-%d") + ".log"), encoding="utf-8"
-)
-werkzeug_handler.setLevel(logging.INFO)
-werkzeug_formatter = logging.Formatter(
-    "%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
-)
-werkzeug_handler.setFormatter(werkzeug_formatter)
-werkzeug_logger.addHandler(werkzeug_handler)
+# 读取配置文件（整个进程只读取一次，之后由后台线程在文件被修改时重新加载）
+config_needs_save = config_store.init(resource_path("config.json"))
+_phase_start = record_startup_phase("读取配置", _phase_start)
 
+# 初始化Flask应用
+app = Flask(__name__, template_folder=resource_path("templates"))
+app.secret_key = str(uuid4())  # 在生产环境中应该使用更安全的密钥
 
-# 图形界面自动化和图像处理相关库
-from pynput.mouse import Controller as MouseController, Button  # 鼠标控制库
-import pygetwindow as gw  # 窗口管理库
-import qrcode  # 二维码生成库
-from PIL import Image, ImageDraw, ImageFont  # 图像处理库
-from mss import mss  # 屏幕截图库
-from pyzbar.pyzbar import decode  # 二维码解码库
-from uuid import uuid4
+# 点击"检查更新"时，缓存超过该时间（秒）会在后台重新检查
+UPDATE_RECHECK_AGE = 60
+
+
+class QrCache:
+    """一个档案（默认为全局配置）的二维码缓存和最近一次获取流程的结果"""
+
+    def __init__(self, name=None):
+        self.name = name  # 档案名称，全局配置为None
+        self.lock = threading.Lock()  # 请求锁，同一档案的请求依次处理
+        self.payload = None  # 上次获取到的二维码内容
+        self.png = None  # 上次生成的二维码PNG，只通过 /payload 获取过内容时为None
+        self.svg = None  # 上次生成的二维码SVG
+        self.time = 0  # 上次生成二维码的时间戳
+        self.finish_time = 0  # 上次获取流程完成的时间戳
+        self.error = None  # 上次获取流程失败的原因，成功时为None
+        self.stage_timings = {}  # 上次获取流程各阶段的耗时（毫秒）
+        # 该档案的熔断器，打开后在后台用该档案的配置试探
+        self.breaker = circuit_breaker.CircuitBreaker(
+            probe=lambda: probe_pipeline(self), name=name
+        )
 
-# Windows API 相关库用于操作进程窗口
-import ctypes
-from ctypes import wintypes
-from win32 import win32gui, win32process
-import win32con
-
-# 初始化鼠标控制器
-mouse = MouseController()
-
-# 以下两行代码修复了Win10在系统缩放下第一次请求时鼠标移动位置偏移的bug
-# 导入 Shcore.dll
-shcore = ctypes.windll.shcore
-# 设置 DPI 感知模式：0 = 无感知，1 = 系统级感知，2 = 每显示器感知
-shcore.SetProcessDpiAwareness(2)  # 每显示器高 DPI 感知
-
-
-def get_default_config():
-    """获取默认配置项"""
-    return {
-        "p1": [1087, 799],
-        "p2": [945, 682],
-        "token": "qrmai",
-        "host": "0.0.0.0",
-        "port": 5000,
-        "qr_route": "/qrmai",  # 二维码访问路径
-        "cache_duration": 60,
-        "standalone_mode": False,
-        "decode": {"time": 10, "retry_count": 10},
-        "skin_format": "new",
-        "custom_skin_path": "./skin.png",
-        "custom_skin_qrcode_size": 576,
-        "custom_skin_qrcode_point": [106, 638],
-        "dev_mode": False,
-    }
 
+_qr_caches_lock = threading.Lock()
+_qr_caches = {None: QrCache()}  # {档案名称: QrCache}
+desktop_queue = desktop_actor.DesktopQueue()  # 各档案的获取流程轮流使用桌面
+last_stage_timings = {}  # 最近一次获取流程（任意档案）各阶段的耗时（毫秒）
+
+
+def get_qr_cache(name=None):
+    """获取档案的二维码缓存，第一次访问该档案时创建"""
+    with _qr_caches_lock:
+        cache = _qr_caches.get(name)
+        if cache is None:
+            cache = _qr_caches[name] = QrCache(name)
+        return cache
+
+
+# 运行统计，可通过 /metrics 查看
+metrics_lock = threading.Lock()
+metrics = {
+    "qr_requests": 0,  # 二维码请求总数
+    "pipeline_runs": 0,  # 实际执行获取流程的次数
+    "pipeline_failures": 0,  # 获取流程失败（找不到窗口/解码超时）的次数
+    "cache_hits": 0,  # 直接返回缓存的次数
+    "coalesced": 0,  # 等待期间由其他请求生成了新二维码、直接复用的次数
+    "circuit_rejections": 0,  # 熔断器打开期间直接返回错误的次数
+    "pipeline_aborts": 0,  # 某个阶段超时或超过总时限而中止的次数
+    "stale_rejections": 0,  # 因生成时间早于本次点击而丢弃的旧二维码数量（每次流程中同一个二维码只计一次）
+}
+
+
+def on_config_changed(old, new):
+    """配置变更回调：应用日志和熔断设置；全局配置或档案的点击坐标变更后，之前学习到的解码耗时分布不再适用"""
+    log_setup.apply_config(new["log"])
+    circuit_breaker.configure(**new["circuit_breaker"])
+    if old is None:
+        return
+    for name in (None, *new["profiles"]):
+        try:
+            old_profile = config_store.get_profile(old, name)
+        except KeyError:
+            continue
+        new_profile = config_store.get_profile(new, name)
+        if (old_profile["p1"], old_profile["p2"]) != (
+            new_profile["p1"],
+            new_profile["p2"],
+        ):
+            decode_scheduler.reset(new_profile["p1"], new_profile["p2"], name)
 
-def ensure_config_completeness(config):
-    """确保配置项完整，缺失的项用默认值补全"""
-    default_config = get_default_config()
 
-    # 检查并补全顶层配置项
-    for key, default_value in default_config.items():
-        if key not in config:
-            config[key] = default_value
-        # 对于嵌套字典，也需要检查完整性
-        elif isinstance(default_value, dict) and isinstance(config[key], dict):
-            for sub_key, sub_default_value in default_value.items():
-                if sub_key not in config[key]:
-                    config[key][sub_key] = sub_default_value
+on_config_changed(None, config_store.get())
+config_store.add_listener(on_config_changed)
 
-    return config
 
+def count_metric(name, value=1):
+    """累加运行统计"""
+    with metrics_lock:
+        metrics[name] += value
 
-def kill_wechat_process():
-    """
-    杀死WeChatAppEx.exe进程
-    """
-    try:
-        # 方法1: 使用psutil查找并终止进程
-        killed_any = False
-        for proc in psutil.process_iter(["pid", "name"]):
-            if proc.info["name"] and "WeChatAppEx.exe" in proc.info["name"]:
-                proc.kill()  # 终止进程
-                logger.info(f"已杀死微信进程，PID: {proc.info['pid']}")
-                killed_any = True
-
-        if not killed_any:
-            logger.info("未找到可杀死的WeChatAppEx.exe进程")
-    except psutil.NoSuchProcess:
-        logger.info("微信进程已终止")
-    except psutil.AccessDenied:
-        logger.warning("尝试杀死微信进程时访问被拒绝 - 可能需要提升权限")
-    except Exception as e:
-        logger.error(f"杀死微信进程时出错: {e}")
-        # 备用方法: 尝试使用taskkill命令
+
+def get_preload_modules():
+    """需要预加载的重量级模块，按首次请求中用到的顺序排列"""
+    config = config_store.get()
+    modules = ["PIL.Image", "PIL.ImageDraw", "PIL.ImageFont", "qrcode", "encoder"]
+    if config["qr"]["engine"] == "segno" or (
+        config["qr"]["engine"] == "auto" and importlib.util.find_spec("segno")
+    ):
+        modules.append("segno")
+    modules.append("decoder")
+    if config["decode"]["backend"] == "opencv":
+        modules += ["numpy", "cv2"]
+    else:
+        modules.append("pyzbar.pyzbar")  # 会加载zbar动态库
+    modules.append("updater")
+    return modules
+
+
+def preload_modules():
+    """导入重量级模块并加载桌面后端，让第一个请求不必等待导入"""
+    for name in get_preload_modules():
+        start = time.perf_counter()
         try:
-            subprocess.run(
-                ["taskkill", "/f", "/im", "WeChatAppEx.exe"],
-                creationflags=subprocess.CREATE_NO_WINDOW,
-                check=True,
-            )
-            logger.info("使用taskkill命令杀死微信进程")
-        except subprocess.CalledProcessError:
-            logger.warning("使用taskkill命令杀死微信进程失败")
+            importlib.import_module(name)
+        except Exception as e:
+            logger.warning(f"预加载模块 {name} 失败: {e}")
+        record_startup_phase(f"导入 {name}", start)
 
+    start = time.perf_counter()
+    try:
+        get_desktop_backend()
+    except Exception as e:
+        logger.warning(f"加载桌面后端失败: {e}")
+    record_startup_phase("加载桌面后端", start)
 
-# 读取配置文件
-config = {}
-config_path = resource_path("config.json")
-if os.path.exists(config_path):
-    with open(config_path, "r", encoding="utf-8") as f:
-        config = json.load(f)
 
-# 确保配置项完整
-config = ensure_config_completeness(config)
+# 启动预热状态，可通过 /healthz 查看
+# status: warming 预热中，ok 全部阶段完成，degraded 有阶段出错（errors 中为各阶段的错误）
+warmup_state = {"status": "warming", "ms": None, "stages": {}, "errors": {}}
+WARMUP_PAYLOAD = "SGWCMAID000000000000" + "0" * 64  # 预热用的二维码内容
 
-# 更新配置版本信息（如果尚未存在）
-if "version" not in config:
-    import hashlib
-    import time
-    import os
 
-    try:
-        config_version = hashlib.md5(
-            (config["token"] + str(os.path.getmtime(config_path))).encode()
-        ).hexdigest()
-    except FileNotFoundError:
-        config_version = hashlib.md5(
-            (config["token"] + str(time.time())).encode()
-        ).hexdigest()
-    config["version"] = config_version
+def warm_up():
+    """
+    启动预热：预加载模块后，用合成截图把截屏、解码、生成二维码、皮肤合成和PNG编码各执行一次，
+    让zbar动态库、mss、字体和Pillow编码器的初始化不落在第一个请求上。
+    各阶段单独执行，某个阶段出错（如无桌面的会话中无法截屏）不影响其他阶段
+    """
+    start = time.perf_counter()
+    stages = warmup_state["stages"]
+    errors = warmup_state["errors"]
+    config = config_store.get()
 
-# 初始化Flask应用
-app = Flask(__name__, template_folder=resource_path("templates"))
-app.secret_key = str(uuid4())  # 在生产环境中应该使用更安全的密钥
+    def run_stage(name, func):
+        stage_start = time.perf_counter()
+        try:
+            return func()
+        except Exception as e:
+            errors[name] = str(e)
+            logger.warning(f"启动预热 {name} 阶段出错: {e}")
+        finally:
+            stages[name] = round((time.perf_counter() - stage_start) * 1000, 1)
+            record_startup_phase(f"预热 {name}", stage_start)
+
+    def warm_up_decode():
+        import qrcode
+        from PIL import Image
+        import decoder
+
+        # 在空白画面上放一个二维码作为合成截图
+        frame = Image.new("RGB", (640, 480), "#F5F5F5")
+        frame.paste(qrcode.make(WARMUP_PAYLOAD).convert("RGB"), (100, 60))
+        if not decoder.decode_frame(frame, config["decode"], first_only=True):
+            raise RuntimeError("未能识别合成截图中的二维码")
 
-# 添加全局变量用于缓存
-request_lock = False  # 请求锁，防止并发访问
-last_qr_bytes = None  # 上次生成的二维码字节数据
-last_qr_time = 0  # 上次生成二维码的时间戳
+    try:
+        preload_modules()
+        run_stage(
+            "capture",
+            lambda: desktop_actor.run_stage(
+                "capture",
+                get_desktop_backend().capture_screen,
+                timeout=config["stage_timeouts"]["capture"],
+            ),
+        )
+        run_stage("decode", warm_up_decode)
+        run_stage("render", lambda: render_qr_image(WARMUP_PAYLOAD, config))
+        run_stage("error_images", prerender_error_images)
+    finally:
+        warmup_state["ms"] = round((time.perf_counter() - start) * 1000, 1)
+        warmup_state["status"] = "degraded" if errors else "ok"
+        logger.info(
+            f"启动预热完成（{warmup_state['status']}），耗时 {warmup_state['ms']}ms {stages}"
+        )
 
 
 def require_auth(f):
@@ -242,9 +311,9 @@ def require_auth(f):
             return redirect(url_for("login"))
 
         # 检查配置版本是否匹配（增强安全性）
-        if "config_version" not in session or session["config_version"] != config.get(
-            "version"
-        ):
+        if "config_version" not in session or session[
+            "config_version"
+        ] != config_store.get().get("version"):
             # 配置已更改，需要重新登录
             session.pop("authenticated", None)
             session.pop("config_version", None)
@@ -258,6 +327,7 @@ def require_auth(f):
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
+        config = config_store.get()
         token = request.form.get("token")
         if token and token == config["token"]:
             session["authenticated"] = True
@@ -278,310 +348,734 @@ def logout():
     return "", 204
 
 
-def find_wechat_window_by_process():
-    """
-    通过查找Weixin.exe进程来获取微信窗口句柄
-    """
-
-    def enum_windows_callback(hwnd, windows):
-        if not win32gui.IsWindowVisible(hwnd):
-            return True
-
-        # 获取窗口关联的进程ID
-        _, pid = win32process.GetWindowThreadProcessId(hwnd)
-
-        # 根据进程ID获取进程名称
-        try:
-            process = psutil.Process(pid)
-            if process.name() and "Weixin.exe" in process.name():
-                windows.append(hwnd)
-        except (psutil.NoSuchProcess, psutil.AccessDenied):
-            pass
-
-        return True
-
-    windows = []
-    win32gui.EnumWindows(enum_windows_callback, windows)
-
-    return windows[0] if windows else None
-
-
-def qrmai_action():
+def qrmai_action(config, profile=None):
     """
     核心功能函数：执行二维码获取操作
     1. 定位并激活微信窗口
     2. 自动点击指定位置获取二维码
     3. 截屏并识别二维码
-    4. 将二维码与皮肤合成并返回
+    4. 返回二维码内容（与皮肤合成的图片由 get_cached_png 按需生成）
+    窗口、鼠标和截屏操作都在桌面操作线程中执行，每个阶段和整个流程都有时限，超时后中止并清理
+    :param config: 本次请求开始时取得的配置快照（档案请求时为档案的快照），整个流程只使用这一份配置
+    :param profile: 档案名称，全局配置为None，用于区分各档案的校准记录
+    :return: (二维码内容, None)，失败时为 (None, 失败原因)，失败原因见 ERROR_IMAGE_TEXTS
     """
-    # 创建字节流对象用于存储最终的图片数据
-    img_io = BytesIO()
+    global last_stage_timings
+
+    desktop = get_desktop_backend()
+    run = desktop_actor.PipelineRun(config["stage_timeouts"])
+    try:
+        return _qrmai_steps(config, desktop, run, profile)
+    except (desktop_actor.StageTimeout, desktop_actor.PipelineCancelled) as e:
+        logger.error(f"获取流程已中止: {e}")
+        count_metric("pipeline_failures")
+        count_metric("pipeline_aborts")
+        # 结束小程序进程，让下一次流程从头开始
+        try:
+            desktop_actor.run_stage(
+                "kill",
+                desktop.kill_wechat_process,
+                timeout=config["stage_timeouts"]["kill"],
+            )
+        except desktop_actor.StageTimeout as kill_error:
+            logger.error(f"中止后清理失败: {kill_error}")
+        return None, "aborted"
+    finally:
+        last_stage_timings = run.stages
+
+
+def _qrmai_steps(config, desktop, run, profile):
+    """qrmai_action 的具体步骤，等待和桌面操作都通过 run 执行以便超时中止"""
+    import decoder  # 二维码解码模块
 
     # 直接查找Weixin.exe进程的窗口，而不是通过标题
-    wechat_hwnd = find_wechat_window_by_process()
+    wechat_hwnd = run.call("find_window", desktop.find_wechat_window_by_process)
     if not wechat_hwnd:
         logger.warning("未找到Weixin.exe进程的窗口")
+        count_metric("pipeline_failures")
         # 杀死微信进程并返回错误信息
-        kill_wechat_process()
-        im = Image.new("L", (100, 100), "#FFFFFF")
-        font = ImageFont.load_default(size=23)
-        draw = ImageDraw.Draw(im)
-        draw.text((0, 0), "Window\nnot found", font=font, fill="#000000")
-        im.save(img_io, format="PNG")
-        img_io.seek(0)
-        return img_io
-
-    # 尝试激活窗口，添加重试机制和错误处理
-    activation_success = False
-    for attempt in range(3):  # 最多尝试3次
-        try:
-            # 恢复窗口（如果被最小化）
-            win32gui.ShowWindow(wechat_hwnd, win32con.SW_RESTORE)
-            # 将窗口置于前台并激活
-            win32gui.SetForegroundWindow(wechat_hwnd)
-            # 设置窗口为最顶层
-            win32gui.SetWindowPos(
-                wechat_hwnd,
-                win32con.HWND_TOPMOST,
-                0,
-                0,
-                0,
-                0,
-                win32con.SWP_NOMOVE | win32con.SWP_NOSIZE,
-            )
-            activation_success = True
-            break
-        except Exception as e:
-            logger.warning(f"第 {attempt + 1} 次尝试激活窗口失败: {e}")
-            time.sleep(1)  # 等待1秒后重试
-            pass
+        run.call("kill", desktop.kill_wechat_process)
+        return None, "window_not_found"
+
+    # 后台模式下向微信窗口发送点击消息、截取窗口自身的内容，不激活窗口也不移动鼠标
+    background = config["input_mode"] == "background"
+    click_hwnd = wechat_hwnd if background else None
+
+    # 尝试激活窗口（后台模式下只恢复最小化的窗口）
+    activation_success = run.call(
+        "activate", desktop.activate_window, wechat_hwnd, background
+    )
 
     # 如果激活窗口失败，给出友好提示
     if not activation_success:
         logger.warning("无法激活微信窗口，将继续执行后续操作")
         # 不中断流程，继续执行后续操作
 
-    def move_click(x, y):
-        """
-        移动鼠标并点击的辅助函数
-        :param x: x坐标
-        :param y: y坐标
-        """
-
-        mouse.position = (x, y)
-        mouse.click(Button.left, 1)
+    # 生成时间早于点击p1（减去允许的时钟误差）的二维码是聊天中残留的旧二维码
+    not_before = time.time() - config["decode"]["stale_tolerance"]
+    # 上一次流程返回的二维码可能还留在屏幕上，它以及更早的二维码都不能再次返回
+    previous = get_qr_cache(profile).payload
+    previous = previous.encode("utf-8") if previous else None
 
-    # 点击第一个位置(p1) - 通常是"舞萌 | 中二服务号生成二维码按钮的位置"
-    move_click(config["p1"][0], config["p1"][1])
+    if config["calibration"]["enabled"]:
+        # 按窗口位置和模板校准点击坐标
+        p1, p2, p2_frame, window_rect = _calibrated_click_p1(
+            config, desktop, run, wechat_hwnd, profile
+        )
+    else:
+        p1, p2, p2_frame, window_rect = config["p1"], config["p2"], None, None
+        # 点击第一个位置(p1) - 通常是"舞萌 | 中二服务号生成二维码按钮的位置"
+        run.call("click", desktop.click, p1[0], p1[1], click_hwnd)
 
-    # 等待2秒确保界面响应
-    time.sleep(2)
+        # 等待2秒确保界面响应
+        run.sleep(2)
 
     # 点击第二个位置(p2) - 通常是"生成后的二维码的消息的位置"
-    move_click(config["p2"][0], config["p2"][1])
+    run.call("click", desktop.click, p2[0], p2[1], click_hwnd)
+    p2_click_time = time.time()
+
+    # 根据历史耗时生成本次的解码尝试时间点（相对于点击p2的秒数）
+    schedule = decode_scheduler.build_schedule(
+        config["decode"], config["p1"], config["p2"], profile
+    )
+    last_attempt_offset = 0
 
     # 初始化解码结果
-    decoded_objects = None
+    newest = None
+    # 本次流程中已经丢弃过的旧二维码内容，每次截图都会再次识别到，只计数一次
+    stale_payloads = set()
 
-    # 最小化微信窗口以减少干扰
+    # 最小化微信窗口以减少干扰（后台模式下窗口没有被激活，也不能最小化）
     # 这里需要处理基于窗口句柄的最小化
-    try:
-        time.sleep(0.2)  # 等待0.2秒再最小化，以免还没有点击到二维码就最小化了
-        win32gui.ShowWindow(wechat_hwnd, win32con.SW_MINIMIZE)
-    except:
-        pass
-
-    # 根据配置进行多次尝试解码二维码
-    for i in range(config["decode"]["retry_count"]):
-        # 每次尝试间隔一定时间
-        time.sleep(config["decode"]["time"] / config["decode"]["retry_count"])
-
-        # 使用mss截取整个屏幕
-        with mss() as sct:
-            # monitors[1] 表示第一个显示器
-            screenshot = sct.grab(sct.monitors[1])
-            # 将截图转换为PIL图像对象
-            image = Image.frombytes("RGB", screenshot.size, screenshot.rgb)
+    if not background:
+        run.sleep(0.2)  # 等待0.2秒再最小化，以免还没有点击到二维码就最小化了
+        try:
+            run.call("minimize", desktop.minimize_window, wechat_hwnd)
+        except (desktop_actor.StageTimeout, desktop_actor.PipelineCancelled):
+            raise
+        except Exception:
+            pass
+
+    # 按调度时间点多次尝试解码二维码
+    for i, offset in enumerate(schedule):
+        # 等待到下一个尝试时间点
+        run.sleep(p2_click_time + offset - time.time())
+        attempt_offset = time.time() - p2_click_time
+
+        # 截取屏幕
+        image = run.call("capture", desktop.capture_screen, wechat_hwnd, background)
 
         # 解码二维码
-        decoded_objects = decode(image)
+        decoded_objects = run.timed(
+            "decode", decoder.decode_frame, image, config["decode"], not_before
+        )
+        # 截图中可能还有之前的二维码消息，取最新的一个并丢弃旧二维码
+        newest, stale = decoder.select_newest(decoded_objects, not_before, previous)
+        new_stale = {obj.data for obj in stale} - stale_payloads
+        if new_stale:
+            stale_payloads |= new_stale
+            count_metric("stale_rejections", len(new_stale))
+            logger.info(f"丢弃了{len(new_stale)}个早于本次点击生成的旧二维码")
+
+        # 如果成功解码到新的二维码则跳出循环
+        if newest is not None:
+            # 二维码出现在上一次失败与本次成功之间，取中点作为本次耗时的估计
+            decode_scheduler.record_latency(
+                config["p1"],
+                config["p2"],
+                (last_attempt_offset + attempt_offset) / 2,
+                profile,
+            )
+            if p2_frame is not None:
+                # 点击p2后出现了二维码，记录二维码消息的模板
+                import calibration
 
-        # 如果成功解码到二维码则跳出循环
-        if decoded_objects and len(decoded_objects) > 0:
+                calibration.record("p2", p2_frame, p2, window_rect, profile)
             break
         else:
+            last_attempt_offset = attempt_offset
             # 如果是最后一次尝试仍然失败，则返回错误信息
-            if i == config["decode"]["retry_count"] - 1:
+            if i == len(schedule) - 1:
+                count_metric("pipeline_failures")
+                if p2_frame is not None:
+                    # 可能没有点到二维码消息，下次获取时按模板重新定位p2
+                    import calibration
+
+                    calibration.mark_stale("p2", profile)
                 # 杀死微信进程
-                kill_wechat_process()
-
-                # 创建一个提示错误的图像
-                im = Image.new("L", (100, 100), "#FFFFFF")  # 创建白色背景图像
-                font = ImageFont.load_default(size=23)  # 加载默认字体
-                draw = ImageDraw.Draw(im)  # 创建绘图对象
-                # 绘制错误信息文本
-                draw.text(
-                    (0, 0),
-                    "Unable\nto load\nQRCode\n(Timeout)",
-                    font=font,
-                    fill="#000000",
-                )
-                im.save(img_io, format="PNG")  # 保存图像到字节流
-                img_io.seek(0)  # 将指针移到开始位置
+                run.call("kill", desktop.kill_wechat_process)
 
-                return img_io  # 返回错误图像
+                # 返回失败原因，由调用方返回提示错误的图像
+                return None, "timeout"
             # 打印重试信息
             logger.info(
-                f"二维码解码失败 过{config['decode']['time'] / config['decode']['retry_count']}s后重试 ({i+1}/{config['decode']['retry_count']})"
+                f"二维码解码失败 将在点击后{schedule[i + 1]:.2f}s重试 ({i+1}/{len(schedule)})"
             )
 
-    # 使用解码得到的数据生成新的二维码
-    qr_img = qrcode.make(decoded_objects[0].data.decode("utf-8"))
+    # 杀死微信进程
+    run.call("kill", desktop.kill_wechat_process)
 
-    import os
+    # 返回二维码内容，图片在需要时由 get_cached_png 生成
+    return newest.data.decode("utf-8"), None
 
-    # 如果skin.png存在，则将二维码与皮肤合成
-    if "skin.png" in os.listdir():
 
-        if config["skin_format"] == "custom":
-            skin = Image.open(config["custom_skin_path"])
-        else:
-            skin = Image.open("skin.png")  # 打开皮肤图片
-        qr_img = qr_img.convert("RGBA")  # 转换二维码为RGBA模式
+def _calibrated_click_p1(config, desktop, run, hwnd, profile):
+    """
+    校准模式下点击p1：点击坐标按微信窗口当前的位置换算，点击前后各截取一次窗口，
+    画面有变化时记录p1的模板，没有变化时按模板重新定位p1并再点击一次；
+    上一次点击p2后没有出现二维码时，在点击p1后的截图中按模板重新定位p2
+    :return: (p1, p2, 点击p2前的窗口截图, 截图对应的窗口区域)，无法截取窗口时截图为None
+    """
+    import calibration
+
+    threshold = config["calibration"]["match_threshold"]
+    background = config["input_mode"] == "background"
+    click_hwnd = hwnd if background else None
+    before, window_rect = run.call("capture", desktop.capture_window, hwnd, background)
+    p1, p2 = calibration.resolve(config["p1"], config["p2"], window_rect, profile)
+
+    run.call("click", desktop.click, p1[0], p1[1], click_hwnd)
+    run.sleep(2)
+    if before is None:
+        return p1, p2, None, None
+
+    after, window_rect = run.call("capture", desktop.capture_window, hwnd, background)
+    if after is None:
+        return p1, p2, None, None
+    if calibration.frame_changed(before, after):
+        calibration.record("p1", before, p1, window_rect, profile)
+    else:
+        logger.warning("点击p1后微信窗口没有变化，尝试按模板重新定位")
+        located = calibration.relocate("p1", after, window_rect, threshold, profile)
+        if located:
+            p1 = located
+            run.call("click", desktop.click, p1[0], p1[1], click_hwnd)
+            run.sleep(2)
+            after, window_rect = run.call(
+                "capture", desktop.capture_window, hwnd, background
+            )
+            if after is None:
+                return p1, p2, None, None
+
+    if calibration.is_stale("p2", profile):
+        p2 = calibration.relocate("p2", after, window_rect, threshold, profile) or p2
+    return p1, p2, after, window_rect
 
-        # 获取二维码尺寸
-        width, height = qr_img.size
 
-        # 将二维码中的白色区域替换为透明
-        for x in range(width):
-            for y in range(height):
-                r, g, b, a = qr_img.getpixel((x, y))  # 获取当前像素的颜色值
-                if r > 200 and g > 200 and b > 200:  # 判断是否为接近白色的像素
-                    qr_img.putpixel((x, y), (255, 255, 255, 0))  # 替换为透明像素
+def render_qr_svg(data, config):
+    """
+    生成SVG格式的二维码（不含皮肤）
+    :return: SVG字节数据
+    """
+    import encoder
 
-        # 调整二维码大小为576x576
+    qr_config = config["qr"]
+    matrix = encoder.make_matrix(
+        data, qr_config["error_correction"], qr_config["engine"]
+    )
+    return encoder.make_svg(matrix)
+
+
+# 内置皮肤中二维码区域的左上角坐标，其他皮肤格式使用 custom_skin_qrcode_point
+SKIN_QR_POINTS = {"new": (106, 638), "old": (106, 1060)}
+SKIN_QR_SIZE = 576  # 内置皮肤中二维码区域的边长
+
+
+def render_qr_image(data, config):
+    """
+    根据二维码内容生成二维码图片，存在皮肤时按配置与皮肤合成
+    :return: 包含PNG图片的字节流
+    """
+    from PIL import Image  # 图像处理库
+    import encoder  # 二维码生成
+
+    img_io = BytesIO()
+
+    # 生成二维码的模块矩阵
+    qr_config = config["qr"]
+    matrix = encoder.make_matrix(
+        data, qr_config["error_correction"], qr_config["engine"]
+    )
+
+    import os
+
+    # 如果skin.png存在或使用自定义皮肤，则将二维码与皮肤合成
+    if "skin.png" in os.listdir() or config["skin_format"] == "custom":
         if config["skin_format"] == "custom":
+            skin = Image.open(config["custom_skin_path"])
             qrcode_size = int(config["custom_skin_qrcode_size"])
-            resized_qr = qr_img.resize((qrcode_size, qrcode_size))
         else:
-            resized_qr = qr_img.resize((576, 576))
-
-        # 根据皮肤格式配置确定粘贴位置
-        if config["skin_format"] == "new":
-            # 新版皮肤格式，二维码居中
-            skin.paste(
-                resized_qr, (106, 638), mask=resized_qr
-            )  # 使用 resize 后的图像作为 mask
-        elif config["skin_format"] == "old":
-            # 旧版皮肤格式，二维码靠下
-            skin.paste(
-                resized_qr, (106, 1060), mask=resized_qr
-            )  # 使用 resize 后的图像作为 mask
-        else:
-            qrcode_point = (
-                config["custom_skin_qrcode_point"][0],
-                config["custom_skin_qrcode_point"][1],
-            )
-            skin.paste(resized_qr, qrcode_point, mask=resized_qr)
+            skin = Image.open("skin.png")  # 打开皮肤图片
+            qrcode_size = SKIN_QR_SIZE
+        if skin.mode not in ("RGB", "RGBA"):
+            skin = skin.convert("RGBA")
+
+        # 新版皮肤二维码居中，旧版靠下，其他为用户设置的坐标
+        qrcode_point = SKIN_QR_POINTS.get(
+            config["skin_format"], tuple(config["custom_skin_qrcode_point"])
+        )
+
+        # 只在深色模块处绘制黑色，其余部分保留皮肤原有的背景，皮肤背景本身就是空白，
+        # 因此可以按 qr.border 缩小四周的空白
+        mask = encoder.make_mask(matrix, qr_config["border"], qrcode_size)
+        left, top = qrcode_point
+        skin.paste((0, 0, 0), (left, top, left + qrcode_size, top + qrcode_size), mask)
 
         # 保存合成后的图像到字节流
         skin.save(img_io, format="PNG")
+    else:
+        # 如果没有皮肤文件，则直接保存二维码，四周保留标准宽度的空白以免无法识别
+        encoder.make_image(matrix).save(img_io, format="PNG")
+
+    # 将字节流指针移到开始位置
+    img_io.seek(0)
 
-    # 如果没找到skin.png，就判断是不是自定义
-    elif config["skin_format"] == "custom":
+    return img_io
 
-        skin = Image.open(config["custom_skin_path"])  # 打开皮肤图片
-        qr_img = qr_img.convert("RGBA")  # 转换二维码为RGBA模式
 
-        # 获取二维码尺寸
-        width, height = qr_img.size
+# 错误提示图片的文字，图片在预热时生成并缓存在内存中
+ERROR_IMAGE_TEXTS = {
+    "window_not_found": "Window\nnot found",
+    "timeout": "Unable\nto load\nQRCode\n(Timeout)",
+    "aborted": "Desktop\nnot\nresponding",
+}
+# 错误提示图片的尺寸（像素），可通过 ?size= 为不同设备选择，默认100
+ERROR_IMAGE_SIZES = (100, 200, 400)
+_error_images = {}  # {(失败原因, 尺寸): PNG字节数据}
 
-        # 将二维码中的白色区域替换为透明
-        for x in range(width):
-            for y in range(height):
-                r, g, b, a = qr_img.getpixel((x, y))  # 获取当前像素的颜色值
-                if r > 200 and g > 200 and b > 200:  # 判断是否为接近白色的像素
-                    qr_img.putpixel((x, y), (255, 255, 255, 0))  # 替换为透明像素
 
-        # 调整二维码大小为用户设置的
-        qrcode_size = int(config["custom_skin_qrcode_size"])
-        resized_qr = qr_img.resize((qrcode_size, qrcode_size))
+def make_error_image(text, size=100):
+    """生成提示错误信息的图片，返回PNG字节数据"""
+    from PIL import Image, ImageDraw, ImageFont
 
-        # 获取用户设置的二维码坐标
-        qrcode_point = (
-            config["custom_skin_qrcode_point"][0],
-            config["custom_skin_qrcode_point"][1],
-        )
-        skin.paste(resized_qr, qrcode_point, mask=resized_qr)
+    img_io = BytesIO()
+    im = Image.new("L", (size, size), "#FFFFFF")  # 创建白色背景图像
+    font = ImageFont.load_default(size=23 * size // 100)  # 加载默认字体
+    draw = ImageDraw.Draw(im)  # 创建绘图对象
+    draw.text((0, 0), text, font=font, fill="#000000")  # 绘制错误信息文本
+    im.save(img_io, format="PNG")  # 保存图像到字节流
+    return img_io.getvalue()
 
-        skin.save(img_io, format="PNG")
+
+def get_error_image(kind, size=100):
+    """获取缓存的错误提示图片，未缓存时生成"""
+    key = (kind, size)
+    image = _error_images.get(key)
+    if image is None:
+        image = _error_images[key] = make_error_image(ERROR_IMAGE_TEXTS[kind], size)
+    return image
+
+
+def prerender_error_images():
+    """生成所有错误提示图片"""
+    for kind in ERROR_IMAGE_TEXTS:
+        for size in ERROR_IMAGE_SIZES:
+            get_error_image(kind, size)
+
+
+def pick_error_image_size(value):
+    """根据请求的 size 参数选择不小于它的最小尺寸，参数无效时使用默认尺寸"""
+    try:
+        requested = int(value)
+    except (TypeError, ValueError):
+        return ERROR_IMAGE_SIZES[0]
+    for size in ERROR_IMAGE_SIZES:
+        if size >= requested:
+            return size
+    return ERROR_IMAGE_SIZES[-1]
+
+
+def error_response(kind):
+    """返回错误提示图片，禁止客户端缓存，并通过 X-QRmai-Error 头注明失败原因"""
+    size = pick_error_image_size(request.args.get("size"))
+    return Response(
+        get_error_image(kind, size),
+        mimetype="image/png",
+        headers={"Cache-Control": "no-store", "X-QRmai-Error": kind},
+    )
+
+
+# 二维码路径查找表 {路径: 失效时间}，当前路径的失效时间为None，配置变更时整体替换
+_qr_routes = {}
+
+
+def update_qr_routes(old, new):
+    """配置变更回调：重新生成二维码路径查找表，修改前的路径在宽限期内仍然可用"""
+    global _qr_routes
+    now = time.time()
+    routes = {
+        path: expires
+        for path, expires in _qr_routes.items()
+        if expires is not None and expires > now
+    }
+    current = [path for path, expires in _qr_routes.items() if expires is None]
+
+    if new["qr_route"] in get_reserved_routes():
+        # 不允许覆盖登录、设置等页面，继续使用原来的路径
+        logger.error(f"二维码路径 {new['qr_route']} 与已有页面冲突，未生效")
+        for path in current:
+            routes[path] = None
     else:
-        # 如果没有皮肤文件，则直接保存原始二维码
-        qr_img.save(img_io, format="PNG")
+        grace_period = new["qr_route_grace_period"]
+        for path in current:
+            if path != new["qr_route"] and grace_period > 0:
+                routes[path] = now + grace_period
+            if path != new["qr_route"]:
+                logger.info(
+                    f"二维码路径已从 {path} 修改为 {new['qr_route']}，"
+                    f"旧路径将在{grace_period}秒后失效"
+                )
+        routes[new["qr_route"]] = None
+    _qr_routes = routes
 
-    # 将字节流指针移到开始位置
-    img_io.seek(0)
 
-    # 杀死微信进程
-    kill_wechat_process()
+def get_reserved_routes():
+    """已被其他页面使用、不能作为二维码路径的路径"""
+    return {rule.rule for rule in app.url_map.iter_rules()}
 
-    # 返回包含二维码图像的字节流
-    return img_io
+
+@app.before_request
+def dispatch_qr_route():
+    """
+    按查找表分发二维码请求，修改 qr_route 后无需重启即可生效
+    <二维码路径>/<档案名称> 获取指定档案（见配置中的 profiles）的二维码，旧路径在宽限期内同样可用
+    """
+    routes = _qr_routes
+    path, profile = request.path, None
+    if path not in routes:
+        # 与登录、设置等页面相同的路径（二维码路径为 / 时）仍由这些页面处理
+        if request.url_rule is not None:
+            return None
+        path, _, profile = request.path.rpartition("/")
+        path = path or "/"
+        if path not in routes or not config_store.PROFILE_NAME_PATTERN.match(profile):
+            return None
+    expires = routes[path]
+    if expires is not None:
+        if expires <= time.time():
+            return None
+        logger.info(
+            f"{request.remote_addr}通过旧的二维码路径 {path} 访问，"
+            f"该路径将在{expires - time.time():.0f}秒后失效"
+        )
+    return qrmai(profile)
+
+
+def qrmai(profile=None):
+    """
+    处理二维码路径请求的函数（路径由 config["qr_route"] 决定，见 dispatch_qr_route）
+    返回与皮肤合成后的二维码PNG，profile 为档案名称
+    """
+    return handle_qr_request(png_response, error_response, profile)
 
 
-# 定义路由 /qrmai
-@app.route(f'{config["qr_route"]}')
-def qrmai():
+def handle_qr_request(respond, respond_error, profile=None):
     """
-    处理 /qrmai 路由请求的函数
-    包含身份验证、缓存机制和并发控制
+    二维码图片、内容和SVG接口的公共流程：身份验证、熔断检查、缓存机制和并发控制
+    :param respond: respond(config, cache)，在持有档案的请求锁时生成响应
+    :param respond_error: respond_error(失败原因)，生成失败时的响应
+    :param profile: 档案名称，为None时使用全局配置
     """
+    # 本次请求使用的配置快照
+    config = config_store.get()
+
     # 验证token，如果与配置不符则返回403错误
     if request.args.get("token") != config["token"]:
         return Response("403 Forbidden", status=403)
 
-    # 引入全局变量
-    global request_lock, last_qr_bytes, last_qr_time
+    # 档案请求使用合并了档案设置的快照
+    try:
+        config = config_store.get_profile(config, profile)
+    except KeyError:
+        return Response("404 Not Found", status=404)
+    cache = get_qr_cache(profile)
+
+    count_metric("qr_requests")
 
     # 获取当前时间戳
     current_time = time.time()
 
-    # 获取缓存持续时间，默认60秒
-    cache_duration = config.get("cache_duration", 60)
+    # 没有有效缓存且熔断器打开时直接返回，不等待请求锁（后台试探期间一直持有该锁）
+    if not cache_valid(config, cache, current_time):
+        error, retry_after = check_breaker(cache)
+        if error:
+            return error_with_retry_after(respond_error, error, retry_after)
 
-    # 如果有正在进行的请求，等待直到请求完成
-    while request_lock:
-        time.sleep(0.5)
+    # 同一档案有正在进行的请求时，等待直到请求完成
+    while not cache.lock.acquire(timeout=0.5):
         logger.info("等待请求完成...")
 
+    try:
+        error, retry_after = fetch_qr(config, cache, current_time)
+        if error:
+            return error_with_retry_after(respond_error, error, retry_after)
+        return respond(config, cache)
+    finally:
+        # 释放请求锁
+        cache.lock.release()
+
+
+def error_with_retry_after(respond_error, error, retry_after):
+    """生成失败响应，熔断时带上距离下一次试探的 Retry-After"""
+    response = respond_error(error)
+    if retry_after:
+        response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+def cache_valid(config, cache, current_time):
+    """缓存中有未过期的二维码"""
+    return (
+        bool(cache.payload) and (current_time - cache.time) < config["cache_duration"]
+    )
+
+
+def check_breaker(cache):
+    """
+    该档案连续失败后熔断器打开时，直接返回上次的错误，由后台试探恢复
+    :return: (失败原因, 距离下一次试探的秒数)，允许执行获取流程时为 (None, None)
+    """
+    allowed, retry_after = cache.breaker.check()
+    if allowed:
+        return None, None
+    count_metric("circuit_rejections")
+    return cache.error or "timeout", retry_after
+
+
+def fetch_qr(config, cache, current_time):
+    """
+    获取二维码内容并保存在 cache.payload 中，调用时需持有 cache.lock
+    :return: (失败原因, 熔断时距离下一次试探的秒数)，成功时为 (None, None)
+    """
+    # 等待期间其他请求已经完成了获取流程，直接复用其结果（包括失败）
+    if cache.finish_time >= current_time and (cache.payload or cache.error):
+        count_metric("coalesced")
+        return cache.error, None
+
     # 检查缓存是否有效（存在且未过期）
-    if last_qr_bytes and (current_time - last_qr_time) < cache_duration:
-        # 返回缓存的二维码图像
-        return Response(BytesIO(last_qr_bytes), mimetype="image/png")
+    if cache_valid(config, cache, current_time):
+        count_metric("cache_hits")
+        return None, None
 
-    # 设置请求锁，防止并发访问
-    request_lock = True
-    try:
-        # 执行二维码获取操作
-        img_io = qrmai_action()
-        img_io.seek(0)  # 将指针移到开始位置
+    # 等待请求锁期间熔断器可能已经打开
+    error, retry_after = check_breaker(cache)
+    if error:
+        return error, retry_after
+
+    # 执行二维码获取操作
+    return run_pipeline(config, cache, current_time), None
 
-        # 更新缓存数据
-        last_qr_bytes = img_io.getvalue()
-        last_qr_time = current_time
 
-        # 返回新生成的二维码图像
-        return Response(BytesIO(last_qr_bytes), mimetype="image/png")
+def run_pipeline(config, cache, current_time):
+    """
+    排队使用桌面，执行获取流程并更新缓存，调用时需持有 cache.lock
+    :return: 成功时为None，失败时为失败原因
+    """
+    count_metric("pipeline_runs")
+    # 桌面只有一个，各档案的获取流程按请求的先后顺序轮流执行
+    desktop_queue.acquire(cache.name)
+    try:
+        payload, error = qrmai_action(config, cache.name)
+        cache.stage_timings = last_stage_timings
     finally:
-        # 释放请求锁
-        request_lock = False
+        desktop_queue.release()
+    cache.finish_time = time.time()
+    cache.error = error
+    if error:
+        # 失败结果不缓存，只复用给等待中的请求
+        cache.breaker.record_failure()
+        return error
+
+    # 更新缓存数据，图片在第一次需要时生成
+    cache.payload = payload
+    cache.png = cache.svg = None
+    cache.time = current_time
+    cache.breaker.record_success()
+    return None
+
+
+def get_cached_png(config, cache):
+    """缓存中的二维码PNG，还没有生成时与皮肤合成，调用时需持有 cache.lock"""
+    if cache.png is None:
+        start = time.perf_counter()
+        cache.png = render_qr_image(cache.payload, config).getvalue()
+        cache.stage_timings = dict(
+            cache.stage_timings, render=round((time.perf_counter() - start) * 1000, 1)
+        )
+    return cache.png
+
+
+def get_cached_svg(config, cache):
+    """缓存中的二维码SVG，调用时需持有 cache.lock"""
+    if cache.svg is None:
+        cache.svg = render_qr_svg(cache.payload, config)
+    return cache.svg
+
+
+def png_response(config, cache):
+    return Response(BytesIO(get_cached_png(config, cache)), mimetype="image/png")
+
+
+def payload_response(config, cache):
+    """二维码内容和有效期，expires_at 之前再次请求会得到同一个二维码"""
+    import decoder
+
+    expires_at = cache.time + config["cache_duration"]
+    expires_in = max(0, int(expires_at - time.time()))
+    headers = {"Cache-Control": f"private, max-age={expires_in}"}
+    if request.args.get("format") == "text":
+        return Response(cache.payload, mimetype="text/plain", headers=headers)
+    response = jsonify(
+        payload=cache.payload,
+        # 二维码内容中的生成时间，不是舞萌DX格式时为null
+        issued_at=decoder.payload_time(cache.payload.encode("utf-8")),
+        fetched_at=cache.time,
+        expires_at=expires_at,
+        expires_in=expires_in,
+    )
+    response.headers.update(headers)
+    return response
+
+
+def svg_response(config, cache):
+    return Response(get_cached_svg(config, cache), mimetype="image/svg+xml")
+
+
+def text_error_response(kind):
+    """/payload 和 /qr.svg 失败时返回503，?format=text 或SVG接口返回文本，否则返回JSON"""
+    message = ERROR_IMAGE_TEXTS[kind].replace("\n", " ")
+    if request.path == "/payload" and request.args.get("format") != "text":
+        response = jsonify(error=kind, message=message)
+        response.status_code = 503
+    else:
+        response = Response(message, status=503, mimetype="text/plain")
+    response.headers["Cache-Control"] = "no-store"
+    response.headers["X-QRmai-Error"] = kind
+    return response
+
+
+@app.route("/payload")
+def qr_payload():
+    """
+    只返回二维码内容（需要token），不生成图片，与二维码路径共用缓存
+    默认返回JSON {payload, issued_at, fetched_at, expires_at, expires_in}，?format=text 时只返回内容，
+    ?profile= 时获取指定档案的二维码
+    """
+    return handle_qr_request(
+        payload_response, text_error_response, request.args.get("profile")
+    )
+
+
+@app.route("/qr.svg")
+def qr_svg():
+    """返回SVG格式的二维码（需要token，不含皮肤），与二维码路径共用缓存，?profile= 时获取指定档案的二维码"""
+    return handle_qr_request(
+        svg_response, text_error_response, request.args.get("profile")
+    )
+
+
+def probe_pipeline(cache):
+    """熔断器半开时由后台线程用该档案的配置执行一次获取流程，成功后生成的二维码同样进入缓存"""
+    try:
+        config = config_store.get_profile(config_store.get(), cache.name)
+    except KeyError:
+        # 档案已从配置中删除，不再试探
+        cache.breaker.record_success()
+        return
+    with cache.lock:
+        run_pipeline(config, cache, time.time())
+
+
+@app.route("/healthz")
+def healthz():
+    """
+    健康检查，启动预热完成前返回503和 warming 状态；
+    预热有阶段出错时返回200和 degraded 状态，errors 中为出错的阶段
+    """
+    data = dict(
+        warmup_state,
+        stages=dict(warmup_state["stages"]),
+        errors=dict(warmup_state["errors"]),
+    )
+    return jsonify(data), 503 if data["status"] == "warming" else 200
+
+
+@app.route("/metrics")
+def get_metrics():
+    """返回运行统计（需要token）"""
+    if request.args.get("token") != config_store.get()["token"]:
+        return Response("403 Forbidden", status=403)
+    with metrics_lock:
+        data = dict(metrics)
+    data["circuit_breaker"] = get_qr_cache().breaker.get_status()
+    data["last_stage_ms"] = last_stage_timings
+    data["input_mode"] = config_store.get()["input_mode"]
+    data["desktop_actor_restarts"] = desktop_actor.restart_count
+    data["desktop_queue"] = desktop_queue.waiting()
+    default_cache = get_qr_cache()
+    data["cache_age"] = (
+        round(time.time() - default_cache.time, 3) if default_cache.payload else None
+    )
+    if _desktop_backend is not None:
+        # 最近一次查找微信窗口的耗时和方式（cache/enum/scan）
+        data["window_lookup"] = getattr(_desktop_backend, "last_window_lookup", None)
+        # 最近一次截屏的方式（window/monitors）、区域和耗时
+        data["capture"] = getattr(_desktop_backend, "last_capture", None)
+    if config_store.get()["calibration"]["enabled"]:
+        import calibration
+
+        # 点击位置相对微信窗口的偏移、待重新定位的位置和已记录的模板
+        data["calibration"] = calibration.get_status()
+    data["profiles"] = get_profiles_status(config_store.get())
+    return jsonify(data)
+
+
+def get_profiles_status(config):
+    """各档案的缓存和最近一次获取流程的状态，用于 /metrics"""
+    now = time.time()
+    status = {}
+    for name in config["profiles"]:
+        profile_config = config_store.get_profile(config, name)
+        cache = get_qr_cache(name)
+        item = {
+            "cache_age": round(now - cache.time, 3) if cache.payload else None,
+            "expires_in": (
+                max(0, round(cache.time + profile_config["cache_duration"] - now, 3))
+                if cache.payload
+                else None
+            ),
+            "last_error": cache.error,
+            "circuit_breaker": cache.breaker.get_status(),
+            "last_stage_ms": cache.stage_timings,
+        }
+        if profile_config["calibration"]["enabled"]:
+            import calibration
+
+            item["calibration"] = calibration.get_status(name)
+        status[name] = item
+    return status
+
+
+def parse_form_number(value):
+    """
+    将表单中的数字转换为int或float，带小数的值保留为float，是否允许小数由 config_store.validate 检查
+    :raise ValueError: 不是有限的数字
+    """
+    try:
+        return int(value)
+    except ValueError:
+        number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(value)
+    return number
 
 
 @app.route("/settings", methods=["GET", "POST"])
 @require_auth
 def settings():
     if request.method == "POST":
-        # 读取POST参数并更新config
+        # 在当前配置的副本上修改，校验通过后整体替换
+        config = config_store.thaw(config_store.get())
         token_updated = False
         old_token = config["token"]
 
@@ -605,10 +1099,11 @@ def settings():
                 # 尝试将字符串转换为对应类型（int/float/list）
                 if isinstance(config[key], bool):
                     config[key] = value.lower() in ("true", "1", "yes", "on")
-                elif isinstance(config[key], int):
-                    config[key] = int(value)
-                elif isinstance(config[key], float):
-                    config[key] = float(value)
+                elif isinstance(config[key], (int, float)):
+                    try:
+                        config[key] = parse_form_number(value)
+                    except (ValueError, TypeError):
+                        return f"配置不合法: {key} 必须是数字，当前为 {value}", 400
                 elif isinstance(config[key], list) and "," in value:
                     config[key] = [
                         int(v) if v.isdigit() else v for v in value.split(",")
@@ -618,47 +1113,102 @@ def settings():
                 # 检查是否更新了token
                 if key == "token" and value != old_token:
                     token_updated = True
+            elif "." in key and key.split(".", 1)[0] in config:
+                # 处理嵌套配置项，例如 decode.time
+                parent, child = key.split(".", 1)
+                if isinstance(config[parent], dict) and child in config[parent]:
+                    current = config[parent][child]
+                    if isinstance(current, bool):
+                        config[parent][child] = value.lower() in (
+                            "true",
+                            "1",
+                            "yes",
+                            "on",
+                        )
+                    elif isinstance(current, (int, float)):
+                        try:
+                            config[parent][child] = parse_form_number(value)
+                        except (ValueError, TypeError):
+                            return f"配置不合法: {key} 必须是数字，当前为 {value}", 400
+                    else:
+                        config[parent][child] = value
             elif key == "qr_route":  # 处理新的配置项
+                # 二维码路由路径更改后由 update_qr_routes 立即生效
                 config[key] = value
-                # 二维码路由路径更改，需要更新路由
-                # 注意：在当前请求中无法动态修改路由，需要重启服务
 
-        # 保存更新后的config到文件
-        with open("config.json", "w", encoding="utf-8") as f:
-            json.dump(config, f, ensure_ascii=False, indent=4)
-        # 如果token被更新，需要更新配置版本信息
+        if config["qr_route"] in get_reserved_routes():
+            return f"配置不合法: 二维码路径 {config['qr_route']} 与已有页面冲突", 400
+        # 只调大了 decode.time 时随之调整流程总时限，明确提交了冲突的总时限时仍然拒绝
+        if (
+            "stage_timeouts.pipeline" not in request.form
+            and isinstance(config["decode"]["time"], (int, float))
+            and config["stage_timeouts"]["pipeline"] <= config["decode"]["time"]
+        ):
+            config["stage_timeouts"]["pipeline"] = (
+                config_store.default_pipeline_timeout(config)
+            )
+        # 校验并保存更新后的config（先写临时文件再替换）
+        try:
+            new_config = config_store.replace(config)
+        except ValueError as e:
+            return f"配置不合法: {e}", 400
+        # 如果token被更新，配置版本信息也会更新
         if token_updated:
-            import hashlib
-            import time
-            import os
-
-            try:
-                config_version = hashlib.md5(
-                    (config["token"] + str(os.path.getmtime(config_path))).encode()
-                ).hexdigest()
-            except FileNotFoundError:
-                config_version = hashlib.md5(
-                    (config["token"] + str(time.time())).encode()
-                ).hexdigest()
-            config["version"] = config_version
             # 更新session中的配置版本信息
-            session["config_version"] = config_version
+            session["config_version"] = new_config["version"]
         return "配置已更新", 200
     # GET请求时返回设置页面
-    return render_template("settings.html", config=config)
+    import updater
+
+    config = config_store.get()
+
+    return render_template(
+        "settings.html",
+        config=config,
+        decode_status=decode_scheduler.get_status(config),
+        update_checked_at=format_update_checked_at(
+            updater.get_cached_update_status()[2]
+        ),
+    )
+
+
+def format_update_checked_at(checked_at):
+    """格式化上次检查更新的时间"""
+    if checked_at is None:
+        return None
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(checked_at))
 
 
 @app.route("/check_update", methods=["POST"])
 @require_auth
 def check_update():
-    """检查更新的路由"""
+    """检查更新的路由，直接返回后台线程缓存的结果"""
     try:
         # 导入updater模块
         import updater
 
-        # 检查是否有新版本
-        has_update, latest_release = updater.is_new_version_available()
+        has_update, latest_release, checked_at, error = (
+            updater.get_cached_update_status()
+        )
 
+        # 缓存较旧时在后台重新检查一次，下次点击即可看到最新结果
+        if checked_at is None or time.time() - checked_at > UPDATE_RECHECK_AGE:
+            updater.refresh_release_cache_async()
+        if checked_at is None:
+            return jsonify({"checking": True, "message": "正在检查更新，请稍后再试"})
+
+        last_checked = format_update_checked_at(checked_at)
+        if error and not has_update:
+            return (
+                jsonify(
+                    {
+                        "error": True,
+                        "message": f"检查更新时出错: {error}",
+                        "checked_at": last_checked,
+                    }
+                ),
+                500,
+            )
         if has_update and latest_release:
             return jsonify(
                 {
@@ -667,10 +1217,17 @@ def check_update():
                     "name": latest_release["name"],
                     "published_at": latest_release["published_at"],
                     "body": latest_release["body"],
+                    "checked_at": last_checked,
                 }
             )
         else:
-            return jsonify({"has_update": False, "message": "当前已是最新版本"})
+            return jsonify(
+                {
+                    "has_update": False,
+                    "message": "当前已是最新版本",
+                    "checked_at": last_checked,
+                }
+            )
     except Exception as e:
         return jsonify({"error": True, "message": f"检查更新时出错: {str(e)}"}), 500
 
@@ -683,12 +1240,17 @@ def manual_update():
         # 导入updater模块
         import updater
 
-        # 检查是否有新版本并执行更新
-        has_update, latest_release = updater.is_new_version_available()
+        # 从缓存判断是否有新版本并执行更新
+        has_update, latest_release, checked_at, _ = updater.get_cached_update_status()
+
+        if checked_at is None:
+            # 还没有检查过更新
+            updater.refresh_release_cache_async()
+            return jsonify({"message": "正在检查更新，请稍后再试"}), 202
 
         if has_update and latest_release:
             # 执行更新
-            success = updater.check_and_update()
+            success = updater.check_and_update(latest_release)
 
             if success:
                 # 更新成功，返回200状态码
@@ -703,70 +1265,35 @@ def manual_update():
         return jsonify({"error": True, "message": f"手动更新时出错: {str(e)}"}), 500
 
 
-# 读取配置文件
-config = {}
-config_path = resource_path("config.json")
-if os.path.exists(config_path):
-    with open(config_path, "r", encoding="utf-8") as f:
-        config = json.load(f)
+# 所有页面注册完成后生成二维码路径查找表，之后随配置变更更新
+update_qr_routes(None, config_store.get())
+config_store.add_listener(update_qr_routes)
 
-# 确保配置项完整
-config = ensure_config_completeness(config)
+# 程序入口点
+if __name__ == "__main__":
+    _phase_start = record_startup_phase("定义路由", _phase_start)
 
-# 更新配置版本信息（如果尚未存在）
-if "version" not in config:
-    import hashlib
-    import time
-    import os
+    # 配置文件不存在或缺少配置项时，写入补全后的配置
+    if config_needs_save:
+        config_store.save_current()
+    config_store.start_watcher()
+    config = config_store.get()
 
-    try:
-        config_version = hashlib.md5(
-            (config["token"] + str(os.path.getmtime(config_path))).encode()
-        ).hexdigest()
-    except FileNotFoundError:
-        config_version = hashlib.md5(
-            (config["token"] + str(time.time())).encode()
-        ).hexdigest()
-    config["version"] = config_version
+    def warm_up_and_start_poller():
+        warm_up()
+        # 启动后台检查更新线程
+        import updater
 
-# 程序入口点
-if __name__ == "__main__":
-    import hashlib
-    import time
-
-    # 读取配置文件
-    if os.path.exists(config_path):
-        with open(config_path, "r", encoding="utf-8") as f:
-            config_from_file = json.load(f)
-        config = ensure_config_completeness(config_from_file)
-        # 保存补全后的配置
-        with open(config_path, "w", encoding="utf-8") as f:
-            json.dump(config, f, ensure_ascii=False, indent=4)
-        # 添加配置版本标识，用于增强认证安全性
-        try:
-            config_version = hashlib.md5(
-                (config["token"] + str(os.path.getmtime(config_path))).encode()
-            ).hexdigest()
-        except FileNotFoundError:
-            config_version = hashlib.md5(
-                (config["token"] + str(time.time())).encode()
-            ).hexdigest()
-        config["version"] = config_version
+        updater.start_release_poller(config["update_check_interval"])
+
+    if PROFILE_STARTUP:
+        # 在前台完成预加载和预热，以便统计各模块的导入耗时
+        warm_up_and_start_poller()
     else:
-        # 如果config.json不存在，则创建默认配置文件
-        config = get_default_config()
-        # 保存默认配置到文件
-        with open(config_path, "w", encoding="utf-8") as f:
-            json.dump(config, f, ensure_ascii=False, indent=4)
-        # 添加配置版本标识
-        config_version = hashlib.md5(
-            (config["token"] + str(time.time())).encode()
-        ).hexdigest()
-        config["version"] = config_version
-
-    # 根据配置动态注册二维码路由
-    qr_route = config.get("qr_route", "/qrmai")
-    app.add_url_rule(qr_route, "qrmai", qrmai)
+        threading.Thread(
+            target=warm_up_and_start_poller, name="warmup", daemon=True
+        ).start()
+    _phase_start = time.perf_counter()
 
     # 启动Flask应用，使用配置中的主机和端口
     from webbrowser import open as open_webbrowser
@@ -775,4 +1302,7 @@ if __name__ == "__main__":
         open_webbrowser(f'http://{config["host"]}:{config["port"]}/login')
     else:
         open_webbrowser(f'http://localhost:{config["port"]}/login')
+    if PROFILE_STARTUP:
+        record_startup_phase("注册路由、打开浏览器", _phase_start)
+        print_startup_profile()
     app.run(host=config["host"], port=config["port"], debug=config["dev_mode"])
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量更新包生成脚本
+对比旧版本和新版本的exe，生成 QRmai-<旧版本>-to-<新版本>.patch（bsdiff4格式），
+作为新版本release的附件发布后，updater.py 会优先下载它而不是完整的exe
+
+用法:
+    python packaging/make_patch.py 旧版本exe 新版本exe --from v1.2.0 --to v1.3.0 --out dist
+"""
+
+import argparse
+import os
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成QRmai增量更新包")
+    parser.add_argument("old_exe", help="旧版本exe路径")
+    parser.add_argument("new_exe", help="新版本exe路径")
+    parser.add_argument("--from", dest="from_version", required=True, help="旧版本号")
+    parser.add_argument("--to", dest="to_version", required=True, help="新版本号")
+    parser.add_argument("--out", default=".", help="输出目录")
+    args = parser.parse_args()
+
+    try:
+        import bsdiff4
+    except ImportError:
+        print("错误: 未安装bsdiff4，请运行 pip install bsdiff4")
+        return 1
+
+    for path in (args.old_exe, args.new_exe):
+        if not os.path.isfile(path):
+            print(f"错误: 找不到文件 {path}")
+            return 1
+
+    os.makedirs(args.out, exist_ok=True)
+    patch_path = os.path.join(
+        args.out, f"QRmai-{args.from_version}-to-{args.to_version}.patch"
+    )
+    bsdiff4.file_diff(args.old_exe, args.new_exe, patch_path)
+
+    # 验证补丁可以还原出新版本
+    check_path = patch_path + ".check"
+    bsdiff4.file_patch(args.old_exe, check_path, patch_path)
+    with open(check_path, "rb") as f1, open(args.new_exe, "rb") as f2:
+        identical = f1.read() == f2.read()
+    os.remove(check_path)
+    if not identical:
+        os.remove(patch_path)
+        print("错误: 补丁验证失败")
+        return 1
+
+    patch_size = os.path.getsize(patch_path)
+    full_size = os.path.getsize(args.new_exe)
+    print(f"增量更新包已生成: {patch_path}")
+    print(
+        f"大小: {patch_size / 1024 / 1024:.2f} MB（完整exe {full_size / 1024 / 1024:.2f} MB，"
+        f"节省 {(1 - patch_size / full_size):.0%}）"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,13 +7,17 @@ QRmai 自动更新模块
 """
 
 import requests
+import hashlib
 import json
 import os
+import re
 import sys
 import zipfile
 import shutil
 import subprocess
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
 # 尝试解决SSL证书验证问题
@@ -35,10 +39,24 @@ except ImportError:
 GITHUB_REPO = "SodaCodeSave/QRmai"
 GITHUB_API_URL = f"https://api.github.com/repos/{GITHUB_REPO}"
 CURRENT_VERSION_FILE = "version.txt"  # 本地版本文件
+MIRROR_STATS_FILE = "mirror_stats.json"  # 各下载源的历史延迟记录
+PROBE_TIMEOUT = (5, 10)  # 探测下载源的连接/读取超时（秒）
+PROBE_GRACE_PERIOD = 0.5  # 第一个下载源响应后，再等待其余下载源的时间（秒）
+MAX_SEGMENTS = 4  # 分段下载的最大分段数
+MIN_SEGMENT_SIZE = 1024 * 1024  # 每个分段的最小大小
+CHUNK_SIZE = 256 * 1024  # 每次从网络读取的块大小
+WRITE_BUFFER_SIZE = 1024 * 1024  # 写文件缓冲区大小
+PATCH_ASSET_PATTERN = re.compile(r"^QRmai-(.+)-to-(.+)\.patch$")  # 增量更新包文件名
 
 # 创建一个全局session以复用连接
 _session = None
 
+# 最新版本信息缓存，由后台线程定期刷新
+_release_cache_lock = threading.Lock()
+_release_cache = {"release": None, "etag": None, "checked_at": None, "error": None}
+_poller_thread = None
+_refresh_lock = threading.Lock()
+
 
 def get_requests_session():
     """获取带有适当配置的requests session"""
@@ -93,80 +111,111 @@ def get_current_version():
 
 def find_exe_asset(assets):
     """在assets中查找exe文件"""
+    asset = find_exe_asset_info(assets)
+    return asset.get("browser_download_url") if asset else None
+
+
+def find_exe_asset_info(assets):
+    """在assets中查找exe文件，返回完整的asset信息（包含文件名、大小和摘要）"""
     for asset in assets:
         if asset.get("name", "").endswith(".exe"):
-            return asset.get("browser_download_url")
+            return asset
     return None
 
 
+def build_release_info(release_info):
+    """从GitHub API返回的数据中整理出需要的版本信息"""
+    # 从assets中查找exe文件下载链接
+    assets = release_info.get("assets", [])
+    exe_asset = find_exe_asset_info(assets) or {}
+
+    # 如果没找到exe文件，仍然返回信息，但download_url为None
+    return {
+        "version": release_info["tag_name"],
+        "name": release_info.get("name", release_info["tag_name"]),
+        "published_at": release_info.get("published_at", ""),
+        "download_url": exe_asset.get("browser_download_url"),
+        "download_name": exe_asset.get("name"),
+        "download_size": exe_asset.get("size"),
+        # GitHub提供的摘要格式为 "sha256:<hex>"，旧的release可能没有
+        "download_digest": exe_asset.get("digest"),
+        "assets": assets,  # 保留assets信息以供调试
+        "body": release_info.get("body", ""),
+    }
+
+
+def _request_latest_release(verify=True):
+    """请求最新版本信息，带上缓存的ETag以便GitHub返回304（不计入API频率限制）"""
+    session = get_requests_session()
+    headers = {}
+    with _release_cache_lock:
+        if _release_cache["etag"] and _release_cache["release"]:
+            headers["If-None-Match"] = _release_cache["etag"]
+    return session.get(
+        f"{GITHUB_API_URL}/releases/latest",
+        timeout=10,
+        headers=headers,
+        verify=verify,
+    )
+
+
+def _handle_release_response(response):
+    """解析最新版本的响应，更新缓存"""
+    if response.status_code == 304:
+        # 版本信息没有变化，使用缓存
+        with _release_cache_lock:
+            _release_cache["checked_at"] = time.time()
+            _release_cache["error"] = None
+            return _release_cache["release"]
+    if response.status_code == 200:
+        release_info = response.json()
+        # 检查必需的字段是否存在
+        if not isinstance(release_info, dict) or "tag_name" not in release_info:
+            print("错误: GitHub API返回的数据缺少'tag_name'字段")
+            _record_check_failure("GitHub API返回的数据缺少'tag_name'字段")
+            return None
+
+        release = build_release_info(release_info)
+        with _release_cache_lock:
+            _release_cache["release"] = release
+            _release_cache["etag"] = response.headers.get("ETag")
+            _release_cache["checked_at"] = time.time()
+            _release_cache["error"] = None
+        return release
+    else:
+        print(f"获取版本信息失败: {response.status_code}")
+        _record_check_failure(f"获取版本信息失败: {response.status_code}")
+        return None
+
+
+def _record_check_failure(message):
+    """记录检查更新失败，缓存中已有的版本信息保持不变"""
+    with _release_cache_lock:
+        _release_cache["checked_at"] = time.time()
+        _release_cache["error"] = message
+
+
 def get_latest_release():
     """获取GitHub上的最新发布版本"""
     try:
         # 使用配置好的session发送请求
-        session = get_requests_session()
-        response = session.get(f"{GITHUB_API_URL}/releases/latest", timeout=10)
-        if response.status_code == 200:
-            release_info = response.json()
-            # 检查必需的字段是否存在
-            if "tag_name" not in release_info:
-                print("错误: GitHub API返回的数据缺少'tag_name'字段")
-                return None
-
-            # 从assets中查找exe文件下载链接
-            assets = release_info.get("assets", [])
-            exe_download_url = find_exe_asset(assets)
-
-            # 如果没找到exe文件，仍然返回信息，但download_url为None
-            return {
-                "version": release_info["tag_name"],
-                "name": release_info.get("name", release_info["tag_name"]),
-                "published_at": release_info.get("published_at", ""),
-                "download_url": exe_download_url,
-                "assets": assets,  # 保留assets信息以供调试
-                "body": release_info.get("body", ""),
-            }
-        else:
-            print(f"获取版本信息失败: {response.status_code}")
-            return None
+        return _handle_release_response(_request_latest_release())
     except requests.exceptions.SSLError as ssl_error:
         print(f"SSL证书验证失败: {str(ssl_error)}")
         print("尝试禁用SSL验证重新连接...")
         try:
             # 如果SSL验证失败，尝试禁用SSL验证重新连接
-            session = get_requests_session()
-            response = session.get(
-                f"{GITHUB_API_URL}/releases/latest", timeout=10, verify=False
-            )
-            if response.status_code == 200:
-                release_info = response.json()
-                # 检查必需的字段是否存在
-                if "tag_name" not in release_info:
-                    print("错误: GitHub API返回的数据缺少'tag_name'字段")
-                    return None
-
-                # 从assets中查找exe文件下载链接
-                assets = release_info.get("assets", [])
-                exe_download_url = find_exe_asset(assets)
-
-                return {
-                    "version": release_info["tag_name"],
-                    "name": release_info.get("name", release_info["tag_name"]),
-                    "published_at": release_info.get("published_at", ""),
-                    "download_url": exe_download_url,
-                    "assets": assets,  # 保留assets信息以供调试
-                    "body": release_info.get("body", ""),
-                }
-            else:
-                print(f"获取版本信息失败: {response.status_code}")
-                return None
+            return _handle_release_response(_request_latest_release(verify=False))
         except Exception as e:
             print(f"禁用SSL验证后仍然出错: {str(e)}")
+            _record_check_failure(str(e))
             return None
     except Exception as e:
         print(f"检查更新时出错: {str(e)}")
         import traceback
 
         traceback.print_exc()
+        _record_check_failure(str(e))
         return None
 
 
@@ -203,118 +252,436 @@ def compare_versions(v1, v2):
             return 0
 
 
-def is_new_version_available():
-    """检查是否有新版本"""
-    current_version = get_current_version()
-    latest_release = get_latest_release()
-
+def has_newer_version(latest_release):
+    """判断最新版本是否比当前版本新"""
     if not latest_release:
-        return False, None
+        return False
+
+    current_version = get_current_version()
 
     # 使用版本比较函数
     comparison = compare_versions(latest_release["version"], current_version)
 
-    if (
-        current_version == "unknown" or comparison > 0
-    ):  # 只有当最新版本大于当前版本时才认为有更新
+    # 只有当最新版本大于当前版本时才认为有更新
+    return current_version == "unknown" or comparison > 0
+
+
+def is_new_version_available():
+    """检查是否有新版本"""
+    latest_release = get_latest_release()
+
+    if has_newer_version(latest_release):
         return True, latest_release
     else:
         return False, None
 
 
-def download_with_mirror(download_url, session, timeout=30, verify=True):
-    """使用原地址或镜像源下载文件"""
-    # 首先尝试直接下载
-    print(f"正在从原地址下载: {download_url}")
-    try:
-        response = session.get(
-            download_url, timeout=timeout, stream=True, verify=verify
-        )
-        if response.status_code == 200:
-            print("原地址下载成功")
-            return response
-        else:
-            print(f"原地址下载失败: {response.status_code}")
-    except Exception as e:
-        print(f"原地址下载出错: {str(e)}")
+def get_cached_update_status():
+    """
+    从缓存中获取更新状态，不发送网络请求
+    :return: (是否有新版本, 最新版本信息, 上次检查时间戳（从未检查过时为None）,
+              上次检查失败的原因（成功时为None）)
+    """
+    with _release_cache_lock:
+        latest_release = _release_cache["release"]
+        checked_at = _release_cache["checked_at"]
+        error = _release_cache["error"]
+    if has_newer_version(latest_release):
+        return True, latest_release, checked_at, error
+    return False, None, checked_at, error
 
-    # 如果直接下载失败，尝试使用镜像源
-    mirror_url = f"https://gh-proxy.com/{download_url}"
-    print(f"正在尝试镜像源: {mirror_url}")
-    try:
-        response = session.get(mirror_url, timeout=timeout, stream=True, verify=verify)
-        if response.status_code == 200:
-            print("镜像源下载成功")
-            return response
-        else:
-            print(f"镜像源下载失败: {response.status_code}")
-    except Exception as e:
-        print(f"镜像源下载出错: {str(e)}")
 
-    # 额外镜像源
-    extra_mirror_urls = [
-        f"https://ghproxy.com/{download_url}",
-        f"https://ghproxy.net/{download_url}",
-        f"https://kgithub.com/{download_url}",
+def refresh_release_cache_async():
+    """在后台线程中立即检查一次更新，已有检查在进行时不重复发起"""
+    if not _refresh_lock.acquire(blocking=False):
+        return
+
+    def refresh():
+        try:
+            get_latest_release()
+        finally:
+            _refresh_lock.release()
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def start_release_poller(interval):
+    """
+    启动后台线程，定期检查GitHub上的最新版本并缓存结果
+    :param interval: 检查间隔（秒），小于等于0时只在启动时检查一次
+    """
+    global _poller_thread
+    if _poller_thread is not None:
+        return
+
+    def poll():
+        while True:
+            get_latest_release()
+            if interval <= 0:
+                break
+            time.sleep(interval)
+
+    _poller_thread = threading.Thread(target=poll, name="release-poller", daemon=True)
+    _poller_thread.start()
+
+
+def get_mirror_urls(download_url):
+    """获取下载源列表：原地址和各个镜像源，返回 [(名称, 地址)]"""
+    return [
+        ("github", download_url),
+        ("gh-proxy.com", f"https://gh-proxy.com/{download_url}"),
+        ("ghproxy.com", f"https://ghproxy.com/{download_url}"),
+        ("ghproxy.net", f"https://ghproxy.net/{download_url}"),
+        ("kgithub.com", f"https://kgithub.com/{download_url}"),
     ]
 
-    for extra_mirror in extra_mirror_urls:
-        print(f"正在尝试备用镜像源: {extra_mirror}")
+
+def load_mirror_stats():
+    """读取各下载源的历史延迟记录"""
+    if os.path.exists(MIRROR_STATS_FILE):
         try:
-            response = session.get(
-                extra_mirror, timeout=timeout, stream=True, verify=verify
+            with open(MIRROR_STATS_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            pass
+    return {}
+
+
+def save_mirror_stats(stats):
+    try:
+        with open(MIRROR_STATS_FILE, "w", encoding="utf-8") as f:
+            json.dump(stats, f, ensure_ascii=False, indent=4)
+    except Exception as e:
+        print(f"保存下载源延迟记录时出错: {str(e)}")
+
+
+def update_mirror_stats(stats, name, latency):
+    """
+    更新下载源的延迟记录（指数加权平均）
+    :param latency: 本次探测延迟（秒），探测失败时为None
+    """
+    entry = stats.setdefault(name, {"latency": None, "failures": 0})
+    if latency is None:
+        entry["failures"] += 1
+    else:
+        previous = entry["latency"]
+        entry["latency"] = round(
+            latency if previous is None else previous * 0.7 + latency * 0.3, 3
+        )
+        entry["failures"] = 0
+
+
+def rank_mirrors(mirrors, stats):
+    """按历史延迟排序下载源，没有记录的排在中间，连续失败的排在最后"""
+
+    def sort_key(mirror):
+        entry = stats.get(mirror[0], {})
+        latency = entry.get("latency")
+        return (entry.get("failures", 0), latency if latency is not None else 5)
+
+    return sorted(mirrors, key=sort_key)
+
+
+def probe_mirror(url, verify=True, timeout=PROBE_TIMEOUT):
+    """
+    用一个很小的Range请求探测下载源是否可用
+    :return: (响应头到达的耗时（秒）, 文件总大小（未知时为None）, 是否支持Range分段下载)，
+             不可用时抛出异常
+    """
+    start = time.time()
+    # 探测不使用全局session，避免urllib3的重试和退避拖慢探测
+    response = requests.get(
+        url,
+        headers={"Range": "bytes=0-1023"},
+        timeout=timeout,
+        stream=True,
+        verify=verify,
+    )
+    try:
+        if response.status_code not in (200, 206):
+            raise Exception(f"状态码 {response.status_code}")
+        latency = time.time() - start
+        if response.status_code == 206:
+            # Content-Range: bytes 0-1023/123456
+            total = response.headers.get("Content-Range", "").rpartition("/")[2]
+            return latency, int(total) if total.isdigit() else None, True
+        length = response.headers.get("Content-Length", "")
+        return latency, int(length) if length.isdigit() else None, False
+    finally:
+        response.close()
+
+
+def race_mirrors(download_url, verify=True):
+    """
+    并行探测所有下载源，返回按响应速度排序的下载源列表（最快的在前），
+    每一项为 {"name", "url", "latency", "size", "ranges"}
+    第一个响应的下载源确定后，其余探测的结果仅用于更新延迟记录
+    """
+    stats = load_mirror_stats()
+    mirrors = rank_mirrors(get_mirror_urls(download_url), stats)
+    responders = []
+
+    race_start = time.time()
+    executor = ThreadPoolExecutor(max_workers=len(mirrors))
+    futures = {
+        executor.submit(probe_mirror, url, verify): (name, url) for name, url in mirrors
+    }
+    try:
+        # 等待第一个成功的下载源，之后只再给其余下载源很短的时间
+        deadline = time.time() + PROBE_TIMEOUT[0] + PROBE_TIMEOUT[1]
+        pending = set(futures)
+        while pending and time.time() < deadline:
+            done, pending = wait(
+                pending,
+                timeout=deadline - time.time(),
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                name, url = futures[future]
+                try:
+                    latency, size, ranges = future.result()
+                    print(f"下载源 {name} 响应耗时 {latency * 1000:.0f}ms")
+                    update_mirror_stats(stats, name, latency)
+                    responders.append(
+                        {
+                            "name": name,
+                            "url": url,
+                            "latency": latency,
+                            "size": size,
+                            "ranges": ranges,
+                        }
+                    )
+                except Exception as e:
+                    print(f"下载源 {name} 不可用: {str(e)}")
+                    update_mirror_stats(stats, name, None)
+            if responders:
+                deadline = min(deadline, time.time() + PROBE_GRACE_PERIOD)
+        # 被淘汰的下载源：有其他下载源响应时，以已等待的时间作为其延迟记录
+        elapsed = time.time() - race_start
+        for future in pending:
+            update_mirror_stats(
+                stats, futures[future][0], elapsed if responders else None
             )
+    finally:
+        # 取消尚未开始的探测，已经在进行的探测会在超时后自行结束
+        executor.shutdown(wait=False, cancel_futures=True)
+        save_mirror_stats(stats)
+
+    responders.sort(key=lambda mirror: mirror["latency"])
+    return responders
+
+
+def download_with_mirror(download_url, session, timeout=30, verify=True, mirrors=None):
+    """
+    使用原地址或镜像源下载文件
+    先并行探测所有下载源，从响应最快的开始下载，失败时依次尝试其余可用的下载源
+    :param mirrors: 已经探测过的下载源列表（race_mirrors的结果），为None时重新探测
+    """
+    if mirrors is None:
+        print("正在探测下载源...")
+        mirrors = race_mirrors(download_url, verify)
+    mirrors = [(m["name"], m["url"]) for m in mirrors]
+    if not mirrors:
+        print("所有下载源探测均失败，将按历史记录依次尝试")
+        mirrors = rank_mirrors(get_mirror_urls(download_url), load_mirror_stats())
+
+    for name, url in mirrors:
+        print(f"正在从 {name} 下载: {url}")
+        try:
+            response = session.get(url, timeout=timeout, stream=True, verify=verify)
             if response.status_code == 200:
-                print("备用镜像源下载成功")
+                print(f"{name} 下载成功")
                 return response
             else:
-                print(f"备用镜像源下载失败: {response.status_code}")
+                print(f"{name} 下载失败: {response.status_code}")
+                response.close()
         except Exception as e:
-            print(f"备用镜像源下载出错: {str(e)}")
-            continue
+            print(f"{name} 下载出错: {str(e)}")
 
     return None
 
 
-def download_and_extract_update(download_url, temp_dir="temp_update"):
-    """下载并处理更新文件（主要支持exe格式）"""
+def verify_update_file(file_path, expected_size=None, expected_digest=None):
+    """
+    校验下载的文件大小和摘要
+    :param expected_digest: 形如 "sha256:<hex>" 的摘要，为None时只校验大小
+    """
+    if not os.path.isfile(file_path):
+        return False
+    actual_size = os.path.getsize(file_path)
+    if expected_size is not None and actual_size != expected_size:
+        print(f"文件大小不匹配: 期望 {expected_size}，实际 {actual_size}")
+        return False
+    if expected_digest:
+        algorithm, _, expected_hex = expected_digest.partition(":")
+        digest = hashlib.new(algorithm)
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(WRITE_BUFFER_SIZE), b""):
+                digest.update(block)
+        if digest.hexdigest().lower() != expected_hex.lower():
+            print(f"文件摘要不匹配: 期望 {expected_hex}，实际 {digest.hexdigest()}")
+            return False
+    return True
+
+
+def _remove_partial_files(file_path):
+    """删除未完成的分段文件和下载记录"""
+    directory = os.path.dirname(file_path) or "."
+    prefix = os.path.basename(file_path) + ".part"
+    for name in os.listdir(directory):
+        if name.startswith(prefix):
+            os.remove(os.path.join(directory, name))
+    if os.path.exists(file_path + ".json"):
+        os.remove(file_path + ".json")
+
+
+def _download_segment(session, mirrors, part_path, start, end, first_mirror, verify):
+    """
+    下载一个分段，已下载的部分会保留，重新下载时从断点继续
+    失败时依次换用其余下载源
+    """
+    length = end - start + 1
+    for attempt in range(len(mirrors) * 2):
+        have = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if have > length:
+            os.remove(part_path)
+            have = 0
+        if have == length:
+            return
+        mirror = mirrors[(first_mirror + attempt) % len(mirrors)]
+        try:
+            response = session.get(
+                mirror["url"],
+                headers={"Range": f"bytes={start + have}-{end}"},
+                timeout=30,
+                stream=True,
+                verify=verify,
+            )
+            with response:
+                if response.status_code != 206:
+                    raise Exception(f"不支持分段下载: {response.status_code}")
+                with open(part_path, "ab", buffering=WRITE_BUFFER_SIZE) as f:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        f.write(chunk)
+        except Exception as e:
+            print(
+                f"分段 {os.path.basename(part_path)} 从 {mirror['name']} 下载出错: {e}"
+            )
+    if not os.path.exists(part_path) or os.path.getsize(part_path) != length:
+        raise Exception(f"分段 {os.path.basename(part_path)} 下载失败")
+
+
+def download_segmented(session, mirrors, file_path, size, verify=True):
+    """
+    将文件分成多个字节范围并行下载（可分布在多个下载源上），支持断点续传
+    """
+    segment_count = max(1, min(MAX_SEGMENTS, size // MIN_SEGMENT_SIZE))
+    segment_size = -(-size // segment_count)  # 向上取整
+    segments = [
+        (i, i * segment_size, min(size, (i + 1) * segment_size) - 1)
+        for i in range(segment_count)
+    ]
+
+    # 下载记录与本次下载不一致时（换了版本或分段方式），丢弃之前的分段文件
+    state = {"size": size, "segments": segment_count}
+    state_path = file_path + ".json"
+    previous = None
+    if os.path.exists(state_path):
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                previous = json.load(f)
+        except Exception:
+            pass
+    if previous != state:
+        _remove_partial_files(file_path)
+        with open(state_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+    else:
+        print("发现未完成的下载，将从断点继续")
+
+    print(
+        f"正在分 {segment_count} 段下载 {size / 1024 / 1024:.2f} MB，"
+        f"下载源: {', '.join(m['name'] for m in mirrors)}"
+    )
+    with ThreadPoolExecutor(max_workers=segment_count) as executor:
+        futures = [
+            executor.submit(
+                _download_segment,
+                session,
+                mirrors,
+                f"{file_path}.part{i}",
+                start,
+                end,
+                i % len(mirrors),
+                verify,
+            )
+            for i, start, end in segments
+        ]
+        for future in futures:
+            future.result()
+
+    # 合并分段
+    with open(file_path, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+        for i, _, _ in segments:
+            with open(f"{file_path}.part{i}", "rb") as part:
+                shutil.copyfileobj(part, f, WRITE_BUFFER_SIZE)
+    _remove_partial_files(file_path)
+
+
+def download_and_extract_update(
+    download_url,
+    temp_dir="temp_update",
+    expected_size=None,
+    expected_digest=None,
+    filename=None,
+):
+    """
+    下载并处理更新文件（主要支持exe格式）
+    支持分段并行下载和断点续传，下载完成后校验文件大小和摘要，校验失败时返回None
+    """
     try:
-        # 创建临时目录
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        os.makedirs(temp_dir)
+        # 创建临时目录（保留之前未完成的下载以便续传）
+        os.makedirs(temp_dir, exist_ok=True)
+
+        if not filename:
+            filename = download_url.split("/")[-1]
+        file_path = os.path.join(temp_dir, filename)
+
+        # 之前已经完整下载过，直接使用
+        if expected_size and verify_update_file(
+            file_path, expected_size, expected_digest
+        ):
+            print(f"更新文件已存在并通过校验: {file_path}")
+            return file_path
 
         # 下载更新文件
         print("正在下载更新...")
         session = get_requests_session()
-        response = download_with_mirror(download_url, session)
+        mirrors = race_mirrors(download_url)
+        size = expected_size or next((m["size"] for m in mirrors if m["size"]), None)
+        ranged_mirrors = [m for m in mirrors if m["ranges"] and m["size"] == size]
 
-        if response is None:
-            raise Exception("所有下载源都失败了")
+        if size and ranged_mirrors:
+            download_segmented(session, ranged_mirrors, file_path, size)
+        else:
+            # 下载源不支持分段下载时，使用单个连接完整下载
+            response = download_with_mirror(download_url, session, mirrors=mirrors)
 
-        if response.status_code != 200:
-            raise Exception(f"下载失败: {response.status_code}")
+            if response is None:
+                raise Exception("所有下载源都失败了")
 
-        # 从Content-Disposition头部获取文件名，或从URL提取
-        filename = None
-        content_disposition = response.headers.get("content-disposition")
-        if content_disposition:
-            import re
+            if response.status_code != 200:
+                raise Exception(f"下载失败: {response.status_code}")
 
-            fname = re.findall("filename=(.+)", content_disposition)
-            if fname:
-                filename = fname[0].strip('"')
+            # 流式写入文件以处理大文件
+            with response, open(file_path, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    if chunk:  # 过滤掉保持连接的空块
+                        f.write(chunk)
 
-        if not filename:
-            filename = download_url.split("/")[-1]
-
-        file_path = os.path.join(temp_dir, filename)
-
-        # 流式写入文件以处理大文件
-        with open(file_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:  # 过滤掉保持连接的空块
-                    f.write(chunk)
+        if not verify_update_file(file_path, expected_size or size, expected_digest):
+            os.remove(file_path)
+            raise Exception("更新文件校验失败，已删除")
 
         print(f"更新文件已保存到: {file_path}")
         return file_path
@@ -326,6 +693,144 @@ def download_and_extract_update(download_url, temp_dir="temp_update"):
         return None
 
 
+def get_current_exe_path():
+    """获取当前运行的exe程序路径"""
+    # 如果是PyInstaller打包的exe，sys.executable就是exe本身
+    # 如果是Python脚本运行，需要获取main.py所在的目录
+    if getattr(sys, "frozen", False):
+        # PyInstaller打包的情况
+        return sys.executable
+    # Python脚本运行的情况，尝试获取main.py的路径
+    if hasattr(sys, "_MEIPASS"):
+        # 在PyInstaller临时目录中
+        app_dir = os.path.dirname(sys.executable)
+    else:
+        # 正常的Python脚本，从argv获取main.py的位置
+        script_path = sys.argv[0] if sys.argv else "main.py"
+        script_path = os.path.abspath(script_path)
+        app_dir = os.path.dirname(script_path)
+    return os.path.join(app_dir, "main.exe")  # 期望的exe名称
+
+
+def get_release_patches():
+    """
+    获取所有release中发布的增量更新包
+    增量更新包命名为 QRmai-<旧版本>-to-<新版本>.patch（bsdiff4格式），作为新版本release的附件
+    :return: {旧版本: [(新版本, asset信息)]}
+    """
+    session = get_requests_session()
+    response = session.get(f"{GITHUB_API_URL}/releases?per_page=50", timeout=10)
+    if response.status_code != 200:
+        print(f"获取release列表失败: {response.status_code}")
+        return {}
+
+    patches = {}
+    for release in response.json():
+        for asset in release.get("assets", []):
+            match = PATCH_ASSET_PATTERN.match(asset.get("name", ""))
+            if match:
+                patches.setdefault(match.group(1), []).append((match.group(2), asset))
+    return patches
+
+
+def find_patch_chain(current_version, target_version, patches):
+    """
+    查找从当前版本到目标版本的增量更新包链（广度优先，补丁数量最少）
+    :return: asset信息列表，按应用顺序排列；找不到时返回None
+    """
+    queue = [(current_version, [])]
+    visited = {current_version}
+    while queue:
+        version, chain = queue.pop(0)
+        if version == target_version:
+            return chain
+        for next_version, asset in patches.get(version, []):
+            if next_version not in visited:
+                visited.add(next_version)
+                queue.append((next_version, chain + [asset]))
+    return None
+
+
+def download_delta_update(latest_release, temp_dir="temp_update"):
+    """
+    使用增量更新包生成新版本的exe
+    下载从当前版本到最新版本的补丁链，依次应用到当前exe上，并校验结果与完整exe一致。
+    bsdiff的补丁头中记录了结果的大小，当前exe与补丁的源文件不同时也会生成同样大小的错误文件，
+    因此完整exe没有摘要（无法校验结果）时不使用增量更新
+    :return: 生成的exe路径，不能使用增量更新时返回None
+    """
+    if not latest_release.get("download_digest"):
+        print("最新版本的exe没有提供摘要，无法校验增量更新的结果，将下载完整更新")
+        return None
+
+    try:
+        import bsdiff4
+    except ImportError:
+        print("未安装bsdiff4，跳过增量更新")
+        return None
+
+    current_version = get_current_version()
+    current_exe = get_current_exe_path()
+    if current_version == "unknown" or not os.path.isfile(current_exe):
+        print("无法确定当前版本或找不到当前exe，跳过增量更新")
+        return None
+
+    try:
+        chain = find_patch_chain(
+            current_version, latest_release["version"], get_release_patches()
+        )
+        if not chain:
+            print(
+                f"没有从 {current_version} 到 {latest_release['version']} 的增量更新包"
+            )
+            return None
+        print(f"找到增量更新包: {' -> '.join(asset['name'] for asset in chain)}")
+
+        source = current_exe
+        downloaded = 0
+        for i, asset in enumerate(chain):
+            patch_path = download_and_extract_update(
+                asset["browser_download_url"],
+                temp_dir,
+                expected_size=asset.get("size"),
+                expected_digest=asset.get("digest"),
+                filename=asset["name"],
+            )
+            if not patch_path:
+                return None
+            downloaded += os.path.getsize(patch_path)
+            target = os.path.join(temp_dir, f"delta_{i}.exe")
+            bsdiff4.file_patch(source, target, patch_path)
+            if source != current_exe:
+                os.remove(source)
+            os.remove(patch_path)
+            source = target
+
+        file_path = os.path.join(
+            temp_dir,
+            latest_release["download_name"] or f"QRmai-{latest_release['version']}.exe",
+        )
+        os.replace(source, file_path)
+        if not verify_update_file(
+            file_path,
+            latest_release["download_size"],
+            latest_release["download_digest"],
+        ):
+            os.remove(file_path)
+            print("增量更新结果校验失败，将下载完整更新")
+            return None
+
+        full_size = latest_release["download_size"] or os.path.getsize(file_path)
+        print(
+            f"增量更新完成，下载 {downloaded / 1024 / 1024:.2f} MB，"
+            f"比完整下载节省 {(full_size - downloaded) / 1024 / 1024:.2f} MB"
+        )
+        return file_path
+    except Exception as e:
+        print(f"增量更新时出错: {str(e)}，将下载完整更新")
+        return None
+
+
 def apply_update(update_path):
     """应用更新文件（主要支持exe格式）"""
     try:
@@ -338,22 +843,7 @@ def apply_update(update_path):
             # 在Windows上直接替换当前exe文件
             if sys.platform.startswith("win"):
                 # 获取程序所在目录和主程序路径
-                # 如果是PyInstaller打包的exe，sys.executable就是exe本身
-                # 如果是Python脚本运行，需要获取main.py所在的目录
-                if getattr(sys, "frozen", False):
-                    # PyInstaller打包的情况
-                    current_exe = sys.executable
-                else:
-                    # Python脚本运行的情况，尝试获取main.py的路径
-                    if hasattr(sys, "_MEIPASS"):
-                        # 在PyInstaller临时目录中
-                        app_dir = os.path.dirname(sys.executable)
-                    else:
-                        # 正常的Python脚本，从argv获取main.py的位置
-                        script_path = sys.argv[0] if sys.argv else "main.py"
-                        script_path = os.path.abspath(script_path)
-                        app_dir = os.path.dirname(script_path)
-                    current_exe = os.path.join(app_dir, "main.exe")  # 期望的exe名称
+                current_exe = get_current_exe_path()
 
                 print(f"当前程序路径: {current_exe}")
 
@@ -449,11 +939,16 @@ def restart_application():
         print(f"重启应用时出错: {str(e)}")
 
 
-def check_and_update():
-    """检查并自动更新应用"""
-    print("正在检查更新...")
-
-    has_update, latest_release = is_new_version_available()
+def check_and_update(latest_release=None):
+    """
+    检查并自动更新应用
+    :param latest_release: 已经获取到的最新版本信息，为None时重新检查
+    """
+    if latest_release is None:
+        print("正在检查更新...")
+        has_update, latest_release = is_new_version_available()
+    else:
+        has_update = has_newer_version(latest_release)
 
     if has_update and latest_release:
         print(f"发现新版本: {latest_release['version']}")
@@ -465,7 +960,15 @@ def check_and_update():
         # 如果有下载链接，则尝试下载更新
         if latest_release["download_url"]:
             print(f"找到exe下载链接: {latest_release['download_url']}")
-            update_path = download_and_extract_update(latest_release["download_url"])
+            # 优先使用增量更新包，不可用时下载完整的exe
+            update_path = download_delta_update(latest_release)
+            if not update_path:
+                update_path = download_and_extract_update(
+                    latest_release["download_url"],
+                    expected_size=latest_release["download_size"],
+                    expected_digest=latest_release["download_digest"],
+                    filename=latest_release["download_name"],
+                )
             if update_path:
                 # 应用更新
                 if apply_update(update_path):